@@ -8,22 +8,65 @@
 - Боевые эффекты
 - Система лута
 """
+import json
 import random
 import math
 import time
 import logging
-from typing import Dict, Tuple, Optional
-from database import db
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Optional
+from telebot import types
+from combat_effects import SOURCE_MOB, SOURCE_PLAYER, EffectBook, EffectStack
+from combat_sessions import CombatSession, CombatSessionStore
+from telegram_outbox import MessageOutbox
 from player import get_player_data, save_player_data
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+class AliasTable:
+    """Случайный выбор по весам за O(1) (метод псевдонимов Уокера)"""
+
+    def __init__(self, weights: List[float]):
+        n = len(weights)
+        total = sum(weights)
+        self.size = n
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        scaled = [w * n / total for w in weights]
+        small = [i for i, w in enumerate(scaled) if w < 1]
+        large = [i for i, w in enumerate(scaled) if w >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng=random) -> int:
+        i = int(rng.random() * self.size)
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
 class CombatSystem:
+    # Сколько этажей держать в кэше усиленных таблиц мобов
+    MOB_TABLE_CACHE_SIZE = 64
+    # Ограничения автобоя: боев за одну команду и ходов в одном бою
+    AUTO_BATTLE_MAX_FIGHTS = 50
+    AUTO_BATTLE_MAX_TURNS = 100
+
     def __init__(self):
         self.mob_templates = self._load_mob_templates()
+        # LRU таблиц мобов по этажам: (усиленные мобы, таблица выбора), недавние в конце
+        self._mob_tables: "OrderedDict[int, Tuple[List[Dict], AliasTable]]" = OrderedDict()
         self.boss_templates = self._load_boss_templates()
         self.combat_effects = self._load_combat_effects()
+        self.effects = EffectBook(self.combat_effects)
+        # Текущие бои: документ игрока записывается только в конце боя
+        self.sessions = CombatSessionStore(effects=self.effects)
+        # Правки боевых сообщений: схлопывание и лимиты Telegram
+        self.outbox = MessageOutbox()
 
     def _load_mob_templates(self) -> Dict:
         """Загрузка шаблонов мобов из файла"""
@@ -97,7 +140,7 @@ class CombatSystem:
                 bot.reply_to(message, "❌ Ваш персонаж не найден!")
                 return
             
-            if player_data.get("in_combat", False):
+            if self.sessions.get(player_id) is not None:
                 bot.reply_to(message, "❌ Вы уже в бою!")
                 return
             
@@ -111,15 +154,7 @@ class CombatSystem:
                 mob = self._select_mob(player_data.get("floor", 1))
             
             # Начало боя
-            player_data["in_combat"] = True
-            player_data["combat_data"] = {
-                "mob": mob,
-                "mob_hp": mob["hp"],
-                "player_hp": player_data["stats"]["hp"],
-                "effects": [],
-                "turn": 0
-            }
-            save_player_data(player_id, player_data)
+            self.sessions.start(player_id, mob, is_boss, player_data["stats"])
             
             # Отправка сообщения о начале боя
             self._send_combat_message(bot, message, player_data, mob, is_boss)
@@ -128,20 +163,41 @@ class CombatSystem:
             logger.error(f"Ошибка инициализации боя: {e}")
             bot.reply_to(message, "❌ Произошла ошибка при начале боя!")
 
+    @staticmethod
+    def _scale(template: Dict, scale_factor: float) -> Dict:
+        """Копия шаблона с характеристиками, умноженными на scale_factor"""
+        scaled = template.copy()
+        scaled["hp"] = math.ceil(scaled["hp"] * scale_factor)
+        scaled["attack"] = math.ceil(scaled["attack"] * scale_factor)
+        scaled["defense"] = math.ceil(scaled["defense"] * scale_factor)
+        scaled["xp"] = math.ceil(scaled["xp"] * scale_factor)
+        return scaled
+
+    def _get_mob_table(self, floor: int) -> Tuple[List[Dict], AliasTable]:
+        """Усиленные мобы этажа и таблица выбора по весам (считаются один раз на этаж)"""
+        table = self._mob_tables.get(floor)
+        if table is not None:
+            self._mob_tables.move_to_end(floor)
+            return table
+
+        # Усиливаем мобов на высоких этажах
+        scale_factor = 1 + (floor - 1) * 0.2
+        mobs = [self._scale(mob_data, scale_factor) for mob_data in self.mob_templates.values()]
+        weights = [mob_data.get("weight", 1) for mob_data in self.mob_templates.values()]
+        table = (mobs, AliasTable(weights))
+        self._mob_tables[floor] = table
+        if len(self._mob_tables) > self.MOB_TABLE_CACHE_SIZE:
+            self._mob_tables.popitem(last=False)
+        return table
+
     def _select_mob(self, floor: int) -> Dict:
-        """Выбор моба в зависимости от этажа"""
-        mob_pool = []
-        for mob_id, mob_data in self.mob_templates.items():
-            # Усиливаем мобов на высоких этажах
-            scaled_mob = mob_data.copy()
-            scale_factor = 1 + (floor - 1) * 0.2
-            scaled_mob["hp"] = math.ceil(scaled_mob["hp"] * scale_factor)
-            scaled_mob["attack"] = math.ceil(scaled_mob["attack"] * scale_factor)
-            scaled_mob["defense"] = math.ceil(scaled_mob["defense"] * scale_factor)
-            scaled_mob["xp"] = math.ceil(scaled_mob["xp"] * scale_factor)
-            mob_pool.append(scaled_mob)
-        
-        return random.choice(mob_pool)
+        """Выбор моба в зависимости от этажа.
+
+        Возвращает общий для этажа словарь моба: его нельзя изменять,
+        состояние боя хранится в CombatSession.
+        """
+        mobs, alias_table = self._get_mob_table(floor)
+        return mobs[alias_table.sample()]
 
     def _select_boss(self, floor: int) -> Optional[Dict]:
         """Выбор босса в зависимости от этажа"""
@@ -149,16 +205,9 @@ class CombatSystem:
             return None
         
         boss_id = random.choice(list(self.boss_templates.keys()))
-        boss_data = self.boss_templates[boss_id].copy()
         
         # Усиливаем босса на высоких этажах
-        scale_factor = 1 + (floor - 1) * 0.5
-        boss_data["hp"] = math.ceil(boss_data["hp"] * scale_factor)
-        boss_data["attack"] = math.ceil(boss_data["attack"] * scale_factor)
-        boss_data["defense"] = math.ceil(boss_data["defense"] * scale_factor)
-        boss_data["xp"] = math.ceil(boss_data["xp"] * scale_factor)
-        
-        return boss_data
+        return self._scale(self.boss_templates[boss_id], 1 + (floor - 1) * 0.5)
 
     def _send_combat_message(self, bot, message, player_data: Dict, mob: Dict, is_boss: bool) -> None:
         """Отправка сообщения о бое"""
@@ -173,51 +222,90 @@ class CombatSystem:
                 "Выберите действие:"
             )
             
-            markup = types.InlineKeyboardMarkup()
-            markup.row(
-                types.InlineKeyboardButton("🗡 Атаковать", callback_data="combat_attack"),
-                types.InlineKeyboardButton("🛡 Защищаться", callback_data="combat_defend")
-            )
-            markup.row(
-                types.InlineKeyboardButton("🧪 Использовать зелье", callback_data="combat_potion"),
-                types.InlineKeyboardButton("🏃 Бежать", callback_data="combat_flee")
-            )
-            
-            bot.send_message(message.chat.id, combat_text, reply_markup=markup)
+            bot.send_message(message.chat.id, combat_text, reply_markup=self._combat_markup())
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения о бое: {e}")
             raise
 
+    def _combat_markup(self):
+        """Кнопки действий в бою"""
+        markup = types.InlineKeyboardMarkup()
+        markup.row(
+            types.InlineKeyboardButton("🗡 Атаковать", callback_data="combat_attack"),
+            types.InlineKeyboardButton("🛡 Защищаться", callback_data="combat_defend")
+        )
+        markup.row(
+            types.InlineKeyboardButton("🧪 Использовать зелье", callback_data="combat_potion"),
+            types.InlineKeyboardButton("🏃 Бежать", callback_data="combat_flee")
+        )
+        return markup
+
+    def _update_combat_message(self, bot, call, session: CombatSession, mob: Dict, message: str) -> None:
+        """Обновление сообщения о бое после хода.
+
+        Правка идет через очередь: при частых нажатиях в Telegram уходит
+        только последнее состояние боя.
+        """
+        effects = session.player_effects.names(self.effects)
+        mob_effects = session.mob_effects.names(self.effects)
+        combat_text = (
+            f"{message}\n\n"
+            f"{mob['name']}: ❤️ {max(0, session.mob_hp)}/{mob['hp']}"
+            f"{' (' + ', '.join(mob_effects) + ')' if mob_effects else ''}\n"
+            f"Ваше здоровье: {session.player_hp}"
+            f"{' (' + ', '.join(effects) + ')' if effects else ''}\n\n"
+            f"Ход {session.turn + 1}. Выберите действие:"
+        )
+        self.outbox.edit_message_text(
+            bot, call.message.chat.id, call.message.message_id, combat_text,
+            reply_markup=self._combat_markup()
+        )
+        bot.answer_callback_query(call.id)
+
     def process_combat_action(self, bot, call, action: str) -> None:
         """Обработка боевого действия"""
         try:
             player_id = call.from_user.id
-            player_data = get_player_data(player_id)
+            session = self.sessions.get(player_id)
             
-            if not player_data or not player_data.get("in_combat", False):
+            if session is None:
                 bot.answer_callback_query(call.id, "❌ Вы не в бою!")
                 return
             
-            combat_data = player_data["combat_data"]
-            mob = combat_data["mob"]
+            mob = session.mob
+            
+            # Эффекты срабатывают в начале хода
+            player_stunned, mob_stunned, effects_message = self._tick_effects(session)
+            if session.player_hp <= 0:
+                self._end_combat(bot, call, session, False)
+                return
+            if session.mob_hp <= 0:
+                self._end_combat(bot, call, session, True)
+                return
             
             # Обработка действия игрока
             player_damage = 0
             mob_damage = 0
             message = ""
             
-            if action == "attack":
+            if player_stunned:
+                action = "stunned"
+                message = "💫 Вы оглушены и пропускаете ход!"
+            
+            elif action == "attack":
                 player_damage = self._calculate_damage(
-                    player_data["stats"]["attack"],
+                    session.attack,
                     mob["defense"],
-                    critical_chance=player_data["stats"].get("crit_chance", 0.1)
+                    critical_chance=session.crit_chance
                 )
-                combat_data["mob_hp"] -= player_damage
+                session.mob_hp -= player_damage
                 message = f"🗡 Вы атаковали и нанесли {player_damage} урона!"
+                applied = session.mob_effects.apply_hit(self.effects, SOURCE_PLAYER)
+                message += self._effects_text(mob["name"], applied)
             
             elif action == "defend":
                 # Уменьшение получаемого урона в следующем ходу
-                combat_data["defending"] = True
+                session.defending = True
                 message = "🛡 Вы приготовились к защите!"
             
             elif action == "potion":
@@ -226,45 +314,68 @@ class CombatSystem:
                 # Здесь должна быть логика использования зелья
             
             elif action == "flee":
-                flee_chance = 0.5 + player_data["stats"].get("agility", 0) * 0.02
+                flee_chance = 0.5 + session.agility * 0.02
                 if random.random() < flee_chance:
                     message = "🏃‍♂️ Вы успешно сбежали!"
-                    self._end_combat(bot, call, player_id, player_data, False)
+                    self._end_combat(bot, call, session, False)
                     return
                 else:
                     message = "❌ Вам не удалось сбежать!"
             
             # Проверка победы
-            if combat_data["mob_hp"] <= 0:
-                self._end_combat(bot, call, player_id, player_data, True)
+            if session.mob_hp <= 0:
+                self._end_combat(bot, call, session, True)
                 return
             
             # Ход моба (если игрок не защищается)
-            if action != "defend":
+            if action != "defend" and mob_stunned:
+                message += f"\n\n💫 {mob['name']} оглушен и пропускает ход!"
+            elif action != "defend":
                 mob_damage = self._calculate_damage(
                     mob["attack"],
-                    player_data["stats"]["defense"] * (0.5 if combat_data.get("defending", False) else 1)
+                    session.defense * (0.5 if session.defending else 1)
                 )
-                combat_data["player_hp"] -= mob_damage
+                session.player_hp -= mob_damage
                 message += f"\n\n{mob['name']} атаковал и нанес вам {mob_damage} урона!"
+                applied = session.player_effects.apply_hit(self.effects, SOURCE_MOB)
+                message += self._effects_text("Вы", applied)
             
             # Проверка поражения
-            if combat_data["player_hp"] <= 0:
-                self._end_combat(bot, call, player_id, player_data, False)
+            if session.player_hp <= 0:
+                self._end_combat(bot, call, session, False)
                 return
             
-            # Сохранение состояния боя
-            combat_data["turn"] += 1
-            combat_data.pop("defending", None)
-            save_player_data(player_id, player_data)
+            # Состояние боя остается в памяти, документ игрока не записывается
+            session.turn += 1
+            session.defending = False
+            self.sessions.touch(session)
             
             # Отправка обновленного состояния боя
-            self._update_combat_message(bot, call, player_data, mob, message)
+            self._update_combat_message(bot, call, session, mob, effects_message + message)
             
         except Exception as e:
             logger.error(f"Ошибка обработки боевого действия: {e}")
             bot.answer_callback_query(call.id, "❌ Ошибка в бою!")
 
+    def _tick_effects(self, session: CombatSession) -> Tuple[bool, bool, str]:
+        """Сработать эффектам обоих бойцов. Возвращает (игрок пропускает ход, моб пропускает ход, текст)"""
+        player_damage, player_stunned, _ = session.player_effects.tick(self.effects)
+        mob_damage, mob_stunned, _ = session.mob_effects.tick(self.effects)
+        session.player_hp -= player_damage
+        session.mob_hp -= mob_damage
+        
+        lines = []
+        if player_damage:
+            lines.append(f"☠️ Эффекты нанесли вам {player_damage} урона")
+        if mob_damage:
+            lines.append(f"☠️ Эффекты нанесли {session.mob['name']} {mob_damage} урона")
+        return player_stunned, mob_stunned, "".join(line + "\n" for line in lines)
+
+    def _effects_text(self, target: str, applied: List[int]) -> str:
+        if not applied:
+            return ""
+        return f"\n✨ {target}: {', '.join(self.effects.names[effect] for effect in applied)}"
+
     def _calculate_damage(self, attack: int, defense: int, critical_chance: float = 0.0) -> int:
         """Расчет урона с учетом защиты и шанса крита"""
         base_damage = max(1, attack - defense // 2)
@@ -272,26 +383,145 @@ class CombatSystem:
             return base_damage * 2
         return base_damage
 
-    def _end_combat(self, bot, call, player_id: int, player_data: Dict, victory: bool) -> None:
-        """Завершение боя"""
+    def _apply_victory(self, player_data: Dict, mob: Dict) -> Tuple[int, int, List[str]]:
+        """Награда за победу: опыт, золото и добыча (сразу в инвентарь документа игрока)"""
+        xp_gain = mob["xp"]
+        gold_gain = random.randint(*mob["gold"])
+        
+        player_data["stats"]["xp"] += xp_gain
+        player_data["stats"]["gold"] += gold_gain
+        
+        # Проверка лута
+        loot = []
+        if random.random() < mob.get("loot_chance", 0):
+            loot_item = random.choice(mob["loot"])
+            loot.append(loot_item)
+            inventory = player_data.setdefault("inventory", {})
+            inventory[loot_item] = inventory.get(loot_item, 0) + 1
+        return xp_gain, gold_gain, loot
+
+    def _apply_defeat(self, player_data: Dict) -> int:
+        """Поражение - штрафы. Возвращает потерянное золото"""
+        gold_loss = min(player_data["stats"]["gold"], random.randint(10, 50))
+        player_data["stats"]["gold"] -= gold_loss
+        player_data["stats"]["hp"] = max(1, player_data["stats"]["max_hp"] // 2)
+        return gold_loss
+
+    def _resolve_fight(self, stats: Dict, mob: Dict, player_hp: int) -> Tuple[bool, int, int]:
+        """Провести бой целиком по правилам атаки и эффектов из process_combat_action.
+
+        Возвращает (победа, оставшееся здоровье игрока, число ходов). Бой,
+        не закончившийся за AUTO_BATTLE_MAX_TURNS ходов, считается поражением.
+        """
+        attack = stats["attack"]
+        defense = stats["defense"]
+        crit_chance = stats.get("crit_chance", 0.1)
+        mob_hp = mob["hp"]
+        book = self.effects
+        player_effects = EffectStack()
+        mob_effects = EffectStack()
+        for turn in range(1, self.AUTO_BATTLE_MAX_TURNS + 1):
+            player_stunned = mob_stunned = False
+            if player_effects:
+                damage, player_stunned, _ = player_effects.tick(book)
+                player_hp -= damage
+            if mob_effects:
+                damage, mob_stunned, _ = mob_effects.tick(book)
+                mob_hp -= damage
+            if player_hp <= 0:
+                return False, 0, turn
+            if mob_hp <= 0:
+                return True, player_hp, turn
+            
+            if not player_stunned:
+                mob_hp -= self._calculate_damage(attack, mob["defense"], critical_chance=crit_chance)
+                mob_effects.apply_hit(book, SOURCE_PLAYER)
+                if mob_hp <= 0:
+                    return True, player_hp, turn
+            if not mob_stunned:
+                player_hp -= self._calculate_damage(mob["attack"], defense)
+                player_effects.apply_hit(book, SOURCE_MOB)
+                if player_hp <= 0:
+                    return False, 0, turn
+        return False, player_hp, self.AUTO_BATTLE_MAX_TURNS
+
+    def auto_battle(self, bot, message, fights: int) -> None:
+        """Провести до fights боев с мобами подряд без ходов игрока.
+
+        Здоровье переходит из боя в бой, серия прерывается на первом
+        поражении. Все награды записываются в документ игрока одной
+        записью, игрок получает одно итоговое сообщение.
+        """
         try:
-            combat_data = player_data["combat_data"]
-            mob = combat_data["mob"]
+            player_id = message.from_user.id
+            player_data = get_player_data(player_id)
+            
+            if not player_data:
+                bot.reply_to(message, "❌ Ваш персонаж не найден!")
+                return
+            
+            if self.sessions.get(player_id) is not None:
+                bot.reply_to(message, "❌ Вы уже в бою!")
+                return
+            
+            fights = max(1, min(fights, self.AUTO_BATTLE_MAX_FIGHTS))
+            stats = player_data["stats"]
+            floor = player_data.get("floor", 1)
+            player_hp = stats["hp"]
+            wins = 0
+            xp_total = 0
+            gold_total = 0
+            loot_total: Dict[str, int] = {}
+            defeated_by = None
+            
+            for _ in range(fights):
+                mob = self._select_mob(floor)
+                victory, player_hp, _ = self._resolve_fight(stats, mob, player_hp)
+                if not victory:
+                    defeated_by = mob
+                    break
+                wins += 1
+                xp_gain, gold_gain, loot = self._apply_victory(player_data, mob)
+                xp_total += xp_gain
+                gold_total += gold_gain
+                for item in loot:
+                    loot_total[item] = loot_total.get(item, 0) + 1
+            
+            lines = [
+                f"🤖 Автобой: побед {wins} из {fights}\n",
+                f"Получено: {xp_total} опыта и {gold_total} золота",
+                f"Добыча: {', '.join(f'{item} x{count}' for item, count in loot_total.items()) or 'нет'}"
+            ]
+            if defeated_by is None:
+                stats["hp"] = player_hp
+                lines.append(f"❤️ Здоровье: {player_hp}/{stats['max_hp']}")
+            else:
+                gold_loss = self._apply_defeat(player_data)
+                lines.append(
+                    f"\n☠️ Поражение! {defeated_by['name']} победил вас.\n"
+                    f"Вы потеряли {gold_loss} золота и восстановили половину здоровья."
+                )
+            
+            save_player_data(player_id, player_data)
+            bot.send_message(message.chat.id, "\n".join(lines))
+            
+        except Exception as e:
+            logger.error(f"Ошибка автобоя: {e}")
+            bot.reply_to(message, "❌ Произошла ошибка во время автобоя!")
+
+    def _end_combat(self, bot, call, session: CombatSession, victory: bool) -> None:
+        """Завершение боя: единственная запись документа игрока за бой"""
+        try:
+            player_id = session.player_id
+            self.sessions.end(player_id)
+            player_data = get_player_data(player_id)
+            if not player_data:
+                bot.answer_callback_query(call.id, "❌ Ваш персонаж не найден!")
+                return
+            mob = session.mob
             
             if victory:
-                # Награда за победу
-                xp_gain = mob["xp"]
-                gold_gain = random.randint(*mob["gold"])
-                
-                player_data["stats"]["xp"] += xp_gain
-                player_data["stats"]["gold"] += gold_gain
-                
-                # Проверка лута
-                loot = []
-                if random.random() < mob.get("loot_chance", 0):
-                    loot_item = random.choice(mob["loot"])
-                    loot.append(loot_item)
-                    # Добавление предмета в инвентарь (реализовать в player.py)
+                xp_gain, gold_gain, loot = self._apply_victory(player_data, mob)
                 
                 message = (
                     f"🎉 Победа! Вы победили {mob['name']}!\n\n"
@@ -299,27 +529,20 @@ class CombatSystem:
                     f"Добыча: {', '.join(loot) if loot else 'нет'}"
                 )
             else:
-                # Поражение - штрафы
-                gold_loss = min(player_data["stats"]["gold"], random.randint(10, 50))
-                player_data["stats"]["gold"] -= gold_loss
-                player_data["stats"]["hp"] = max(1, player_data["stats"]["max_hp"] // 2)
+                gold_loss = self._apply_defeat(player_data)
                 
                 message = (
                     f"☠️ Поражение! {mob['name']} победил вас.\n\n"
                     f"Вы потеряли {gold_loss} золота и восстановили половину здоровья."
                 )
             
-            # Выход из боя
+            # Выход из боя (поля остались в документах, сохраненных до хранилища боев)
             player_data["in_combat"] = False
             player_data.pop("combat_data", None)
             save_player_data(player_id, player_data)
             
-            # Отправка сообщения о результате боя
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=message
-            )
+            # Отправка сообщения о результате боя (заменяет ожидающие правки хода)
+            self.outbox.edit_message_text(bot, call.message.chat.id, call.message.message_id, message)
             
         except Exception as e:
             logger.error(f"Ошибка завершения боя: {e}")
@@ -331,6 +554,9 @@ combat_system = CombatSystem()
 def initiate_combat(bot, message, is_boss: bool = False):
     combat_system.initiate_combat(bot, message, is_boss)
 
+def auto_battle(bot, message, fights: int = 10):
+    combat_system.auto_battle(bot, message, fights)
+
 def handle_combat_action(bot, call):
     action = call.data.replace("combat_", "")
     combat_system.process_combat_action(bot, call, action)
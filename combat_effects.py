@@ -0,0 +1,123 @@
+"""
+Боевые эффекты (яд, оглушение...):
+- Описания из data/combat_effects.json компилируются в плоские массивы
+- Эффекты на бойце хранятся в компактных массивах номеров и оставшихся ходов
+- Каждый ход эффекты срабатывают и истекают за один проход
+"""
+import random
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+SOURCE_PLAYER = "player"  # эффект накладывает удар игрока
+SOURCE_MOB = "mob"        # эффект накладывает удар моба
+SOURCE_ANY = "any"
+
+class EffectBook:
+    """Скомпилированные описания эффектов: параметры эффекта i лежат в i-х элементах массивов.
+
+    Поля описания в JSON: name, duration (ходов), chance (шанс наложить при
+    ударе), damage_per_turn, miss_turn (пропуск хода), max_stacks (по
+    умолчанию 1) и source (player, mob или any - чей удар накладывает
+    эффект, по умолчанию any).
+    """
+
+    def __init__(self, definitions: Dict[str, Dict]):
+        self.ids: List[str] = list(definitions)
+        self.index: Dict[str, int] = {effect_id: i for i, effect_id in enumerate(self.ids)}
+        self.names: List[str] = [d.get("name", effect_id) for effect_id, d in definitions.items()]
+        self.duration = array('H', (int(d.get("duration", 1)) for d in definitions.values()))
+        self.damage = array('i', (int(d.get("damage_per_turn", 0)) for d in definitions.values()))
+        self.miss_turn = array('b', (bool(d.get("miss_turn", False)) for d in definitions.values()))
+        self.max_stacks = array('H', (int(d.get("max_stacks", 1)) for d in definitions.values()))
+
+        # Эффекты, которые может наложить удар каждой стороны: (номер, шанс)
+        self.on_hit: Dict[str, List[Tuple[int, float]]] = {SOURCE_PLAYER: [], SOURCE_MOB: []}
+        for i, d in enumerate(definitions.values()):
+            chance = float(d.get("chance", 0))
+            if chance <= 0:
+                continue
+            source = d.get("source", SOURCE_ANY)
+            for side in self.on_hit:
+                if source in (side, SOURCE_ANY):
+                    self.on_hit[side].append((i, chance))
+
+class EffectStack:
+    """Эффекты на одном бойце: номер эффекта и оставшиеся ходы, по одному элементу на наложение"""
+    __slots__ = ('effects', 'turns')
+
+    def __init__(self, effects=(), turns=()):
+        self.effects = array('H', effects)
+        self.turns = array('H', turns)
+
+    def __len__(self) -> int:
+        return len(self.effects)
+
+    def add(self, book: EffectBook, effect: int):
+        """Наложить эффект. Сверх max_stacks обновляется самое старое наложение"""
+        first = -1
+        stacks = 0
+        for i, current in enumerate(self.effects):
+            if current == effect:
+                if first < 0:
+                    first = i
+                stacks += 1
+        if stacks >= book.max_stacks[effect]:
+            del self.effects[first]
+            del self.turns[first]
+        self.effects.append(effect)
+        self.turns.append(book.duration[effect])
+
+    def apply_hit(self, book: EffectBook, source: str, rng: random.Random = random) -> List[int]:
+        """Бросить шансы эффектов удара source, вернуть наложенные"""
+        applied = []
+        for effect, chance in book.on_hit[source]:
+            if rng.random() < chance:
+                self.add(book, effect)
+                applied.append(effect)
+        return applied
+
+    def tick(self, book: EffectBook) -> Tuple[int, bool, List[int]]:
+        """Сработать эффектам за ход: (урон, пропуск хода, истекшие).
+
+        Истекшие наложения удаляются тем же проходом, с уплотнением массивов на месте.
+        """
+        damage = 0
+        miss = False
+        expired = []
+        keep = 0
+        effects, turns = self.effects, self.turns
+        for i in range(len(effects)):
+            effect = effects[i]
+            damage += book.damage[effect]
+            if book.miss_turn[effect]:
+                miss = True
+            left = turns[i] - 1
+            if left > 0:
+                effects[keep] = effect
+                turns[keep] = left
+                keep += 1
+            else:
+                expired.append(effect)
+        if keep < len(effects):
+            del effects[keep:]
+            del turns[keep:]
+        return damage, miss, expired
+
+    def names(self, book: EffectBook) -> List[str]:
+        return [book.names[effect] for effect in self.effects]
+
+    def to_list(self, book: EffectBook) -> List[List]:
+        """[id эффектов, оставшиеся ходы]: номера эффектов зависят от порядка в JSON и не сохраняются"""
+        return [[book.ids[effect] for effect in self.effects], list(self.turns)]
+
+    @classmethod
+    def from_list(cls, book: EffectBook, data: Optional[List[List]]) -> 'EffectStack':
+        """Стек из to_list. Эффекты, которых больше нет в описаниях, отбрасываются"""
+        stack = cls()
+        if data:
+            for effect_id, turns in zip(*data):
+                effect = book.index.get(effect_id)
+                if effect is not None:
+                    stack.effects.append(effect)
+                    stack.turns.append(turns)
+        return stack
@@ -0,0 +1,208 @@
+"""
+Хранилище текущих боев с мобами:
+- Состояние боя живет в памяти, а не в документе игрока
+- Брошенные бои снимаются по таймауту
+- Периодический снимок на диск для восстановления после падения
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from combat_effects import EffectBook, EffectStack
+
+logger = logging.getLogger(__name__)
+
+class CombatSession:
+    """Состояние одного боя. mob - общий словарь моба этажа, его нельзя изменять"""
+    __slots__ = ('player_id', 'mob', 'is_boss', 'mob_hp', 'player_hp', 'turn', 'defending',
+                 'attack', 'defense', 'crit_chance', 'agility', 'last_action',
+                 'player_effects', 'mob_effects')
+
+    def __init__(self, player_id: int, mob: Dict, is_boss: bool, mob_hp: int, player_hp: int,
+                 attack: int, defense: int, crit_chance: float, agility: int,
+                 turn: int = 0, defending: bool = False, last_action: float = 0.0,
+                 player_effects: Optional[EffectStack] = None, mob_effects: Optional[EffectStack] = None):
+        self.player_id = player_id
+        self.mob = mob
+        self.is_boss = is_boss
+        self.mob_hp = mob_hp
+        self.player_hp = player_hp
+        self.turn = turn
+        self.defending = defending
+        # Характеристики игрока на начало боя: во время боя документ игрока не меняется
+        self.attack = attack
+        self.defense = defense
+        self.crit_chance = crit_chance
+        self.agility = agility
+        self.last_action = last_action
+        self.player_effects = player_effects or EffectStack()
+        self.mob_effects = mob_effects or EffectStack()
+
+    def to_dict(self, book: EffectBook) -> Dict:
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        data['player_effects'] = self.player_effects.to_list(book)
+        data['mob_effects'] = self.mob_effects.to_list(book)
+        return data
+
+    @classmethod
+    def from_dict(cls, book: EffectBook, data: Dict) -> 'CombatSession':
+        data = dict(data)
+        data['player_effects'] = EffectStack.from_list(book, data.get('player_effects'))
+        data['mob_effects'] = EffectStack.from_list(book, data.get('mob_effects'))
+        return cls(**data)
+
+class CombatSessionStore:
+    """Текущие бои по player_id.
+
+    Сессии лежат в OrderedDict в порядке последнего действия, поэтому
+    истекшие бои снимаются с начала словаря без перебора всех боев.
+    Снимок пишется не чаще snapshot_interval секунд через временный файл
+    и os.replace, чтобы падение во время записи не портило прошлый снимок.
+    Снимок пишет копии боев, сделанные в start и touch, то есть после
+    завершенного хода: поток снимков не видит наполовину примененный ход.
+    Эффекты сохраняются по id, поэтому снимок переживает изменение порядка
+    описаний в data/combat_effects.json.
+    Изменения без последующих действий дописывает фоновый поток: он
+    просыпается раз в snapshot_interval, снимает истекшие бои и пишет
+    снимок, если что-то изменилось. close() пишет последний снимок при
+    остановке бота.
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = "combat_sessions.json", ttl: float = 1800.0,
+                 snapshot_interval: float = 30.0, clock: Callable[[], float] = time.time,
+                 effects: Optional[EffectBook] = None):
+        self.snapshot_path = snapshot_path
+        self.effects = effects if effects is not None else EffectBook({})
+        self.ttl = ttl
+        self.snapshot_interval = snapshot_interval
+        self.clock = clock
+        self.sessions: "OrderedDict[int, CombatSession]" = OrderedDict()
+        self._saved: Dict[int, Dict] = {}  # player_id: копия боя после последнего хода
+        self._last_snapshot = clock()
+        self._dirty = False
+        self._lock = threading.RLock()  # бои меняют потоки обработчиков бота и поток снимков
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.restore()
+
+    def start(self, player_id: int, mob: Dict, is_boss: bool, player_stats: Dict) -> CombatSession:
+        """Начать бой игрока с мобом"""
+        session = CombatSession(
+            player_id, mob, is_boss, mob["hp"], player_stats["hp"],
+            player_stats["attack"], player_stats["defense"],
+            player_stats.get("crit_chance", 0.1), player_stats.get("agility", 0),
+            last_action=self.clock()
+        )
+        with self._lock:
+            self.sessions[player_id] = session
+            self.sessions.move_to_end(player_id)
+            self._saved[player_id] = session.to_dict(self.effects)
+            self._changed()
+        return session
+
+    def get(self, player_id: int) -> Optional[CombatSession]:
+        """Текущий бой игрока (None, если боя нет или он истек)"""
+        with self._lock:
+            self.evict_expired()
+            return self.sessions.get(player_id)
+
+    def touch(self, session: CombatSession):
+        """Отметить действие в бою (после изменения состояния)"""
+        with self._lock:
+            session.last_action = self.clock()
+            self.sessions.move_to_end(session.player_id)
+            self._saved[session.player_id] = session.to_dict(self.effects)
+            self._changed()
+
+    def end(self, player_id: int) -> Optional[CombatSession]:
+        """Завершить бой"""
+        with self._lock:
+            session = self.sessions.pop(player_id, None)
+            self._saved.pop(player_id, None)
+            if session is not None:
+                self._changed()
+        return session
+
+    def evict_expired(self) -> List[CombatSession]:
+        """Снять бои без действий дольше ttl"""
+        with self._lock:
+            deadline = self.clock() - self.ttl
+            evicted = []
+            while self.sessions:
+                session = next(iter(self.sessions.values()))
+                if session.last_action > deadline:
+                    break
+                self.sessions.popitem(last=False)
+                self._saved.pop(session.player_id, None)
+                evicted.append(session)
+            if evicted:
+                logger.info(f"Evicted {len(evicted)} abandoned combat sessions")
+                self._changed()
+        return evicted
+
+    def _changed(self):
+        self._dirty = True
+        if self.clock() - self._last_snapshot >= self.snapshot_interval:
+            self.snapshot()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self.snapshot_path is None or self.snapshot_interval <= 0 or self._stop.is_set():
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="combat-snapshots", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                with self._lock:
+                    self.evict_expired()
+                    self.snapshot()
+            except Exception as e:
+                logger.error(f"Ошибка фонового снимка боев: {e}")
+
+    def snapshot(self):
+        """Записать все текущие бои на диск"""
+        with self._lock:
+            self._last_snapshot = self.clock()
+            if self.snapshot_path is None or not self._dirty:
+                return
+            tmp_path = self.snapshot_path + ".tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump([self._saved[player_id] for player_id in self.sessions], f, ensure_ascii=False)
+                os.replace(tmp_path, self.snapshot_path)
+                self._dirty = False
+            except OSError as e:
+                logger.error(f"Ошибка записи снимка боев: {e}")
+
+    def close(self):
+        """Остановить фоновый поток и записать последний снимок"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.snapshot()
+
+    def restore(self):
+        """Загрузить бои из последнего снимка (истекшие отбрасываются)"""
+        if self.snapshot_path is None:
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Ошибка загрузки снимка боев: {e}")
+            return
+
+        for item in sorted(data, key=lambda item: item["last_action"]):
+            session = CombatSession.from_dict(self.effects, item)
+            self.sessions[session.player_id] = session
+            self._saved[session.player_id] = session.to_dict(self.effects)
+        self.evict_expired()
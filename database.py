@@ -1,6 +1,8 @@
 import sqlite3
+import json
 import logging
-from typing import Optional, Dict, List
+from datetime import datetime
+from typing import Optional, Dict, List, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -152,7 +154,7 @@ class Database:
                     INSERT INTO guilds (name, tag, created_at)
                     VALUES (?, ?, datetime('now'))
                     ''',
-                    (name, tag)
+                    (name, tag))
                 guild_id = cursor.lastrowid
                 
                 # Добавить лидера в гильдию
@@ -310,6 +312,9 @@ class Database:
         self.execute_query('''
             CREATE TABLE IF NOT EXISTS pvp_stats (
                 player_id INTEGER PRIMARY KEY,
+                wins INTEGER DEFAULT 0,
+                losses INTEGER DEFAULT 0,
+                draws INTEGER DEFAULT 0,
                 kills INTEGER DEFAULT 0,
                 deaths INTEGER DEFAULT 0,
                 honor INTEGER DEFAULT 0,
@@ -318,20 +323,278 @@ class Database:
             )
         ''', commit=True)
 
-    def update_pvp_stats(self, player_id: int, kills: int = 0, deaths: int = 0, honor: int = 0):
-        """Обновить PvP статистику игрока"""
+        # Таблицы, созданные до появления арены, не содержат счетчиков боев
+        columns = {row['name'] for row in self.execute_query('PRAGMA table_info(pvp_stats)').fetchall()}
+        for column in ('wins', 'losses', 'draws'):
+            if column not in columns:
+                self.execute_query(f'ALTER TABLE pvp_stats ADD COLUMN {column} INTEGER DEFAULT 0', commit=True)
+
+        # Итоги сезонов: снимок статистики, награды и ход смены сезона
+        self.execute_query('''
+            CREATE TABLE IF NOT EXISTS pvp_season_archive (
+                season TEXT NOT NULL,
+                player_id INTEGER NOT NULL,
+                wins INTEGER DEFAULT 0,
+                losses INTEGER DEFAULT 0,
+                draws INTEGER DEFAULT 0,
+                kills INTEGER DEFAULT 0,
+                deaths INTEGER DEFAULT 0,
+                honor INTEGER DEFAULT 0,
+                PRIMARY KEY (season, player_id)
+            )
+        ''', commit=True)
+        self.execute_query('''
+            CREATE INDEX IF NOT EXISTS idx_pvp_season_archive_honor
+            ON pvp_season_archive(season, honor DESC, player_id)
+        ''', commit=True)
+
+        self.execute_query('''
+            CREATE TABLE IF NOT EXISTS seasonal_rewards (
+                season TEXT NOT NULL,
+                player_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                rewards TEXT NOT NULL,
+                PRIMARY KEY (season, player_id)
+            )
+        ''', commit=True)
+
+        self.execute_query('''
+            CREATE TABLE IF NOT EXISTS pvp_season_rollover (
+                season TEXT PRIMARY KEY,
+                last_player_id INTEGER,
+                started_at TEXT NOT NULL,
+                finished_at TEXT
+            )
+        ''', commit=True)
+
+        self.execute_query('''
+            CREATE TABLE IF NOT EXISTS pvp_ratings (
+                player_id INTEGER NOT NULL,
+                arena_type TEXT NOT NULL,
+                rating REAL NOT NULL,
+                rd REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (arena_type, player_id)
+            )
+        ''', commit=True)
+
+        # Вызовы на дуэль: AUTOINCREMENT не выдает номер повторно
+        self.execute_query('''
+            CREATE TABLE IF NOT EXISTS pvp_duels (
+                duel_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                challenger_id INTEGER NOT NULL,
+                target_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                bet INTEGER DEFAULT 0,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''', commit=True)
+        self.execute_query('''
+            CREATE INDEX IF NOT EXISTS idx_pvp_duels_expires ON pvp_duels(expires_at)
+        ''', commit=True)
+
+    def get_unfinished_pvp_rollover(self) -> Optional[Dict]:
+        """Получить незавершенную смену сезона (если прервалась)"""
+        cursor = self.execute_query(
+            'SELECT * FROM pvp_season_rollover WHERE finished_at IS NULL ORDER BY started_at LIMIT 1')
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def start_pvp_rollover(self, season: str) -> Dict:
+        """Начать смену сезона (или вернуть уже начатую)"""
         self.execute_query(
+            'INSERT OR IGNORE INTO pvp_season_rollover (season, started_at) VALUES (?, ?)',
+            (season, datetime.now().isoformat()),
+            commit=True)
+        cursor = self.execute_query('SELECT * FROM pvp_season_rollover WHERE season = ?', (season,))
+        return dict(cursor.fetchone())
+
+    def archive_pvp_stats_chunk(self, season: str, after_player_id: Optional[int], limit: int) -> Optional[int]:
+        """Перенести в архив и обнулить следующую пачку игроков.
+
+        Архив, обнуление и отметка прогресса идут одной транзакцией, поэтому
+        прерванную смену сезона можно продолжить с last_player_id. Возвращает
+        последний обработанный player_id или None, если игроков не осталось.
+        """
+        after = after_player_id if after_player_id is not None else -1
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''
+                SELECT MAX(player_id) FROM (
+                    SELECT player_id FROM pvp_stats WHERE player_id > ? ORDER BY player_id LIMIT ?
+                )
+                ''',
+                (after, limit))
+            last = cursor.fetchone()[0]
+            if last is None:
+                return None
+
+            cursor.execute(
+                '''
+                INSERT OR IGNORE INTO pvp_season_archive
+                (season, player_id, wins, losses, draws, kills, deaths, honor)
+                SELECT ?, player_id, wins, losses, draws, kills, deaths, honor
+                FROM pvp_stats WHERE player_id > ? AND player_id <= ?
+                ''',
+                (season, after, last))
+            cursor.execute(
+                'UPDATE pvp_stats SET wins = 0, losses = 0, draws = 0 WHERE player_id > ? AND player_id <= ?',
+                (after, last))
+            cursor.execute(
+                'UPDATE pvp_season_rollover SET last_player_id = ? WHERE season = ?',
+                (last, season))
+            conn.commit()
+        return last
+
+    def get_season_standings(self, season: str, limit: int) -> List[Tuple[int, int]]:
+        """Итоговая таблица сезона из архива: (player_id, честь)"""
+        cursor = self.execute_query(
+            '''
+            SELECT player_id, honor FROM pvp_season_archive
+            WHERE season = ? ORDER BY honor DESC, player_id LIMIT ?
+            ''',
+            (season, limit))
+        return [(row['player_id'], row['honor']) for row in cursor.fetchall()]
+
+    def save_season_rewards(self, season: str, rows: List[Tuple[int, int, Dict]]):
+        """Сохранить награды сезона (player_id, место, награды) одной транзакцией"""
+        with self.get_connection() as conn:
+            conn.executemany(
+                '''
+                INSERT OR IGNORE INTO seasonal_rewards (season, player_id, position, rewards)
+                VALUES (?, ?, ?, ?)
+                ''',
+                [(season, player_id, position, json.dumps(rewards)) for player_id, position, rewards in rows])
+            conn.commit()
+
+    def finish_pvp_rollover(self, season: str):
+        """Отметить смену сезона завершенной"""
+        self.execute_query(
+            'UPDATE pvp_season_rollover SET finished_at = ? WHERE season = ?',
+            (datetime.now().isoformat(), season),
+            commit=True)
+
+    def get_pvp_honor(self) -> List[Tuple[int, int]]:
+        """Получить честь всех игроков (для построения рейтинга)"""
+        cursor = self.execute_query('SELECT player_id, honor FROM pvp_stats')
+        return [(row['player_id'], row['honor']) for row in cursor.fetchall()]
+
+    def get_pvp_stats_for(self, player_ids: List[int]) -> Dict[int, Dict]:
+        """Получить PvP статистику указанных игроков"""
+        if not player_ids:
+            return {}
+        placeholders = ','.join('?' * len(player_ids))
+        cursor = self.execute_query(
+            f'SELECT * FROM pvp_stats WHERE player_id IN ({placeholders})', tuple(player_ids))
+        return {row['player_id']: dict(row) for row in cursor.fetchall()}
+
+    def get_pvp_ratings(self, arena_type: str, player_ids: List[int]) -> Dict[int, Dict]:
+        """Получить рейтинги игроков на арене"""
+        if not player_ids:
+            return {}
+        placeholders = ','.join('?' * len(player_ids))
+        cursor = self.execute_query(
+            f'''
+            SELECT player_id, rating, rd, updated_at FROM pvp_ratings
+            WHERE arena_type = ? AND player_id IN ({placeholders})
+            ''',
+            (arena_type, *player_ids))
+        return {row['player_id']: dict(row) for row in cursor.fetchall()}
+
+    def save_pvp_ratings(self, rows: List[Tuple[int, str, float, float, float]]):
+        """Сохранить рейтинги (player_id, arena_type, rating, rd, updated_at) одной транзакцией"""
+        with self.get_connection() as conn:
+            conn.executemany(
+                '''
+                INSERT INTO pvp_ratings (player_id, arena_type, rating, rd, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(arena_type, player_id) DO UPDATE SET
+                    rating = excluded.rating, rd = excluded.rd, updated_at = excluded.updated_at
+                ''',
+                rows)
+
+    def create_pvp_duel(self, challenger_id: int, target_id: int, bet: int,
+                        created_at: float, expires_at: float) -> int:
+        """Сохранить вызов на дуэль, вернуть его номер"""
+        cursor = self.execute_query(
             '''
-            INSERT OR REPLACE INTO pvp_stats 
-            (player_id, kills, deaths, honor, last_pvp_time)
-            VALUES (?, 
-                COALESCE((SELECT kills FROM pvp_stats WHERE player_id = ?), 0) + ?,
-                COALESCE((SELECT deaths FROM pvp_stats WHERE player_id = ?), 0) + ?,
-                COALESCE((SELECT honor FROM pvp_stats WHERE player_id = ?), 0) + ?,
-                datetime('now'))
+            INSERT INTO pvp_duels (challenger_id, target_id, bet, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
             ''',
-            (player_id, player_id, kills, player_id, deaths, player_id, honor),
+            (challenger_id, target_id, bet, created_at, expires_at),
             commit=True)
+        return cursor.lastrowid
+
+    def get_pvp_duel(self, duel_id: int) -> Optional[Dict]:
+        """Получить вызов на дуэль"""
+        cursor = self.execute_query('SELECT * FROM pvp_duels WHERE duel_id = ?', (duel_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def get_pending_pvp_duels(self, now: float) -> List[Dict]:
+        """Получить неистекшие ожидающие вызовы"""
+        cursor = self.execute_query(
+            "SELECT * FROM pvp_duels WHERE status = 'pending' AND expires_at > ? ORDER BY duel_id",
+            (now,))
+        return [dict(row) for row in cursor.fetchall()]
+
+    def claim_pvp_duel(self, duel_id: int) -> bool:
+        """Перевести вызов из ожидания в бой. False, если его уже принял другой процесс"""
+        cursor = self.execute_query(
+            "UPDATE pvp_duels SET status = 'active' WHERE duel_id = ? AND status = 'pending'",
+            (duel_id,),
+            commit=True)
+        return cursor.rowcount == 1
+
+    def release_pvp_duel(self, duel_id: int) -> bool:
+        """Вернуть принятый вызов в ожидание (дуэль не состоялась)"""
+        cursor = self.execute_query(
+            "UPDATE pvp_duels SET status = 'pending' WHERE duel_id = ? AND status = 'active'",
+            (duel_id,),
+            commit=True)
+        return cursor.rowcount == 1
+
+    def delete_pvp_duels(self, duel_ids: List[int]):
+        """Удалить вызовы одной транзакцией"""
+        with self.get_connection() as conn:
+            conn.executemany('DELETE FROM pvp_duels WHERE duel_id = ?', [(duel_id,) for duel_id in duel_ids])
+
+    def delete_expired_pvp_duels(self, now: float) -> int:
+        """Удалить истекшие ожидающие вызовы"""
+        cursor = self.execute_query(
+            "DELETE FROM pvp_duels WHERE status = 'pending' AND expires_at <= ?",
+            (now,),
+            commit=True)
+        return cursor.rowcount
+
+    def update_pvp_stats(self, player_id: int, kills: int = 0, deaths: int = 0, honor: int = 0):
+        """Обновить PvP статистику игрока"""
+        self.apply_pvp_stat_deltas([(player_id, 0, 0, 0, kills, deaths, honor, datetime.now().isoformat())])
+
+    def apply_pvp_stat_deltas(self, rows: List[Tuple]):
+        """Прибавить изменения статистики одной транзакцией.
+
+        Строка: (player_id, wins, losses, draws, kills, deaths, honor, last_pvp_time).
+        """
+        with self.get_connection() as conn:
+            conn.executemany(
+                '''
+                INSERT INTO pvp_stats
+                (player_id, wins, losses, draws, kills, deaths, honor, last_pvp_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(player_id) DO UPDATE SET
+                    wins = wins + excluded.wins,
+                    losses = losses + excluded.losses,
+                    draws = draws + excluded.draws,
+                    kills = kills + excluded.kills,
+                    deaths = deaths + excluded.deaths,
+                    honor = honor + excluded.honor,
+                    last_pvp_time = excluded.last_pvp_time
+                ''',
+                rows)
+            conn.commit()
 
     # Методы для работы с рейдами
     def init_raid_tables(self):
@@ -360,45 +623,127 @@ class Database:
             )
         ''', commit=True)
 
+        self.execute_query('''
+            CREATE TABLE IF NOT EXISTS raid_loot (
+                raid_id TEXT NOT NULL,
+                player_id INTEGER NOT NULL,
+                item_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                PRIMARY KEY (raid_id, player_id, item_id)
+            )
+        ''', commit=True)
+
+        # Долг добычи: число побед над боссом без награды (защита от невезения)
+        self.execute_query('''
+            CREATE TABLE IF NOT EXISTS raid_loot_debt (
+                player_id INTEGER NOT NULL,
+                boss_id TEXT NOT NULL,
+                debt INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (boss_id, player_id)
+            )
+        ''', commit=True)
+
+    def get_loot_debts(self, boss_id: str, player_ids: List[int]) -> Dict[int, int]:
+        """Получить долги добычи игроков по боссу"""
+        if not player_ids:
+            return {}
+        placeholders = ','.join('?' * len(player_ids))
+        cursor = self.execute_query(
+            f'SELECT player_id, debt FROM raid_loot_debt WHERE boss_id = ? AND player_id IN ({placeholders})',
+            (boss_id, *player_ids))
+        return {row['player_id']: row['debt'] for row in cursor.fetchall()}
+
     def save_raid_result(self, raid_data: Dict):
         """Сохранить результаты рейда"""
+        self.save_raid_results([raid_data])
+
+    def save_raid_results(self, results: List[Dict]) -> List[Dict]:
+        """Сохранить результаты нескольких рейдов одной транзакцией.
+
+        Каждый рейд пишется в своей точке сохранения: ошибка в одном рейде
+        откатывает только его строки, остальные фиксируются. Возвращает
+        результаты, которые записать не удалось.
+        """
+        failed = []
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            # Сохранить основную информацию о рейде
-            cursor.execute(
-                '''
-                INSERT INTO raid_history 
-                (raid_id, boss_id, difficulty, start_time, end_time, status)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ''',
+            # Без явного BEGIN первая точка сохранения сама открывает транзакцию,
+            # и ее RELEASE фиксировал бы каждый рейд отдельно
+            if not conn.in_transaction:
+                cursor.execute('BEGIN')
+            for raid_data in results:
+                cursor.execute('SAVEPOINT raid_result')
+                try:
+                    self._insert_raid_result(cursor, raid_data)
+                    cursor.execute('RELEASE SAVEPOINT raid_result')
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to save raid {raid_data.get('raid_id')}: {e}")
+                    cursor.execute('ROLLBACK TO SAVEPOINT raid_result')
+                    cursor.execute('RELEASE SAVEPOINT raid_result')
+                    failed.append(raid_data)
+            conn.commit()
+        return failed
+
+    def _insert_raid_result(self, cursor, raid_data: Dict):
+        # Основная информация о рейде
+        cursor.execute(
+            '''
+            INSERT INTO raid_history 
+            (raid_id, boss_id, difficulty, start_time, end_time, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            (
+                raid_data['raid_id'],
+                raid_data['boss_id'],
+                raid_data['difficulty'],
+                raid_data['start_time'],
+                raid_data['end_time'],
+                raid_data['status']
+            ))
+        
+        # Данные участников
+        cursor.executemany(
+            '''
+            INSERT INTO raid_participants 
+            (raid_id, player_id, role, damage_done, healing_done, loot_received)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            [
                 (
                     raid_data['raid_id'],
-                    raid_data['boss_id'],
-                    raid_data['difficulty'],
-                    raid_data['start_time'],
-                    raid_data['end_time'],
-                    raid_data['status']
-                ))
-            
-            # Сохранить данные участников
-            for participant in raid_data['participants']:
-                cursor.execute(
-                    '''
-                    INSERT INTO raid_participants 
-                    (raid_id, player_id, role, damage_done, healing_done, loot_received)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    ''',
-                    (
-                        raid_data['raid_id'],
-                        participant['player_id'],
-                        participant['role'],
-                        participant.get('damage_done', 0),
-                        participant.get('healing_done', 0),
-                        json.dumps(participant.get('loot_received', []))
-                    ))
-            
-            conn.commit()
+                    participant['player_id'],
+                    participant['role'],
+                    participant.get('damage_done', 0),
+                    participant.get('healing_done', 0),
+                    json.dumps(participant.get('loot_received', []))
+                )
+                for participant in raid_data['participants']
+            ])
+
+        # Добыча
+        cursor.executemany(
+            '''
+            INSERT INTO raid_loot 
+            (raid_id, player_id, item_id, timestamp)
+            VALUES (?, ?, ?, ?)
+            ''',
+            [
+                (raid_data['raid_id'], participant['player_id'], item_id, raid_data['end_time'])
+                for participant in raid_data['participants']
+                for item_id in participant.get('loot_received', [])
+            ])
+
+        # Долги добычи
+        cursor.executemany(
+            '''
+            INSERT INTO raid_loot_debt (player_id, boss_id, debt)
+            VALUES (?, ?, ?)
+            ON CONFLICT(boss_id, player_id) DO UPDATE SET debt = excluded.debt
+            ''',
+            [
+                (player_id, raid_data['boss_id'], debt)
+                for player_id, debt in raid_data.get('loot_debts', {}).items()
+            ])
 
     # Методы для работы с экономикой
     def init_economy_tables(self):
@@ -1,9 +1,15 @@
+import atexit
+import heapq
 import logging
-from typing import Dict, List, Optional, Tuple
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
 from datetime import datetime, timedelta
 from dataclasses import dataclass
 from enum import Enum, auto
 from database import Database
+from ranking import RankedIndex
 
 logger = logging.getLogger(__name__)
 
@@ -28,10 +34,27 @@ class GuildBankItem:
     deposited_by: int
     deposited_at: datetime
 
+def find_member_guild_id(db: Database, user_id: int) -> Optional[int]:
+    """Найти ID гильдии игрока в БД"""
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT guild_id FROM guild_members WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
 class Guild:
-    def __init__(self, db: Database, guild_id: int):
+    def __init__(self, db: Database, guild_id: int, member_index: Optional[Dict[int, int]] = None,
+                 autoload: bool = True, bank_service: Optional["GuildBankService"] = None,
+                 leaderboard: Optional["GuildLeaderboard"] = None):
         self.db = db
         self.guild_id = guild_id
+        # Если задан, операции с банком идут напрямую в БД через сервис
+        self.bank_service = bank_service
+        # Рейтинг гильдий, который нужно уведомлять об изменении очков
+        self.leaderboard = leaderboard
+        # Общий индекс user_id -> guild_id, которым владеет GuildManager.
+        # None - игрок исключен, но удаление еще не записано в БД
+        self.member_index: Dict[int, Optional[int]] = member_index if member_index is not None else {}
         self.name: str = ""
         self.tag: str = ""
         self.level: int = 1
@@ -39,9 +62,24 @@ class Guild:
         self.members: Dict[int, GuildMember] = {}
         self.bank: Dict[str, GuildBankItem] = {}
         self.bank_balance: int = 0
+        self.total_contribution: int = 0
         self.created_at: datetime = datetime.now()
         self.motd: str = ""
-        self.load_guild_data()
+        # Измененные и удаленные строки, которые нужно записать при сохранении
+        self._dirty_members: Set[int] = set()
+        self._removed_members: Set[int] = set()
+        self._dirty_bank: Set[str] = set()
+        self._removed_bank: Set[str] = set()
+        self.write_stats: Dict[str, int] = {
+            'saves': 0,
+            'member_upserts': 0,
+            'member_deletes': 0,
+            'bank_upserts': 0,
+            'bank_deletes': 0
+        }
+        self._saved_info: Optional[Tuple] = None
+        if autoload:
+            self.load_guild_data()
 
     def load_guild_data(self):
         """Загрузить данные гильдии из БД"""
@@ -54,8 +92,6 @@ class Guild:
             
             if not guild_data:
                 raise ValueError(f"Guild with ID {self.guild_id} not found")
-                
-            self.name, self.tag, self.level, self.exp, self.created_at, self.motd = guild_data
             
             # Участники гильдии
             cursor.execute("""
@@ -63,15 +99,7 @@ class Guild:
                 FROM guild_members 
                 WHERE guild_id = ?
             """, (self.guild_id,))
-            
-            for row in cursor.fetchall():
-                self.members[row[0]] = GuildMember(
-                    user_id=row[0],
-                    rank=GuildRank(row[1]),
-                    joined_at=datetime.fromisoformat(row[2]),
-                    contribution=row[3],
-                    last_online=datetime.fromisoformat(row[4])
-                )
+            member_rows = cursor.fetchall()
             
             # Банк гильдии
             cursor.execute("""
@@ -79,79 +107,193 @@ class Guild:
                 FROM guild_bank 
                 WHERE guild_id = ?
             """, (self.guild_id,))
-            
-            for row in cursor.fetchall():
-                self.bank[row[0]] = GuildBankItem(
-                    item_id=row[0],
-                    quantity=row[1],
-                    deposited_by=row[2],
-                    deposited_at=datetime.fromisoformat(row[3])
-                )
+            bank_rows = cursor.fetchall()
             
             # Баланс гильдии
             cursor.execute("SELECT balance FROM guild_bank_balance WHERE guild_id = ?", (self.guild_id,))
             balance = cursor.fetchone()
-            self.bank_balance = balance[0] if balance else 0
+
+        self.apply_rows(guild_data, member_rows, bank_rows, balance[0] if balance else 0)
+
+    def apply_rows(self, guild_data: Tuple, member_rows: List[Tuple], bank_rows: List[Tuple], balance: int):
+        """Заполнить гильдию из строк БД (используется и при пакетной загрузке)"""
+        self.name, self.tag, self.level, self.exp, self.created_at, self.motd = guild_data
+
+        for user_id in self.members:
+            if self.member_index.get(user_id) == self.guild_id:
+                del self.member_index[user_id]
+        self.members = {}
+        for row in member_rows:
+            self.members[row[0]] = GuildMember(
+                user_id=row[0],
+                rank=GuildRank(row[1]),
+                joined_at=datetime.fromisoformat(row[2]),
+                contribution=row[3],
+                last_online=datetime.fromisoformat(row[4])
+            )
+            self.member_index[row[0]] = self.guild_id
+
+        self.bank = {}
+        for row in bank_rows:
+            self.bank[row[0]] = GuildBankItem(
+                item_id=row[0],
+                quantity=row[1],
+                deposited_by=row[2],
+                deposited_at=datetime.fromisoformat(row[3])
+            )
+
+        self.bank_balance = balance
+        self.total_contribution = sum(member.contribution for member in self.members.values())
+        self._saved_info = self._info_snapshot()
+        self._clear_dirty()
+
+    def _info_snapshot(self) -> Tuple:
+        return (self.name, self.tag, self.level, self.exp, self.motd, self.bank_balance)
+
+    def has_unsaved_changes(self) -> bool:
+        """Есть ли изменения, еще не записанные в БД"""
+        return bool(
+            self._dirty_members or self._removed_members or
+            self._dirty_bank or self._removed_bank or
+            self._info_snapshot() != self._saved_info
+        )
+
+    def mark_member_dirty(self, user_id: int):
+        """Пометить участника как измененного для следующего сохранения"""
+        if user_id in self.members:
+            self._dirty_members.add(user_id)
+            self._removed_members.discard(user_id)
+
+    def mark_bank_item_dirty(self, item_id: str):
+        """Пометить предмет банка как измененный для следующего сохранения"""
+        if item_id in self.bank:
+            self._dirty_bank.add(item_id)
+            self._removed_bank.discard(item_id)
+
+    def _clear_dirty(self):
+        self._dirty_members.clear()
+        self._removed_members.clear()
+        self._dirty_bank.clear()
+        self._removed_bank.clear()
 
     def save_guild_data(self):
-        """Сохранить данные гильдии в БД"""
+        """Сохранить изменения гильдии в БД
+
+        Пишутся только строки участников и банка, измененные с момента
+        последней загрузки или сохранения. Все изменения применяются
+        одной транзакцией.
+        """
+        member_rows = [
+            (
+                self.guild_id,
+                member.user_id,
+                member.rank.value,
+                member.joined_at.isoformat(),
+                member.contribution,
+                member.last_online.isoformat()
+            )
+            for member in (self.members[user_id] for user_id in self._dirty_members)
+        ]
+        bank_rows = [
+            (
+                self.guild_id,
+                item.item_id,
+                item.quantity,
+                item.deposited_by,
+                item.deposited_at.isoformat()
+            )
+            for item in (self.bank[item_id] for item_id in self._dirty_bank)
+        ]
+        removed_members = [(self.guild_id, user_id) for user_id in self._removed_members]
+        removed_bank = [(self.guild_id, item_id) for item_id in self._removed_bank]
+        info = self._info_snapshot()
+        info_changed = info != self._saved_info
+
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
             
             # Основная информация
-            cursor.execute("""
-                UPDATE guilds 
-                SET name = ?, tag = ?, level = ?, exp = ?, motd = ?
-                WHERE id = ?
-            """, (self.name, self.tag, self.level, self.exp, self.motd, self.guild_id))
-            
-            # Удалить старых участников
-            cursor.execute("DELETE FROM guild_members WHERE guild_id = ?", (self.guild_id,))
-            
-            # Добавить текущих участников
-            for member in self.members.values():
+            if info_changed:
                 cursor.execute("""
+                    UPDATE guilds 
+                    SET name = ?, tag = ?, level = ?, exp = ?, motd = ?
+                    WHERE id = ?
+                """, (self.name, self.tag, self.level, self.exp, self.motd, self.guild_id))
+            
+            # Участники гильдии
+            if removed_members:
+                cursor.executemany(
+                    "DELETE FROM guild_members WHERE guild_id = ? AND user_id = ?",
+                    removed_members
+                )
+            if member_rows:
+                cursor.executemany("""
                     INSERT INTO guild_members 
                     (guild_id, user_id, rank, joined_at, contribution, last_online)
                     VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    self.guild_id,
-                    member.user_id,
-                    member.rank.value,
-                    member.joined_at.isoformat(),
-                    member.contribution,
-                    member.last_online.isoformat()
-                ))
+                    ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                        rank = excluded.rank,
+                        joined_at = excluded.joined_at,
+                        contribution = excluded.contribution,
+                        last_online = excluded.last_online
+                """, member_rows)
             
             # Банк гильдии
-            cursor.execute("DELETE FROM guild_bank WHERE guild_id = ?", (self.guild_id,))
-            
-            for item in self.bank.values():
-                cursor.execute("""
+            if removed_bank:
+                cursor.executemany(
+                    "DELETE FROM guild_bank WHERE guild_id = ? AND item_id = ?",
+                    removed_bank
+                )
+            if bank_rows:
+                cursor.executemany("""
                     INSERT INTO guild_bank 
                     (guild_id, item_id, quantity, deposited_by, deposited_at)
                     VALUES (?, ?, ?, ?, ?)
-                """, (
-                    self.guild_id,
-                    item.item_id,
-                    item.quantity,
-                    item.deposited_by,
-                    item.deposited_at.isoformat()
-                ))
+                    ON CONFLICT (guild_id, item_id) DO UPDATE SET
+                        quantity = excluded.quantity,
+                        deposited_by = excluded.deposited_by,
+                        deposited_at = excluded.deposited_at
+                """, bank_rows)
             
             # Баланс
-            cursor.execute("""
-                INSERT OR REPLACE INTO guild_bank_balance 
-                (guild_id, balance) 
-                VALUES (?, ?)
-            """, (self.guild_id, self.bank_balance))
+            if info_changed:
+                cursor.execute("""
+                    INSERT OR REPLACE INTO guild_bank_balance 
+                    (guild_id, balance) 
+                    VALUES (?, ?)
+                """, (self.guild_id, self.bank_balance))
             
             conn.commit()
 
+        # Статистика записи для контроля write amplification
+        self.write_stats['saves'] += 1
+        self.write_stats['member_upserts'] += len(member_rows)
+        self.write_stats['member_deletes'] += len(removed_members)
+        self.write_stats['bank_upserts'] += len(bank_rows)
+        self.write_stats['bank_deletes'] += len(removed_bank)
+        logger.debug(
+            f"Guild {self.guild_id} saved: {len(member_rows)} member upserts, "
+            f"{len(removed_members)} member deletes, {len(bank_rows)} bank upserts, "
+            f"{len(removed_bank)} bank deletes"
+        )
+        self._saved_info = info
+        for user_id in self._removed_members:
+            if user_id in self.member_index and self.member_index[user_id] is None:
+                del self.member_index[user_id]
+        self._clear_dirty()
+
     def add_member(self, user_id: int, rank: GuildRank = GuildRank.RECRUIT) -> bool:
         """Добавить нового участника в гильдию"""
         if user_id in self.members:
             return False
+
+        # Игрок не может состоять в двух гильдиях одновременно
+        if user_id in self.member_index:
+            guild_id = self.member_index[user_id]
+        else:
+            guild_id = find_member_guild_id(self.db, user_id)
+        if guild_id is not None and guild_id != self.guild_id:
+            return False
             
         if len(self.members) >= self.get_max_members():
             return False
@@ -163,6 +305,8 @@ class Guild:
             contribution=0,
             last_online=datetime.now()
         )
+        self.member_index[user_id] = self.guild_id
+        self.mark_member_dirty(user_id)
         return True
 
     def remove_member(self, user_id: int) -> bool:
@@ -170,7 +314,13 @@ class Guild:
         if user_id not in self.members:
             return False
             
-        del self.members[user_id]
+        self.total_contribution -= self.members.pop(user_id).contribution
+        self._dirty_members.discard(user_id)
+        self._removed_members.add(user_id)
+        if self.member_index.get(user_id) == self.guild_id:
+            # Строка в БД удалится при сохранении, до тех пор БД не спрашиваем
+            self.member_index[user_id] = None
+        self._score_changed()
         return True
 
     def promote_member(self, user_id: int) -> bool:
@@ -183,6 +333,7 @@ class Guild:
             return False
             
         self.members[user_id].rank = GuildRank(current_rank.value + 1)
+        self.mark_member_dirty(user_id)
         return True
 
     def demote_member(self, user_id: int) -> bool:
@@ -195,6 +346,7 @@ class Guild:
             return False
             
         self.members[user_id].rank = GuildRank(current_rank.value - 1)
+        self.mark_member_dirty(user_id)
         return True
 
     def get_max_members(self) -> int:
@@ -208,19 +360,49 @@ class Guild:
         
         if self.exp >= required_exp:
             self.level_up()
+        else:
+            self._score_changed()
 
     def level_up(self):
         """Повысить уровень гильдии"""
         self.level += 1
         self.exp = 0
+        self._score_changed()
         # Можно добавить уведомления и награды за повышение уровня
 
+    def add_contribution(self, user_id: int, amount: int, persisted: bool = False):
+        """Увеличить вклад участника
+
+        persisted=True означает, что значение в БД уже обновлено
+        (например, сервисом банка) и участника не нужно помечать измененным.
+        """
+        if user_id not in self.members:
+            return
+        self.members[user_id].contribution += amount
+        self.total_contribution += amount
+        if not persisted:
+            self.mark_member_dirty(user_id)
+        self._score_changed()
+
+    def _score_changed(self):
+        if self.leaderboard is not None:
+            self.leaderboard.update(self.guild_id, self.level, self.exp, self.total_contribution)
+
     def get_exp_for_next_level(self) -> int:
         """Получить необходимое количество опыта для следующего уровня"""
         return 1000 * (2 ** (self.level - 1))
 
     def deposit_to_bank(self, user_id: int, item_id: str, quantity: int) -> bool:
         """Положить предмет в банк гильдии"""
+        if self.bank_service is not None:
+            quantity_after = self.bank_service.deposit(self.guild_id, user_id, item_id, quantity)
+            if quantity_after is None:
+                return False
+            self._sync_bank_item(item_id, quantity_after, user_id)
+            # Вклад уже записан сервисом, здесь только обновляем копию в памяти
+            self.add_contribution(user_id, quantity * 10, persisted=True)
+            return True
+
         if item_id in self.bank:
             self.bank[item_id].quantity += quantity
         else:
@@ -230,26 +412,55 @@ class Guild:
                 deposited_by=user_id,
                 deposited_at=datetime.now()
             )
+        self.mark_bank_item_dirty(item_id)
         
         # Увеличить вклад участника
-        if user_id in self.members:
-            self.members[user_id].contribution += quantity * 10
+        self.add_contribution(user_id, quantity * 10)
             
         return True
 
     def withdraw_from_bank(self, user_id: int, item_id: str, quantity: int) -> bool:
         """Взять предмет из банка гильдии"""
-        if item_id not in self.bank or self.bank[item_id].quantity < quantity:
+        # Проверка прав (офицеры и выше могут брать) по текущему составу в памяти:
+        # исключения и смены рангов попадают в БД только при сохранении гильдии
+        if user_id not in self.members or self.members[user_id].rank.value < GuildRank.OFFICER.value:
             return False
-            
-        # Проверка прав (офицеры и выше могут брать)
-        if user_id in self.members and self.members[user_id].rank.value >= GuildRank.OFFICER.value:
-            self.bank[item_id].quantity -= quantity
-            if self.bank[item_id].quantity <= 0:
-                del self.bank[item_id]
+
+        if self.bank_service is not None:
+            # Остаток проверяется и уменьшается атомарно в БД
+            quantity_after = self.bank_service.withdraw(self.guild_id, user_id, item_id, quantity)
+            if quantity_after is None:
+                return False
+            self._sync_bank_item(item_id, quantity_after, user_id)
             return True
+
+        if item_id not in self.bank or self.bank[item_id].quantity < quantity:
+            return False
             
-        return False
+        self.bank[item_id].quantity -= quantity
+        if self.bank[item_id].quantity <= 0:
+            del self.bank[item_id]
+            self._dirty_bank.discard(item_id)
+            self._removed_bank.add(item_id)
+        else:
+            self.mark_bank_item_dirty(item_id)
+        return True
+
+    def _sync_bank_item(self, item_id: str, quantity: int, user_id: int):
+        """Обновить копию предмета банка в памяти после записи сервисом"""
+        self._dirty_bank.discard(item_id)
+        self._removed_bank.discard(item_id)
+        if quantity <= 0:
+            self.bank.pop(item_id, None)
+        elif item_id in self.bank:
+            self.bank[item_id].quantity = quantity
+        else:
+            self.bank[item_id] = GuildBankItem(
+                item_id=item_id,
+                quantity=quantity,
+                deposited_by=user_id,
+                deposited_at=datetime.now()
+            )
 
     def get_member_info(self, user_id: int) -> Optional[Dict]:
         """Получить информацию об участнике"""
@@ -266,29 +477,529 @@ class Guild:
             'online': (datetime.now() - member.last_online) < timedelta(minutes=5)
         }
 
-class GuildManager:
+class GuildBankService:
+    """Атомарные операции с банком гильдии.
+
+    Каждое пополнение и снятие - отдельный UPSERT или условный декремент
+    строки guild_bank, поэтому параллельные снятия не могут увести остаток
+    в минус. Все операции пишутся в журнал guild_bank_log, который только
+    дополняется. Каждая операция коммитится до возврата результата, так что
+    подтвержденное пополнение или снятие не теряется при падении процесса.
+    У каждого потока свое соединение с файлом БД (соединение sqlite нельзя
+    делить между потоками), а операция начинается с BEGIN IMMEDIATE, так
+    что параллельные операции из потоков и процессов идут по очереди.
+    Права на снятие проверяет вызывающий (Guild.withdraw_from_bank) по
+    составу гильдии в памяти.
+    """
+
     def __init__(self, db: Database):
         self.db = db
-        self.guilds: Dict[int, Guild] = {}
-        self.load_all_guilds()
+        self._local = threading.local()
+        self._initialize_db()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db.db_path, timeout=30)
+        return conn
 
-    def load_all_guilds(self):
-        """Загрузить все гильдии из БД"""
+    def _initialize_db(self):
+        """Создать необходимые таблицы в БД"""
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT id FROM guilds")
-            
-            for row in cursor.fetchall():
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS guild_bank_log (
+                    log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    item_id TEXT NOT NULL,
+                    delta INTEGER NOT NULL,
+                    quantity_after INTEGER NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_guild_bank_log_guild
+                ON guild_bank_log (guild_id, log_id)
+            """)
+            conn.commit()
+
+    def deposit(self, guild_id: int, user_id: int, item_id: str, quantity: int) -> Optional[int]:
+        """Положить предмет в банк. Возвращает новый остаток или None"""
+        if quantity <= 0:
+            return None
+
+        now = datetime.now().isoformat()
+        # Контекст соединения коммитит операцию целиком или откатывает ее при ошибке
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                INSERT INTO guild_bank 
+                (guild_id, item_id, quantity, deposited_by, deposited_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (guild_id, item_id) DO UPDATE SET
+                    quantity = quantity + excluded.quantity
+            """, (guild_id, item_id, quantity, user_id, now))
+            cursor.execute("""
+                UPDATE guild_members 
+                SET contribution = contribution + ? 
+                WHERE guild_id = ? AND user_id = ?
+            """, (quantity * 10, guild_id, user_id))
+            quantity_after = self._get_quantity(cursor, guild_id, item_id)
+            self._log(cursor, guild_id, user_id, item_id, quantity, quantity_after, now)
+        return quantity_after
+
+    def withdraw(self, guild_id: int, user_id: int, item_id: str, quantity: int) -> Optional[int]:
+        """Взять предмет из банка (права уже проверены). Возвращает новый остаток или None"""
+        if quantity <= 0:
+            return None
+
+        now = datetime.now().isoformat()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                UPDATE guild_bank 
+                SET quantity = quantity - ? 
+                WHERE guild_id = ? AND item_id = ? AND quantity >= ?
+            """, (quantity, guild_id, item_id, quantity))
+            if cursor.rowcount == 0:
+                return None
+
+            quantity_after = self._get_quantity(cursor, guild_id, item_id)
+            if quantity_after <= 0:
+                cursor.execute(
+                    "DELETE FROM guild_bank WHERE guild_id = ? AND item_id = ? AND quantity <= 0",
+                    (guild_id, item_id)
+                )
+            self._log(cursor, guild_id, user_id, item_id, -quantity, quantity_after, now)
+        return quantity_after
+
+    def get_log(self, guild_id: int, limit: int = 50) -> List[Dict]:
+        """Последние записи журнала банка гильдии"""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT user_id, item_id, delta, quantity_after, created_at
+                FROM guild_bank_log
+                WHERE guild_id = ?
+                ORDER BY log_id DESC
+                LIMIT ?
+            """, (guild_id, limit))
+            return [
+                {
+                    'user_id': row[0],
+                    'item_id': row[1],
+                    'delta': row[2],
+                    'quantity_after': row[3],
+                    'created_at': row[4]
+                }
+                for row in cursor.fetchall()
+            ]
+
+    def _get_quantity(self, cursor, guild_id: int, item_id: str) -> int:
+        cursor.execute(
+            "SELECT quantity FROM guild_bank WHERE guild_id = ? AND item_id = ?",
+            (guild_id, item_id)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _log(self, cursor, guild_id: int, user_id: int, item_id: str, delta: int,
+             quantity_after: int, created_at: str):
+        cursor.execute("""
+            INSERT INTO guild_bank_log 
+            (guild_id, user_id, item_id, delta, quantity_after, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (guild_id, user_id, item_id, delta, quantity_after, created_at))
+
+class GuildLeaderboard:
+    """Рейтинг гильдий по уровню, опыту и суммарному вкладу участников.
+
+    Порядок хранится в RankedIndex и обновляется за O(log n) при каждом
+    изменении очков гильдии. Очки сохраняются в таблицу guild_rankings.
+    При первом обращении она сверяется с guilds и guild_members (UPSERT
+    всех гильдий, удаление исчезнувших), и рейтинг строится из нее одним
+    запросом, так что несохраненные при остановке очки не расходятся
+    с данными гильдий навсегда.
+    """
+
+    def __init__(self, db: Database, flush_every: int = 100):
+        self.db = db
+        self.flush_every = flush_every
+        self.index = RankedIndex()
+        self.scores: Dict[int, Tuple[int, int, int]] = {}  # guild_id: (level, exp, contribution)
+        self._dirty: Set[int] = set()
+        self._loaded = False
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Создать необходимые таблицы в БД"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS guild_rankings (
+                    guild_id INTEGER PRIMARY KEY,
+                    level INTEGER NOT NULL,
+                    exp INTEGER NOT NULL,
+                    total_contribution INTEGER NOT NULL,
+                    updated_at TEXT
+                )
+            """)
+            conn.commit()
+
+    @staticmethod
+    def _key(guild_id: int, score: Tuple[int, int, int]) -> Tuple[int, int, int, int]:
+        level, exp, contribution = score
+        return (-level, -exp, -contribution, guild_id)
+
+    def _ensure_loaded(self):
+        """Сверить guild_rankings с данными гильдий и построить рейтинг"""
+        if self._loaded:
+            return
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO guild_rankings 
+                (guild_id, level, exp, total_contribution, updated_at)
+                SELECT g.id, g.level, g.exp, COALESCE(SUM(m.contribution), 0), ?
+                FROM guilds g
+                LEFT JOIN guild_members m ON m.guild_id = g.id
+                GROUP BY g.id
+                ON CONFLICT (guild_id) DO UPDATE SET
+                    level = excluded.level,
+                    exp = excluded.exp,
+                    total_contribution = excluded.total_contribution,
+                    updated_at = excluded.updated_at
+                WHERE (level, exp, total_contribution)
+                      != (excluded.level, excluded.exp, excluded.total_contribution)
+            """, (datetime.now().isoformat(),))
+            cursor.execute("DELETE FROM guild_rankings WHERE guild_id NOT IN (SELECT id FROM guilds)")
+            conn.commit()
+            cursor.execute("SELECT guild_id, level, exp, total_contribution FROM guild_rankings")
+            for guild_id, level, exp, contribution in cursor.fetchall():
+                score = (level, exp, contribution)
+                self.scores[guild_id] = score
+                self.index.insert(self._key(guild_id, score))
+        self._loaded = True
+
+    def update(self, guild_id: int, level: int, exp: int, total_contribution: int):
+        """Обновить очки гильдии"""
+        self._ensure_loaded()
+        score = (level, exp, total_contribution)
+        old_score = self.scores.get(guild_id)
+        if old_score == score:
+            return
+        if old_score is not None:
+            self.index.remove(self._key(guild_id, old_score))
+        self.scores[guild_id] = score
+        self.index.insert(self._key(guild_id, score))
+
+        self._dirty.add(guild_id)
+        if len(self._dirty) >= self.flush_every:
+            self.flush()
+
+    def remove(self, guild_id: int):
+        """Убрать гильдию из рейтинга"""
+        self._ensure_loaded()
+        score = self.scores.pop(guild_id, None)
+        if score is not None:
+            self.index.remove(self._key(guild_id, score))
+        self._dirty.discard(guild_id)
+        with self.db.get_connection() as conn:
+            conn.execute("DELETE FROM guild_rankings WHERE guild_id = ?", (guild_id,))
+            conn.commit()
+
+    def flush(self):
+        """Записать измененные очки в guild_rankings"""
+        if not self._dirty:
+            return
+        now = datetime.now().isoformat()
+        rows = [(guild_id, *self.scores[guild_id], now) for guild_id in self._dirty]
+        with self.db.get_connection() as conn:
+            conn.executemany("""
+                INSERT INTO guild_rankings 
+                (guild_id, level, exp, total_contribution, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (guild_id) DO UPDATE SET
+                    level = excluded.level,
+                    exp = excluded.exp,
+                    total_contribution = excluded.total_contribution,
+                    updated_at = excluded.updated_at
+            """, rows)
+            conn.commit()
+        self._dirty.clear()
+
+    def get_top(self, limit: int = 10) -> List[Dict]:
+        """Топ гильдий"""
+        self._ensure_loaded()
+        results = []
+        for position, key in enumerate(self.index.iter_from(0), start=1):
+            if position > limit:
+                break
+            guild_id = key[3]
+            level, exp, contribution = self.scores[guild_id]
+            results.append({
+                'position': position,
+                'guild_id': guild_id,
+                'level': level,
+                'exp': exp,
+                'total_contribution': contribution
+            })
+        return results
+
+    def get_rank(self, guild_id: int) -> Optional[int]:
+        """Место гильдии в рейтинге (с 1) или None"""
+        self._ensure_loaded()
+        score = self.scores.get(guild_id)
+        if score is None:
+            return None
+        return self.index.rank(self._key(guild_id, score)) + 1
+
+class GuildSearchIndex:
+    """N-граммный индекс по названиям и тегам гильдий.
+
+    Для каждой гильдии индексируются все подстроки длиной от 1 до NGRAM
+    символов из названия и тега. Запрос не длиннее NGRAM отвечается одним
+    поиском в словаре, более длинный - пересечением множеств его n-грамм
+    с последующей проверкой вхождения подстроки.
+    """
+    NGRAM = 3
+
+    def __init__(self):
+        self.postings: Dict[str, Set[int]] = {}
+        self.keys: Dict[int, Tuple[str, str]] = {}  # guild_id: (name, tag) в нижнем регистре
+
+    def _grams(self, text: str) -> Set[str]:
+        grams = set()
+        for size in range(1, self.NGRAM + 1):
+            for i in range(len(text) - size + 1):
+                grams.add(text[i:i + size])
+        return grams
+
+    def add(self, guild_id: int, name: str, tag: str):
+        """Добавить гильдию в индекс"""
+        self.remove(guild_id)
+        name, tag = name.lower(), tag.lower()
+        self.keys[guild_id] = (name, tag)
+        for gram in self._grams(name) | self._grams(tag):
+            self.postings.setdefault(gram, set()).add(guild_id)
+
+    def remove(self, guild_id: int):
+        """Удалить гильдию из индекса"""
+        keys = self.keys.pop(guild_id, None)
+        if keys is None:
+            return
+        name, tag = keys
+        for gram in self._grams(name) | self._grams(tag):
+            ids = self.postings.get(gram)
+            if ids is None:
+                continue
+            ids.discard(guild_id)
+            if not ids:
+                del self.postings[gram]
+
+    def search(self, query: str, limit: int) -> List[int]:
+        """Найти ID гильдий, в названии или теге которых есть подстрока query"""
+        query = query.lower()
+        if not query:
+            return heapq.nsmallest(limit, self.keys)
+
+        if len(query) <= self.NGRAM:
+            return heapq.nsmallest(limit, self.postings.get(query, ()))
+
+        grams = [query[i:i + self.NGRAM] for i in range(len(query) - self.NGRAM + 1)]
+        candidate_sets = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set.intersection(*candidate_sets)
+        matches = (
+            guild_id for guild_id in candidates
+            if query in self.keys[guild_id][0] or query in self.keys[guild_id][1]
+        )
+        return heapq.nsmallest(limit, matches)
+
+class GuildManager:
+    # Размер пачки ID для запросов с IN (...), чтобы не упереться в лимит параметров SQLite
+    HYDRATE_CHUNK = 500
+
+    def __init__(self, db: Database, cache_size: int = 1000):
+        self.db = db
+        # LRU загруженных гильдий: самые недавно использованные в конце
+        self.guilds: "OrderedDict[int, Guild]" = OrderedDict()
+        self.cache_size = cache_size
+        # user_id: guild_id для загруженных гильдий (None - исключен, удаление не записано)
+        self.member_index: Dict[int, Optional[int]] = {}
+        self.search_index = GuildSearchIndex()
+        self._search_index_ready = False
+        self._initialize_db()
+        self.bank_service = GuildBankService(db)
+        self.leaderboard = GuildLeaderboard(db)
+        # Остаток изменений рейтинга записывается при остановке бота
+        atexit.register(self.flush)
+
+    def _initialize_db(self):
+        """Создать необходимые таблицы в БД"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS guilds (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    tag TEXT NOT NULL,
+                    level INTEGER DEFAULT 1,
+                    exp INTEGER DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    motd TEXT
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS guild_members (
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    joined_at TEXT NOT NULL,
+                    contribution INTEGER DEFAULT 0,
+                    last_online TEXT,
+                    PRIMARY KEY (guild_id, user_id)
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_guild_members_user
+                ON guild_members (user_id)
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS guild_bank (
+                    guild_id INTEGER NOT NULL,
+                    item_id TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    deposited_by INTEGER,
+                    deposited_at TEXT,
+                    PRIMARY KEY (guild_id, item_id)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS guild_bank_balance (
+                    guild_id INTEGER PRIMARY KEY,
+                    balance INTEGER DEFAULT 0
+                )
+            """)
+            conn.commit()
+
+    def _cache_guild(self, guild: Guild):
+        """Положить гильдию в LRU, вытеснив самые старые при переполнении"""
+        self.guilds[guild.guild_id] = guild
+        self.guilds.move_to_end(guild.guild_id)
+        if self._search_index_ready:
+            self.search_index.add(guild.guild_id, guild.name, guild.tag)
+
+        while len(self.guilds) > self.cache_size:
+            _, evicted = self.guilds.popitem(last=False)
+            if evicted.has_unsaved_changes():
+                evicted.save_guild_data()
+            self._forget_members(evicted)
+
+    def _forget_members(self, guild: Guild):
+        for user_id in guild.members:
+            if self.member_index.get(user_id) == guild.guild_id:
+                del self.member_index[user_id]
+
+    def get_guild(self, guild_id: int) -> Optional[Guild]:
+        """Получить гильдию по ID, загрузив ее из БД при необходимости"""
+        guild = self.guilds.get(guild_id)
+        if guild is not None:
+            self.guilds.move_to_end(guild_id)
+            return guild
+        return self.hydrate_guilds([guild_id]).get(guild_id)
+
+    def hydrate_guilds(self, guild_ids: List[int]) -> Dict[int, Guild]:
+        """Загрузить несколько гильдий пачкой
+
+        Отсутствующие в кэше гильдии загружаются тремя запросами на пачку
+        (информация с балансом, участники, банк) вместо отдельных запросов
+        на каждую гильдию.
+        """
+        result: Dict[int, Guild] = {}
+        missing = []
+        for guild_id in dict.fromkeys(guild_ids):
+            guild = self.guilds.get(guild_id)
+            if guild is not None:
+                self.guilds.move_to_end(guild_id)
+                result[guild_id] = guild
+            else:
+                missing.append(guild_id)
+
+        for start in range(0, len(missing), self.HYDRATE_CHUNK):
+            chunk = missing[start:start + self.HYDRATE_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT g.id, g.name, g.tag, g.level, g.exp, g.created_at, g.motd, b.balance
+                    FROM guilds g
+                    LEFT JOIN guild_bank_balance b ON b.guild_id = g.id
+                    WHERE g.id IN ({placeholders})
+                """, chunk)
+                guild_rows = cursor.fetchall()
+
+                cursor.execute(f"""
+                    SELECT guild_id, user_id, rank, joined_at, contribution, last_online
+                    FROM guild_members
+                    WHERE guild_id IN ({placeholders})
+                """, chunk)
+                member_rows: Dict[int, List[Tuple]] = {}
+                for row in cursor.fetchall():
+                    member_rows.setdefault(row[0], []).append(tuple(row[1:]))
+
+                cursor.execute(f"""
+                    SELECT guild_id, item_id, quantity, deposited_by, deposited_at
+                    FROM guild_bank
+                    WHERE guild_id IN ({placeholders})
+                """, chunk)
+                bank_rows: Dict[int, List[Tuple]] = {}
+                for row in cursor.fetchall():
+                    bank_rows.setdefault(row[0], []).append(tuple(row[1:]))
+
+            for row in guild_rows:
                 guild_id = row[0]
                 try:
-                    self.guilds[guild_id] = Guild(self.db, guild_id)
+                    guild = Guild(
+                        self.db, guild_id, self.member_index, autoload=False,
+                        bank_service=self.bank_service, leaderboard=self.leaderboard
+                    )
+                    guild.apply_rows(
+                        tuple(row[1:7]),
+                        member_rows.get(guild_id, []),
+                        bank_rows.get(guild_id, []),
+                        row[7] or 0
+                    )
                 except Exception as e:
                     logger.error(f"Failed to load guild {guild_id}: {e}")
+                    continue
+                self._cache_guild(guild)
+                result[guild_id] = guild
+
+        return result
+
+    def _ensure_search_index(self):
+        """Построить поисковый индекс при первом поиске (одним запросом)"""
+        if self._search_index_ready:
+            return
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, tag FROM guilds")
+            for guild_id, name, tag in cursor.fetchall():
+                self.search_index.add(guild_id, name, tag)
+        self._search_index_ready = True
 
     def create_guild(self, leader_id: int, name: str, tag: str) -> Optional[Guild]:
         """Создать новую гильдию"""
         if len(tag) > 4 or len(name) > 24:
             return None
+
+        if self.get_guild_by_member(leader_id):
+            return None
             
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
@@ -316,16 +1027,16 @@ class GuildManager:
             conn.commit()
             
             # Загрузить новую гильдию в менеджер
-            new_guild = Guild(self.db, guild_id)
-            self.guilds[guild_id] = new_guild
+            new_guild = self.get_guild(guild_id)
+            if new_guild is not None:
+                new_guild._score_changed()
             return new_guild
 
     def disband_guild(self, guild_id: int, leader_id: int) -> bool:
         """Распустить гильдию"""
-        if guild_id not in self.guilds:
+        guild = self.get_guild(guild_id)
+        if guild is None:
             return False
-            
-        guild = self.guilds[guild_id]
         
         # Проверить, что запрашивающий является лидером
         if leader_id not in guild.members or guild.members[leader_id].rank != GuildRank.LEADER:
@@ -342,34 +1053,62 @@ class GuildManager:
             
             conn.commit()
             
-            # Удалить из менеджера
+            # Удалить из менеджера и индексов
+            self._forget_members(guild)
+            self.search_index.remove(guild_id)
+            self.leaderboard.remove(guild_id)
             del self.guilds[guild_id]
             return True
 
     def get_guild_by_member(self, user_id: int) -> Optional[Guild]:
         """Получить гильдию по ID участника"""
-        for guild in self.guilds.values():
-            if user_id in guild.members:
-                return guild
-        return None
+        if user_id in self.member_index:
+            guild_id = self.member_index[user_id]
+        else:
+            guild_id = find_member_guild_id(self.db, user_id)
+        if guild_id is None:
+            return None
+        return self.get_guild(guild_id)
 
     def search_guilds(self, query: str, limit: int = 10) -> List[Dict]:
         """Поиск гильдий по названию или тегу"""
         results = []
-        query = query.lower()
+        self._ensure_search_index()
+        guild_ids = self.search_index.search(query, limit)
+        guilds = self.hydrate_guilds(guild_ids)
         
-        for guild in self.guilds.values():
-            if query in guild.name.lower() or query in guild.tag.lower():
-                results.append({
-                    'id': guild.guild_id,
-                    'name': guild.name,
-                    'tag': guild.tag,
-                    'level': guild.level,
-                    'member_count': len(guild.members),
-                    'created_at': guild.created_at
-                })
-                
-                if len(results) >= limit:
-                    break
+        for guild_id in guild_ids:
+            guild = guilds.get(guild_id)
+            if guild is None:
+                continue
+            results.append({
+                'id': guild.guild_id,
+                'name': guild.name,
+                'tag': guild.tag,
+                'level': guild.level,
+                'member_count': len(guild.members),
+                'created_at': guild.created_at
+            })
                     
         return results
+
+    def get_guild_leaderboard(self, limit: int = 10) -> List[Dict]:
+        """Топ гильдий по уровню, опыту и вкладу"""
+        top = self.leaderboard.get_top(limit)
+        guilds = self.hydrate_guilds([entry['guild_id'] for entry in top])
+        for entry in top:
+            guild = guilds.get(entry['guild_id'])
+            entry['name'] = guild.name if guild else None
+            entry['tag'] = guild.tag if guild else None
+        return top
+
+    def get_guild_rank(self, guild_id: int) -> Optional[int]:
+        """Место гильдии в рейтинге"""
+        return self.leaderboard.get_rank(guild_id)
+
+    def flush(self):
+        """Записать накопленные изменения рейтинга"""
+        try:
+            self.leaderboard.flush()
+        except Exception as e:
+            logger.error(f"Ошибка записи рейтинга гильдий: {e}")
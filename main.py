@@ -78,6 +78,13 @@ def show_inventory(message):
 def fight_monster(message):
     combat.initiate_combat(bot, message)
 
+@bot.message_handler(commands=['auto'])
+def auto_battle(message):
+    # /auto [число боев]
+    args = message.text.split()[1:]
+    fights = int(args[0]) if args and args[0].isdigit() else 10
+    combat.auto_battle(bot, message, fights)
+
 @bot.message_handler(func=lambda msg: msg.text == "🏃‍♂️ Исследовать")
 def explore_location(message):
     exploration.explore(bot, message)
@@ -221,3 +228,6 @@ if __name__ == "__main__":
         bot.polling(none_stop=True, interval=1, timeout=30)
     except Exception as e:
         logger.error(f"Ошибка в работе бота: {e}")
+    finally:
+        # Последний снимок текущих боев, чтобы перезапуск их восстановил
+        combat.combat_system.sessions.close()
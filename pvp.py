@@ -1,31 +1,238 @@
 import random
 import logging
-from typing import Dict, Optional, List, Tuple
+import time
+import asyncio
+from datetime import datetime
+from typing import Callable, Dict, Optional, List, Tuple
 from player import Player
 from database import Database
 from combat import CombatSystem
+from pvp_challenges import STATUS_PENDING, DuelChallenge, DuelRegistry
+from pvp_duel import make_fighters, resolve_duel
+from pvp_matchmaking import ArenaMatchmaker, PvPRating, glicko_update, inflate_rd, team_rating
+from pvp_zones import MAX_LEVEL_DIFFERENCE, ZonePresenceTracker
+from ranking import RankedIndex
 
 logger = logging.getLogger(__name__)
 
+class PvPLeaderboard:
+    """Рейтинг игроков по чести.
+
+    Порядок хранится в RankedIndex и обновляется за O(log n) при каждом
+    изменении чести. Строится из pvp_stats одним запросом при первом
+    обращении, дальше таблица для рейтинга не читается.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.index = RankedIndex()
+        self.honor: Dict[int, int] = {}  # player_id: честь
+        self._loaded = False
+
+    @staticmethod
+    def _key(player_id: int, honor: int) -> Tuple[int, int]:
+        return (-honor, player_id)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self.honor = dict(self.db.get_pvp_honor())
+        self.index.bulk_load(sorted(self._key(player_id, honor) for player_id, honor in self.honor.items()))
+        self._loaded = True
+
+    def set_honor(self, player_id: int, honor: int):
+        """Задать честь игрока"""
+        self._ensure_loaded()
+        old_honor = self.honor.get(player_id)
+        if old_honor == honor:
+            return
+        if old_honor is not None:
+            self.index.remove(self._key(player_id, old_honor))
+        self.honor[player_id] = honor
+        self.index.insert(self._key(player_id, honor))
+
+    def add_honor(self, player_id: int, amount: int):
+        """Начислить честь игроку"""
+        self._ensure_loaded()
+        self.set_honor(player_id, self.honor.get(player_id, 0) + amount)
+
+    def get_top(self, limit: int = 10, offset: int = 0) -> List[Tuple[int, int, int]]:
+        """Топ игроков: (место с 1, player_id, честь)"""
+        self._ensure_loaded()
+        results = []
+        for position, (negative_honor, player_id) in enumerate(self.index.iter_from(offset), start=offset + 1):
+            if len(results) >= limit:
+                break
+            results.append((position, player_id, -negative_honor))
+        return results
+
+    def get_rank(self, player_id: int) -> Optional[Dict]:
+        """Место игрока (с 1) и перцентиль (доля игроков не выше него) или None"""
+        self._ensure_loaded()
+        honor = self.honor.get(player_id)
+        if honor is None:
+            return None
+        position = self.index.rank(self._key(player_id, honor)) + 1
+        total = len(self.index)
+        return {
+            'position': position,
+            'total': total,
+            'honor': honor,
+            'percentile': 100.0 * (total - position + 1) / total
+        }
+
+class PvPStatsStore:
+    """Накопление изменений PvP статистики с пакетной записью.
+
+    Бои только прибавляют изменения к счетчикам в памяти (и сразу
+    обновляют рейтинг чести). Раз в flush_interval секунд или при
+    max_pending игроках изменения записываются одной транзакцией через
+    Database.apply_pvp_stat_deltas. На время смены сезона запись
+    откладывается (hold): результаты нового сезона копятся в памяти и
+    пишутся одной транзакцией после release, когда архив уже закрыт.
+    """
+    FIELDS = ('wins', 'losses', 'draws', 'kills', 'deaths', 'honor')
+
+    def __init__(self, db: Database, leaderboard: PvPLeaderboard,
+                 flush_interval: float = 5.0, max_pending: int = 1000):
+        self.db = db
+        self.leaderboard = leaderboard
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending: Dict[int, List[int]] = {}  # player_id: изменения в порядке FIELDS
+        self.write_stats = {'updates': 0, 'flushes': 0, 'rows': 0}
+        self._task: Optional[asyncio.Task] = None
+        self._held = False
+
+    def record(self, player_id: int, **deltas: int):
+        """Прибавить изменения статистики игрока"""
+        row = self.pending.get(player_id)
+        if row is None:
+            row = self.pending[player_id] = [0] * len(self.FIELDS)
+        for name, value in deltas.items():
+            row[self.FIELDS.index(name)] += value
+        if deltas.get('honor'):
+            self.leaderboard.add_honor(player_id, deltas['honor'])
+        self.write_stats['updates'] += 1
+
+        if len(self.pending) >= self.max_pending:
+            self.flush()
+        else:
+            self._ensure_task()
+
+    def _ensure_task(self):
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        except RuntimeError:
+            pass  # нет цикла событий - изменения запишет flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def hold(self):
+        """Откладывать запись изменений до release (смена сезона)"""
+        self._held = True
+
+    def release(self):
+        """Снова писать изменения и записать накопленные за время hold"""
+        self._held = False
+        self.flush()
+
+    def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        if not self.pending or self._held:
+            return
+        pending, self.pending = self.pending, {}
+        now = datetime.now().isoformat()
+        try:
+            self.db.apply_pvp_stat_deltas([(player_id, *row, now) for player_id, row in pending.items()])
+        except Exception as e:
+            logger.error(f"Failed to flush PvP stats for {len(pending)} players: {e}")
+            # Вернуть изменения, чтобы записать их следующей попыткой
+            for player_id, row in pending.items():
+                current = self.pending.setdefault(player_id, [0] * len(self.FIELDS))
+                for i, value in enumerate(row):
+                    current[i] += value
+            return
+        self.write_stats['flushes'] += 1
+        self.write_stats['rows'] += len(pending)
+
+    def get_stats(self, player_ids: List[int]) -> Dict[int, Dict]:
+        """Статистика игроков с учетом еще не записанных изменений"""
+        stats = self.db.get_pvp_stats_for(player_ids)
+        for player_id in player_ids:
+            row = self.pending.get(player_id)
+            if row is None:
+                continue
+            current = stats.setdefault(player_id, {'player_id': player_id, **{name: 0 for name in self.FIELDS}})
+            for name, value in zip(self.FIELDS, row):
+                current[name] = (current.get(name) or 0) + value
+        return stats
+
+    async def stop(self):
+        """Остановить фоновую запись и сбросить остаток"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
 class PvPManager:
-    def __init__(self, db: Database, combat_system: CombatSystem):
+    def __init__(self, db: Database, combat_system: CombatSystem,
+                 player_loader: Optional[Callable[[int], Optional[Player]]] = None):
         self.db = db
         self.combat_system = combat_system
-        self.duels: Dict[int, Dict] = {}  # {chat_id: duel_data}
-        self.arena_queues: Dict[str, List[int]] = {
-            '1v1': [],
-            '3v3': [],
-            '5v5': []
-        }
+        self.player_loader = player_loader  # загрузка игрока для вызовов из другого процесса
+        self.rng = random.Random()
+        self.duels = DuelRegistry(db)
+        self.matchmaker = ArenaMatchmaker()
+        self.ratings: Dict[Tuple[int, str], PvPRating] = {}  # (player_id, тип арены): рейтинг
+        self.leaderboard = PvPLeaderboard(db)
+        self.stats = PvPStatsStore(db, self.leaderboard)
         self.pvp_zones = {
             'blood_arena': {'min_level': 30, 'max_players': 20},
             'wild_lands': {'min_level': 15, 'max_players': 50}
         }
+        self.zone_tracker = ZonePresenceTracker(self.pvp_zones)
         self.honor_rewards = {
             'win': 50,
             'loss': 10,
             'kill': 15
         }
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Создать необходимые таблицы в БД"""
+        self.db.init_pvp_tables()
+
+    def get_ratings(self, player_ids: List[int], arena_type: str) -> Dict[int, PvPRating]:
+        """Рейтинги игроков на арене (недостающие загружаются одним запросом)"""
+        missing = [pid for pid in player_ids if (pid, arena_type) not in self.ratings]
+        if missing:
+            loaded = self.db.get_pvp_ratings(arena_type, missing)
+            for player_id in missing:
+                row = loaded.get(player_id)
+                self.ratings[(player_id, arena_type)] = (
+                    PvPRating(row['rating'], row['rd'], row['updated_at']) if row else PvPRating()
+                )
+
+        now = time.time()
+        result = {}
+        for player_id in player_ids:
+            rating = self.ratings[(player_id, arena_type)]
+            if rating.updated_at:
+                # Неопределенность растет, пока игрок не сражается
+                rating = PvPRating(rating.rating, inflate_rd(rating.rd, (now - rating.updated_at) / 86400),
+                                   rating.updated_at)
+            result[player_id] = rating
+        return result
 
     async def challenge_player(self, challenger: Player, target: Player) -> Dict:
         """Отправить вызов на дуэль другому игроку"""
@@ -38,14 +245,7 @@ class PvPManager:
         if challenger.current_hp < challenger.max_hp * 0.5:
             return {'success': False, 'message': 'Ваше здоровье должно быть выше 50%'}
 
-        duel_id = hash(f"{challenger.user_id}_{target.user_id}_{random.randint(1000, 9999)}")
-        self.duels[duel_id] = {
-            'challenger': challenger,
-            'target': target,
-            'status': 'pending',
-            'timestamp': datetime.now(),
-            'bet': 0
-        }
+        duel_id = self.duels.create(challenger.user_id, target.user_id, players=(challenger, target)).duel_id
 
         return {
             'success': True,
@@ -53,6 +253,22 @@ class PvPManager:
             'message': f"{target.name}, вы получили вызов от {challenger.name}! Принять? /accept_duel_{duel_id}"
         }
 
+    def get_incoming_challenges(self, player_id: int) -> List[DuelChallenge]:
+        """Ожидающие вызовы игроку"""
+        return self.duels.get_incoming(player_id)
+
+    def _duel_players(self, duel: DuelChallenge) -> Optional[Tuple[Player, Player]]:
+        if duel.players is not None:
+            return duel.players
+        if self.player_loader is None:
+            return None
+        challenger = self.player_loader(duel.challenger_id)
+        target = self.player_loader(duel.target_id)
+        if challenger is None or target is None:
+            return None
+        duel.players = (challenger, target)
+        return duel.players
+
     async def accept_duel(self, duel_id: int, accepted: bool) -> Dict:
         """Принять или отклонить вызов на дуэль"""
         duel = self.duels.get(duel_id)
@@ -60,72 +276,60 @@ class PvPManager:
             return {'success': False, 'message': 'Вызов не найден или истек'}
 
         if not accepted:
-            self.duels.pop(duel_id)
+            self.duels.remove(duel_id)
             return {'success': True, 'message': 'Вызов отклонен'}
 
-        if duel['status'] != 'pending':
+        if duel.status != STATUS_PENDING:
             return {'success': False, 'message': 'Этот вызов уже обработан'}
 
-        challenger = duel['challenger']
-        target = duel['target']
+        players = self._duel_players(duel)
+        if players is None:
+            self.duels.remove(duel_id)
+            return {'success': False, 'message': 'Участник дуэли не найден'}
+        challenger, target = players
+
+        if not self.duels.claim(duel_id):
+            return {'success': False, 'message': 'Этот вызов уже обработан'}
 
         # Проверка готовности игроков
         for player in [challenger, target]:
             if player.current_hp < player.max_hp * 0.3:
-                self.duels.pop(duel_id)
+                self.duels.remove(duel_id)
                 return {'success': False, 'message': f'{player.name} не готов к битве (HP < 30%)'}
 
-        duel['status'] = 'active'
-        battle_result = await self._start_duel(challenger, target)
+        try:
+            battle_result = await self._start_duel(challenger, target)
+        except Exception:
+            # Дуэль не состоялась: вызов снова ждет ответа, а не висит в бою
+            self.duels.release(duel_id)
+            raise
+        self.duels.remove(duel_id)
         
         # Обновление статистики PvP
         await self._update_pvp_stats(challenger, target, battle_result['winner'])
-        self.duels.pop(duel_id)
         
         return battle_result
 
     async def _start_duel(self, player1: Player, player2: Player) -> Dict:
         """Провести дуэль между двумя игроками"""
-        logger.info(f"Starting duel between {player1.name} and {player2.name}")
+        logger.debug(f"Starting duel between {player1.name} and {player2.name}")
 
-        # Временные модификаторы для PvP
-        pvp_modifiers = {
-            'damage_reduction': 0.3,  # Уменьшение урона в PvP
-            'cc_duration': 0.5       # Уменьшение длительности контроля
-        }
-
-        battle_log = []
-        round_count = 0
-        max_rounds = 20
-
-        while player1.current_hp > 0 and player2.current_hp > 0 and round_count < max_rounds:
-            round_count += 1
-            round_log = f"🔴 Раунд {round_count}:"
-
-            # Ход игрока 1
-            attack_result = self.combat_system.pvp_attack(player1, player2, pvp_modifiers)
-            round_log += f"\n{player1.name} наносит {attack_result['damage']} урона!"
-            if attack_result.get('critical'):
-                round_log += " Критический удар!"
-            
-            # Ход игрока 2
-            if player2.current_hp > 0:
-                attack_result = self.combat_system.pvp_attack(player2, player1, pvp_modifiers)
-                round_log += f"\n{player2.name} наносит {attack_result['damage']} урона!"
-                if attack_result.get('critical'):
-                    round_log += " Критический удар!"
-
-            battle_log.append(round_log)
+        # Бой считается по числам, лог отрисуется, только если его прочитают
+        fighter1, fighter2 = make_fighters(player1, player2)
+        winner_index, round_count, hp1, hp2, battle_log = resolve_duel(fighter1, fighter2, self.rng)
+        player1.current_hp = max(0, hp1)
+        player2.current_hp = max(0, hp2)
 
         # Определение победителя
-        if player1.current_hp <= 0:
-            winner = player2
-            loser = player1
-        elif player2.current_hp <= 0:
+        if winner_index == 0:
             winner = player1
             loser = player2
+        elif winner_index == 1:
+            winner = player2
+            loser = player1
         else:
             winner = None  # Ничья по таймауту
+            loser = None
 
         # Восстановление здоровья после боя
         player1.current_hp = min(player1.current_hp, player1.max_hp * 0.3)
@@ -142,101 +346,138 @@ class PvPManager:
 
     async def join_arena_queue(self, player: Player, arena_type: str) -> Dict:
         """Войти в очередь на арену"""
-        if arena_type not in self.arena_queues:
+        if arena_type not in self.matchmaker.TEAM_SIZES:
             return {'success': False, 'message': 'Неверный тип арены'}
 
-        if player.user_id in self.arena_queues[arena_type]:
+        if player.user_id in self.matchmaker.entries:
             return {'success': False, 'message': 'Вы уже в очереди'}
 
-        self.arena_queues[arena_type].append(player.user_id)
+        rating = self.get_ratings([player.user_id], arena_type)[player.user_id]
+        self.matchmaker.enqueue(player.user_id, arena_type, rating.rating)
         return {'success': True, 'message': f'Вы в очереди на {arena_type} арену'}
 
     async def leave_arena_queue(self, player: Player) -> Dict:
         """Покинуть очередь на арену"""
-        for queue in self.arena_queues.values():
-            if player.user_id in queue:
-                queue.remove(player.user_id)
-                return {'success': True, 'message': 'Вы покинули очередь'}
+        if self.matchmaker.cancel(player.user_id):
+            return {'success': True, 'message': 'Вы покинули очередь'}
         return {'success': False, 'message': 'Вы не в очереди'}
 
     async def check_arena_matches(self) -> List[Dict]:
         """Проверить и создать матчи для арены"""
-        formed_matches = []
-        
-        # Обработка 1v1 очереди
-        while len(self.arena_queues['1v1']) >= 2:
-            player1_id = self.arena_queues['1v1'].pop(0)
-            player2_id = self.arena_queues['1v1'].pop(0)
-            
-            formed_matches.append({
-                'type': '1v1',
-                'team1': [player1_id],
-                'team2': [player2_id]
-            })
-
-        # Обработка 3v3 очереди (упрощенная версия)
-        if len(self.arena_queues['3v3']) >= 6:
-            team1 = [self.arena_queues['3v3'].pop(0) for _ in range(3)]
-            team2 = [self.arena_queues['3v3'].pop(0) for _ in range(3)]
-            
-            formed_matches.append({
-                'type': '3v3',
-                'team1': team1,
-                'team2': team2
-            })
-
-        return formed_matches
-
-    async def _update_pvp_stats(self, player1: Player, player2: Player, winner: Optional[Player]) -> None:
-        """Обновить PvP статистику игроков"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            if winner:
-                loser = player2 if winner.user_id == player1.user_id else player1
-                
-                # Обновление победителя
-                cursor.execute(
-                    "UPDATE pvp_stats SET wins = wins + 1, honor = honor + ? WHERE user_id = ?",
-                    (self.honor_rewards['win'], winner.user_id)
-                
-                # Обновление проигравшего
-                cursor.execute(
-                    "UPDATE pvp_stats SET losses = losses + 1, honor = honor + ? WHERE user_id = ?",
-                    (self.honor_rewards['loss'], loser.user_id))
+        # Команды подбираются по рейтингу, допуск растет со временем ожидания
+        return self.matchmaker.form_matches()
+
+    async def record_arena_result(self, match: Dict, winner_team: Optional[int]) -> Dict[int, float]:
+        """Обновить рейтинги после матча арены (winner_team: 1, 2 или None при ничьей).
+
+        Каждый игрок считается сыгравшим против команды соперников как
+        одного игрока со средним рейтингом. Возвращает изменение рейтинга.
+        """
+        arena_type = match['type']
+        teams = (match['team1'], match['team2'])
+        ratings = self.get_ratings(teams[0] + teams[1], arena_type)
+        opponents = [team_rating([ratings[pid] for pid in team]) for team in reversed(teams)]
+
+        now = time.time()
+        changes = {}
+        rows = []
+        for index, team in enumerate(teams):
+            if winner_team is None:
+                score = 0.5
+                result = {'draws': 1}
+            elif winner_team == index + 1:
+                score = 1.0
+                result = {'wins': 1, 'honor': self.honor_rewards['win']}
             else:
-                # Ничья
-                for player in [player1, player2]:
-                    cursor.execute(
-                        "UPDATE pvp_stats SET draws = draws + 1 WHERE user_id = ?",
-                        (player.user_id,))
-
-            conn.commit()
+                score = 0.0
+                result = {'losses': 1, 'honor': self.honor_rewards['loss']}
+            opponent_rating, opponent_rd = opponents[index]
+            for player_id in team:
+                self.stats.record(player_id, **result)
+                current = ratings[player_id]
+                new_rating, new_rd = glicko_update(current.rating, current.rd, opponent_rating, opponent_rd, score)
+                self.ratings[(player_id, arena_type)] = PvPRating(new_rating, new_rd, now)
+                changes[player_id] = new_rating - current.rating
+                rows.append((player_id, arena_type, new_rating, new_rd, now))
+
+        self.db.save_pvp_ratings(rows)
+        return changes
+
+    async def _update_pvp_stats(self, player1: Player, player2: Player, winner: Optional[Player],
+                                zone_kill: bool = False) -> None:
+        """Обновить PvP статистику игроков (запись в БД - пакетом в PvPStatsStore)"""
+        if winner:
+            loser = player2 if winner.user_id == player1.user_id else player1
+            if zone_kill:
+                self.stats.record(winner.user_id, wins=1, kills=1,
+                                  honor=self.honor_rewards['win'] + self.honor_rewards['kill'])
+                self.stats.record(loser.user_id, losses=1, deaths=1, honor=self.honor_rewards['loss'])
+            else:
+                self.stats.record(winner.user_id, wins=1, honor=self.honor_rewards['win'])
+                self.stats.record(loser.user_id, losses=1, honor=self.honor_rewards['loss'])
+        else:
+            # Ничья
+            for player in [player1, player2]:
+                self.stats.record(player.user_id, draws=1)
 
     async def get_pvp_leaderboard(self, limit: int = 10) -> List[Dict]:
         """Получить таблицу лидеров PvP"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT user_id, wins, losses, draws, honor 
-                FROM pvp_stats 
-                ORDER BY honor DESC 
-                LIMIT ?
-            """, (limit,))
-            
-            return [dict(row) for row in cursor.fetchall()]
+        # Порядок берется из индекса, из БД - только статистика выбранных игроков
+        top = self.leaderboard.get_top(limit)
+        stats = self.stats.get_stats([player_id for _, player_id, _ in top])
+        return [
+            {**stats.get(player_id, {}), 'position': position, 'player_id': player_id, 'honor': honor}
+            for position, player_id, honor in top
+        ]
+
+    async def get_pvp_rank(self, player_id: int) -> Optional[Dict]:
+        """Место игрока в рейтинге чести и перцентиль"""
+        return self.leaderboard.get_rank(player_id)
+
+    async def enter_pvp_zone(self, player: Player, zone: str) -> Dict:
+        """Войти в PvP зону"""
+        zone_data = self.pvp_zones.get(zone)
+        if not zone_data:
+            return {'success': False, 'message': 'Неизвестная PvP зона'}
+
+        if player.level < zone_data['min_level']:
+            return {'success': False, 'message': f"Для входа нужен {zone_data['min_level']} уровень"}
+
+        if not self.zone_tracker.enter(player.user_id, zone, player.level):
+            return {'success': False, 'message': 'Зона заполнена, попробуйте позже'}
+
+        return {
+            'success': True,
+            'message': f"Вы вошли в PvP зону. Игроков в зоне: {self.zone_tracker.count(zone)}"
+        }
+
+    async def leave_pvp_zone(self, player: Player) -> Dict:
+        """Покинуть PvP зону"""
+        if self.zone_tracker.leave(player.user_id) is None:
+            return {'success': False, 'message': 'Вы не находитесь в PvP зоне'}
+        return {'success': True, 'message': 'Вы покинули PvP зону'}
+
+    def get_zone_targets(self, player: Player, limit: int = 20) -> List[int]:
+        """Игроки в зоне атакующего, которых он может атаковать (ближайшие по уровню)"""
+        return self.zone_tracker.get_targets(player.user_id, limit)
 
     async def handle_pvp_zone_combat(self, attacker: Player, defender: Player) -> Dict:
         """Обработка боя в PvP зоне"""
         if not self._can_attack(attacker, defender):
             return {'success': False, 'message': 'Вы не можете атаковать этого игрока'}
 
+        # Уровень мог измениться с момента входа в зону
+        self.zone_tracker.update_level(attacker.user_id, attacker.level)
+        self.zone_tracker.update_level(defender.user_id, defender.level)
+        if not self.zone_tracker.can_attack(attacker.user_id, defender.user_id):
+            return {'success': False, 'message': 'Противник не находится в вашей PvP зоне'}
+
         combat_result = await self._start_duel(attacker, defender)
         
         # Дополнительные награды за убийство в PvP зоне
         if combat_result['winner']:
             combat_result['honor_gained'] += self.honor_rewards['kill']
-            await self._update_pvp_stats(attacker, defender, combat_result['winner'])
+            await self._update_pvp_stats(attacker, defender, combat_result['winner'], zone_kill=True)
         
         return combat_result
 
@@ -247,30 +488,57 @@ class PvPManager:
             return False
         
         # Проверка уровня (опционально)
-        if abs(attacker.level - defender.level) > 10:
+        if abs(attacker.level - defender.level) > MAX_LEVEL_DIFFERENCE:
             return False
         
         # Проверка фракций/гильдий (можно добавить)
         return True
 
-    async def reset_pvp_season(self):
-        """Сбросить PvP сезон и выдать награды"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Получить топ игроков
-            top_players = await self.get_pvp_leaderboard(100)
-            
-            # Выдать сезонные награды
-            for i, player in enumerate(top_players, start=1):
-                rewards = self._calculate_season_rewards(i)
-                cursor.execute(
-                    "INSERT INTO seasonal_rewards (user_id, season, position, rewards) VALUES (?, ?, ?, ?)",
-                    (player['user_id'], datetime.now().strftime("%Y-%m"), i, str(rewards))
-            
-            # Сбросить статистику
-            cursor.execute("UPDATE pvp_stats SET wins = 0, losses = 0, draws = 0")
-            conn.commit()
+    async def reset_pvp_season(self, season: Optional[str] = None, chunk_size: int = 1000,
+                               rewarded_positions: int = 100) -> str:
+        """Сбросить PvP сезон и выдать награды.
+
+        Статистика переносится в архив сезона и обнуляется пачками по
+        chunk_size игроков с передачей управления циклу событий между
+        пачками, так что игра не ждет окончания сброса. Прогресс хранится
+        в pvp_season_rollover: прерванная смена сезона продолжается при
+        следующем вызове. Возвращает сезон, который был закрыт.
+        """
+        rollover = self.db.get_unfinished_pvp_rollover()
+        if rollover is None:
+            rollover = self.db.start_pvp_rollover(season or datetime.now().strftime("%Y-%m"))
+            if rollover['finished_at'] is not None:
+                raise ValueError(f"PvP season {rollover['season']} is already closed")
+        season = rollover['season']
+        logger.info(f"PvP season {season} rollover from player {rollover['last_player_id']}")
+
+        # Изменения, накопленные до сброса, относятся к закрываемому сезону.
+        # Бои во время сброса уже идут в новом сезоне: их запись откладывается,
+        # иначе следующая пачка перенесла бы их в архив закрываемого сезона.
+        # Если сброс прервется, запись остается отложенной до его продолжения.
+        self.stats.flush()
+        self.stats.hold()
+        last_player_id = rollover['last_player_id']
+        while True:
+            last_player_id = self.db.archive_pvp_stats_chunk(season, last_player_id, chunk_size)
+            if last_player_id is None:
+                break
+            await asyncio.sleep(0)
+
+        # Награды по итоговой таблице из архива (повторная запись игнорируется)
+        standings = self.db.get_season_standings(season, rewarded_positions)
+        rows = [
+            (player_id, position, self._calculate_season_rewards(position))
+            for position, (player_id, _) in enumerate(standings, start=1)
+        ]
+        for start in range(0, len(rows), chunk_size):
+            self.db.save_season_rewards(season, rows[start:start + chunk_size])
+            await asyncio.sleep(0)
+
+        self.db.finish_pvp_rollover(season)
+        self.stats.release()
+        logger.info(f"PvP season {season} closed, {len(rows)} players rewarded")
+        return season
 
     def _calculate_season_rewards(self, position: int) -> Dict:
         """Рассчитать сезонные награды по позиции"""
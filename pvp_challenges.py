@@ -0,0 +1,162 @@
+"""
+Реестр вызовов на дуэль:
+- Номера вызовов выдает БД (AUTOINCREMENT), они не повторяются между
+  перезапусками и процессами
+- Входящие и исходящие вызовы игрока без перебора всех дуэлей
+- Истечение ожидающих вызовов по куче сроков
+"""
+import heapq
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+DUEL_TTL = 120.0  # сколько секунд вызов ждет ответа
+
+STATUS_PENDING = 'pending'
+STATUS_ACTIVE = 'active'
+
+@dataclass
+class DuelChallenge:
+    duel_id: int
+    challenger_id: int
+    target_id: int
+    created_at: float
+    expires_at: float
+    bet: int = 0
+    status: str = STATUS_PENDING
+    players: Optional[Tuple[Any, Any]] = None  # объекты игроков в этом процессе, в БД не пишутся
+
+    @classmethod
+    def from_row(cls, row: Dict) -> 'DuelChallenge':
+        return cls(row['duel_id'], row['challenger_id'], row['target_id'],
+                   row['created_at'], row['expires_at'], row['bet'], row['status'])
+
+class DuelRegistry:
+    """Вызовы на дуэль с индексами по игрокам и сроком ожидания.
+
+    Вызов сохраняется в pvp_duels при создании, поэтому ожидающие вызовы
+    переживают перезапуск (загружаются при первом обращении), а вызов,
+    созданный другим процессом, находится по номеру через БД. Принятие
+    вызова атомарно в БД: принять один вызов дважды нельзя даже из
+    разных процессов.
+    """
+
+    def __init__(self, db, ttl: float = DUEL_TTL, clock: Callable[[], float] = time.time):
+        self.db = db
+        self.ttl = ttl
+        self.clock = clock
+        self.duels: Dict[int, DuelChallenge] = {}
+        self.incoming: Dict[int, Set[int]] = {}  # player_id: номера вызовов игроку
+        self.outgoing: Dict[int, Set[int]] = {}  # player_id: номера вызовов от игрока
+        self._expiry: List[Tuple[float, int]] = []  # куча (срок, номер вызова)
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        now = self.clock()
+        self.db.delete_expired_pvp_duels(now)
+        for row in self.db.get_pending_pvp_duels(now):
+            self._index(DuelChallenge.from_row(row))
+
+    def _index(self, duel: DuelChallenge):
+        self.duels[duel.duel_id] = duel
+        self.incoming.setdefault(duel.target_id, set()).add(duel.duel_id)
+        self.outgoing.setdefault(duel.challenger_id, set()).add(duel.duel_id)
+        if duel.status == STATUS_PENDING:
+            heapq.heappush(self._expiry, (duel.expires_at, duel.duel_id))
+
+    def _unindex(self, duel: DuelChallenge):
+        # Запись в куче остается и пропускается при извлечении
+        self.duels.pop(duel.duel_id, None)
+        for index, player_id in ((self.incoming, duel.target_id), (self.outgoing, duel.challenger_id)):
+            ids = index.get(player_id)
+            if ids is not None:
+                ids.discard(duel.duel_id)
+                if not ids:
+                    del index[player_id]
+
+    def expire(self) -> List[DuelChallenge]:
+        """Снять истекшие ожидающие вызовы, вернуть их"""
+        self._ensure_loaded()
+        now = self.clock()
+        expired = []
+        while self._expiry and self._expiry[0][0] <= now:
+            _, duel_id = heapq.heappop(self._expiry)
+            duel = self.duels.get(duel_id)
+            if duel is None or duel.status != STATUS_PENDING:
+                continue
+            self._unindex(duel)
+            expired.append(duel)
+        if expired:
+            self.db.delete_pvp_duels([duel.duel_id for duel in expired])
+        return expired
+
+    def create(self, challenger_id: int, target_id: int, bet: int = 0,
+               players: Optional[Tuple[Any, Any]] = None) -> DuelChallenge:
+        """Создать вызов (повторный вызов того же игрока возвращает ожидающий)"""
+        self.expire()
+        for duel_id in self.outgoing.get(challenger_id, ()):
+            duel = self.duels[duel_id]
+            if duel.target_id == target_id and duel.status == STATUS_PENDING:
+                duel.players = players or duel.players
+                return duel
+
+        now = self.clock()
+        expires_at = now + self.ttl
+        duel_id = self.db.create_pvp_duel(challenger_id, target_id, bet, now, expires_at)
+        duel = DuelChallenge(duel_id, challenger_id, target_id, now, expires_at, bet, players=players)
+        self._index(duel)
+        return duel
+
+    def get(self, duel_id: int) -> Optional[DuelChallenge]:
+        """Вызов по номеру (созданный другим процессом читается из БД)"""
+        self.expire()
+        duel = self.duels.get(duel_id)
+        if duel is None:
+            row = self.db.get_pvp_duel(duel_id)
+            if row is None or row['expires_at'] <= self.clock() and row['status'] == STATUS_PENDING:
+                return None
+            duel = DuelChallenge.from_row(row)
+            self._index(duel)
+        return duel
+
+    def get_incoming(self, player_id: int) -> List[DuelChallenge]:
+        """Ожидающие вызовы игроку, старые первыми"""
+        self.expire()
+        ids = sorted(self.incoming.get(player_id, ()))
+        return [self.duels[duel_id] for duel_id in ids if self.duels[duel_id].status == STATUS_PENDING]
+
+    def get_outgoing(self, player_id: int) -> List[DuelChallenge]:
+        """Ожидающие вызовы от игрока, старые первыми"""
+        self.expire()
+        ids = sorted(self.outgoing.get(player_id, ()))
+        return [self.duels[duel_id] for duel_id in ids if self.duels[duel_id].status == STATUS_PENDING]
+
+    def claim(self, duel_id: int) -> bool:
+        """Перевести вызов в бой. False, если он уже принят или снят"""
+        duel = self.get(duel_id)
+        if duel is None or duel.status != STATUS_PENDING:
+            return False
+        if not self.db.claim_pvp_duel(duel_id):
+            self._unindex(duel)
+            return False
+        duel.status = STATUS_ACTIVE
+        return True
+
+    def release(self, duel_id: int):
+        """Вернуть принятый вызов в ожидание (дуэль не состоялась)"""
+        self.db.release_pvp_duel(duel_id)
+        duel = self.duels.get(duel_id)
+        if duel is not None and duel.status == STATUS_ACTIVE:
+            duel.status = STATUS_PENDING
+            heapq.heappush(self._expiry, (duel.expires_at, duel.duel_id))
+
+    def remove(self, duel_id: int) -> Optional[DuelChallenge]:
+        """Удалить вызов (отклонен или дуэль завершена)"""
+        duel = self.duels.get(duel_id)
+        if duel is not None:
+            self._unindex(duel)
+        self.db.delete_pvp_duels([duel_id])
+        return duel
@@ -0,0 +1,142 @@
+"""
+Быстрое проведение дуэлей:
+- Бой идет по числам (HP, урон, шанс крита) без объектов и строк
+- Без критов исход считается по формуле, с критами - коротким циклом
+- Лог боя хранится как маска критов и отрисовывается только по запросу
+"""
+import math
+import random
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+MAX_ROUNDS = 20
+PVP_DAMAGE_REDUCTION = 0.3  # уменьшение урона в PvP
+DEFAULT_CRIT_CHANCE = 0.1
+
+@dataclass
+class DuelFighter:
+    name: str
+    hp: int
+    damage: int       # урон удара без крита, уже с учетом защиты соперника
+    crit_chance: float
+
+def fighter_stats(player) -> Tuple[int, int, float]:
+    """Атака, защита и шанс крита игрока (по уровню, если характеристики не заданы)"""
+    attack = getattr(player, 'attack', None)
+    defense = getattr(player, 'defense', None)
+    if attack is None:
+        attack = 10 + player.level * 2
+    if defense is None:
+        defense = 5 + player.level
+    return attack, defense, getattr(player, 'crit_chance', DEFAULT_CRIT_CHANCE)
+
+def pvp_damage(attack: int, defense: int) -> int:
+    """Урон удара в PvP: как CombatSystem._calculate_damage, с PvP-снижением"""
+    return max(1, int(max(1, attack - defense // 2) * (1 - PVP_DAMAGE_REDUCTION)))
+
+def make_fighters(player1, player2) -> Tuple[DuelFighter, DuelFighter]:
+    attack1, defense1, crit1 = fighter_stats(player1)
+    attack2, defense2, crit2 = fighter_stats(player2)
+    return (
+        DuelFighter(player1.name, int(player1.current_hp), pvp_damage(attack1, defense2), crit1),
+        DuelFighter(player2.name, int(player2.current_hp), pvp_damage(attack2, defense1), crit2)
+    )
+
+class DuelLog:
+    """Лог дуэли, который превращается в строки только при чтении.
+
+    Хранит урон ударов без крита и маску критов (бит i - удар i по
+    порядку), этого достаточно, чтобы восстановить каждый раунд.
+    """
+    __slots__ = ('names', 'damage', 'crits', 'hits', '_rendered')
+
+    def __init__(self, names: Tuple[str, str], damage: Tuple[int, int], crits: int, hits: int):
+        self.names = names
+        self.damage = damage
+        self.crits = crits
+        self.hits = hits
+        self._rendered: Optional[List[str]] = None
+
+    def render(self) -> List[str]:
+        """Строки лога по раундам (как раньше возвращал _start_duel)"""
+        if self._rendered is None:
+            rounds = []
+            for hit in range(self.hits):
+                attacker = hit % 2
+                critical = self.crits >> hit & 1
+                damage = self.damage[attacker] * (2 if critical else 1)
+                line = f"\n{self.names[attacker]} наносит {damage} урона!"
+                if critical:
+                    line += " Критический удар!"
+                if attacker == 0:
+                    rounds.append(f"🔴 Раунд {hit // 2 + 1}:" + line)
+                else:
+                    rounds[-1] += line
+            self._rendered = rounds
+        return self._rendered
+
+    def __len__(self) -> int:
+        return (self.hits + 1) // 2
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.render())
+
+    def __getitem__(self, index):
+        return self.render()[index]
+
+def resolve_duel(fighter1: DuelFighter, fighter2: DuelFighter, rng: random.Random = random,
+                 max_rounds: int = MAX_ROUNDS) -> Tuple[Optional[int], int, int, int, DuelLog]:
+    """Провести дуэль: удары по очереди, первым бьет fighter1.
+
+    Возвращает индекс победителя (0, 1 или None при ничьей по таймауту),
+    число раундов, оставшееся HP бойцов и ленивый лог.
+    """
+    hp1, hp2 = fighter1.hp, fighter2.hp
+    damage1, damage2 = fighter1.damage, fighter2.damage
+    names = (fighter1.name, fighter2.name)
+
+    if hp1 <= 0 or hp2 <= 0:
+        return (1 if hp1 <= 0 else 0), 0, hp1, hp2, DuelLog(names, (damage1, damage2), 0, 0)
+
+    if fighter1.crit_chance <= 0 and fighter2.crit_chance <= 0:
+        # Без критов: число ударов до смерти каждого известно заранее
+        hits_to_kill1 = math.ceil(hp2 / damage1)
+        hits_to_kill2 = math.ceil(hp1 / damage2)
+        if hits_to_kill1 <= hits_to_kill2 and hits_to_kill1 <= max_rounds:
+            rounds = hits_to_kill1
+            hits = 2 * rounds - 1
+            return 0, rounds, hp1 - damage2 * (rounds - 1), 0, DuelLog(names, (damage1, damage2), 0, hits)
+        if hits_to_kill2 <= max_rounds:
+            rounds = hits_to_kill2
+            return 1, rounds, 0, hp2 - damage1 * rounds, DuelLog(names, (damage1, damage2), 0, 2 * rounds)
+        return (None, max_rounds, hp1 - damage2 * max_rounds, hp2 - damage1 * max_rounds,
+                DuelLog(names, (damage1, damage2), 0, 2 * max_rounds))
+
+    crit1, crit2 = fighter1.crit_chance, fighter2.crit_chance
+    roll = rng.random
+    crits = 0
+    hit = 0
+    rounds = 0
+    while hp1 > 0 and hp2 > 0 and rounds < max_rounds:
+        rounds += 1
+        if roll() < crit1:
+            hp2 -= damage1 * 2
+            crits |= 1 << hit
+        else:
+            hp2 -= damage1
+        hit += 1
+        if hp2 <= 0:
+            break
+        if roll() < crit2:
+            hp1 -= damage2 * 2
+            crits |= 1 << hit
+        else:
+            hp1 -= damage2
+        hit += 1
+
+    log = DuelLog(names, (damage1, damage2), crits, hit)
+    if hp2 <= 0:
+        return 0, rounds, hp1, 0, log
+    if hp1 <= 0:
+        return 1, rounds, 0, hp2, log
+    return None, rounds, hp1, hp2, log
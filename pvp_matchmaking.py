@@ -0,0 +1,236 @@
+"""
+Рейтинг и подбор матчей для арены:
+- Рейтинг Glicko (оценка силы и ее неопределенность) по типам арены
+- Очереди, разбитые на корзины по рейтингу
+- Допуск по рейтингу расширяется со временем ожидания
+- Команды 1v1, 3v3 и 5v5 с близкими средними рейтингами
+"""
+import math
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+DEFAULT_RATING = 1500.0
+DEFAULT_RD = 350.0   # неопределенность нового игрока
+MIN_RD = 30.0
+RD_GROWTH = 35.0     # рост неопределенности за день без боев
+
+_Q = math.log(10) / 400
+
+@dataclass
+class PvPRating:
+    rating: float = DEFAULT_RATING
+    rd: float = DEFAULT_RD
+    updated_at: float = 0.0  # unix-время последнего изменения
+
+def _g(rd: float) -> float:
+    return 1 / math.sqrt(1 + 3 * _Q ** 2 * rd ** 2 / math.pi ** 2)
+
+def expected_score(rating: float, opponent_rating: float, opponent_rd: float) -> float:
+    """Ожидаемый результат (вероятность победы) против соперника"""
+    return 1 / (1 + 10 ** (-_g(opponent_rd) * (rating - opponent_rating) / 400))
+
+def inflate_rd(rd: float, idle_days: float) -> float:
+    """Неопределенность рейтинга после перерыва в боях"""
+    return min(DEFAULT_RD, math.sqrt(rd ** 2 + RD_GROWTH ** 2 * max(0.0, idle_days)))
+
+def glicko_update(rating: float, rd: float, opponent_rating: float, opponent_rd: float,
+                  score: float) -> Tuple[float, float]:
+    """Новый рейтинг и неопределенность после боя (score: 1 - победа, 0.5 - ничья, 0 - поражение)"""
+    g = _g(opponent_rd)
+    expected = expected_score(rating, opponent_rating, opponent_rd)
+    d_squared = 1 / (_Q ** 2 * g ** 2 * expected * (1 - expected))
+    denominator = 1 / rd ** 2 + 1 / d_squared
+    new_rating = rating + _Q / denominator * g * (score - expected)
+    new_rd = max(MIN_RD, math.sqrt(1 / denominator))
+    return new_rating, new_rd
+
+def team_rating(ratings: List[PvPRating]) -> Tuple[float, float]:
+    """Команда как один соперник: средний рейтинг и среднеквадратичная неопределенность"""
+    rating = sum(r.rating for r in ratings) / len(ratings)
+    rd = math.sqrt(sum(r.rd ** 2 for r in ratings) / len(ratings))
+    return rating, rd
+
+@dataclass
+class ArenaQueueEntry:
+    player_id: int
+    arena_type: str
+    rating: float
+    queued_at: float
+    cancelled: bool = False
+
+class ArenaMatchmaker:
+    """Очередь арены с корзинами по рейтингу.
+
+    Для каждого типа арены игроки лежат в очередях по корзинам шириной
+    BUCKET_WIDTH. Матч собирается вокруг самого долго ждущего игрока
+    среди голов корзин: соперники берутся из ближайших корзин в пределах
+    его допуска, который растет со временем ожидания. Отмена и выбор в
+    матч только помечают запись, помеченные записи вычищаются лениво.
+    """
+    TEAM_SIZES = {
+        '1v1': 1,
+        '3v3': 3,
+        '5v5': 5
+    }
+    BUCKET_WIDTH = 50
+    BASE_TOLERANCE = 100.0
+    TOLERANCE_GROWTH = 10.0  # расширение допуска за секунду ожидания
+    MAX_TOLERANCE = 1000.0
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.buckets: Dict[str, Dict[int, Deque[ArenaQueueEntry]]] = {
+            arena_type: {} for arena_type in self.TEAM_SIZES
+        }
+        self.counts: Dict[str, int] = {arena_type: 0 for arena_type in self.TEAM_SIZES}
+        self.entries: Dict[int, ArenaQueueEntry] = {}  # player_id: запись в очереди
+        self._removed: Dict[Tuple[str, int], int] = {}  # помеченные записи по корзинам
+        self.wait_stats: Dict[str, Dict[str, float]] = {
+            arena_type: {'matched': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+            for arena_type in self.TEAM_SIZES
+        }
+
+    def _bucket(self, rating: float) -> int:
+        return int(rating // self.BUCKET_WIDTH)
+
+    def enqueue(self, player_id: int, arena_type: str, rating: float) -> bool:
+        """Поставить игрока в очередь"""
+        if arena_type not in self.TEAM_SIZES or player_id in self.entries:
+            return False
+
+        entry = ArenaQueueEntry(player_id, arena_type, rating, self.clock())
+        self.buckets[arena_type].setdefault(self._bucket(rating), deque()).append(entry)
+        self.counts[arena_type] += 1
+        self.entries[player_id] = entry
+        return True
+
+    def _mark_removed(self, entry: ArenaQueueEntry):
+        del self.entries[entry.player_id]
+        entry.cancelled = True
+        self.counts[entry.arena_type] -= 1
+
+        bucket_id = self._bucket(entry.rating)
+        key = (entry.arena_type, bucket_id)
+        removed = self._removed.get(key, 0) + 1
+        queue = self.buckets[entry.arena_type][bucket_id]
+        if removed * 2 > len(queue):
+            queue = deque(e for e in queue if not e.cancelled)
+            if queue:
+                self.buckets[entry.arena_type][bucket_id] = queue
+            else:
+                del self.buckets[entry.arena_type][bucket_id]
+            removed = 0
+        self._removed[key] = removed
+
+    def cancel(self, player_id: int) -> bool:
+        """Убрать игрока из очереди"""
+        entry = self.entries.get(player_id)
+        if entry is None:
+            return False
+        self._mark_removed(entry)
+        return True
+
+    def _head(self, arena_type: str, bucket_id: int) -> Optional[ArenaQueueEntry]:
+        """Первая действующая запись корзины (помеченные снимаются с головы)"""
+        queue = self.buckets[arena_type][bucket_id]
+        key = (arena_type, bucket_id)
+        while queue and queue[0].cancelled:
+            queue.popleft()
+            self._removed[key] -= 1
+        if not queue:
+            del self.buckets[arena_type][bucket_id]
+            return None
+        return queue[0]
+
+    def tolerance(self, entry: ArenaQueueEntry, now: float) -> float:
+        return min(self.MAX_TOLERANCE, self.BASE_TOLERANCE + self.TOLERANCE_GROWTH * (now - entry.queued_at))
+
+    def _gather(self, anchor: ArenaQueueEntry, needed: int, now: float) -> List[ArenaQueueEntry]:
+        """Подобрать игроков вокруг anchor: сначала ближайшие корзины, в корзине - ждущие дольше"""
+        buckets = self.buckets[anchor.arena_type]
+        tolerance = self.tolerance(anchor, now)
+        low = self._bucket(anchor.rating - tolerance)
+        high = self._bucket(anchor.rating + tolerance)
+        center = self._bucket(anchor.rating)
+
+        group = [anchor]
+        for distance in range(max(center - low, high - center) + 1):
+            for bucket_id in ((center,) if distance == 0 else (center - distance, center + distance)):
+                if not low <= bucket_id <= high or bucket_id not in buckets:
+                    continue
+                for entry in buckets[bucket_id]:
+                    if (not entry.cancelled and entry is not anchor
+                            and abs(entry.rating - anchor.rating) <= tolerance):
+                        group.append(entry)
+                        if len(group) == needed:
+                            return group
+        return group
+
+    @staticmethod
+    def _split_teams(group: List[ArenaQueueEntry]) -> Tuple[List[ArenaQueueEntry], List[ArenaQueueEntry]]:
+        """Разбить игроков на две команды змейкой по рейтингу (A B B A A B ...)"""
+        ordered = sorted(group, key=lambda e: e.rating, reverse=True)
+        team1, team2 = [], []
+        for i, entry in enumerate(ordered):
+            (team1 if i % 4 in (0, 3) else team2).append(entry)
+        return team1, team2
+
+    def _form_match(self, arena_type: str, now: float) -> Optional[Dict]:
+        needed = 2 * self.TEAM_SIZES[arena_type]
+        heads = []
+        for bucket_id in list(self.buckets[arena_type]):
+            head = self._head(arena_type, bucket_id)
+            if head is not None:
+                heads.append(head)
+        heads.sort(key=lambda e: e.queued_at)
+
+        for anchor in heads:
+            group = self._gather(anchor, needed, now)
+            if len(group) < needed:
+                continue
+
+            stats = self.wait_stats[arena_type]
+            for entry in group:
+                self._mark_removed(entry)
+                wait = now - entry.queued_at
+                stats['matched'] += 1
+                stats['total_wait'] += wait
+                stats['max_wait'] = max(stats['max_wait'], wait)
+
+            team1, team2 = self._split_teams(group)
+            return {
+                'type': arena_type,
+                'team1': [e.player_id for e in team1],
+                'team2': [e.player_id for e in team2],
+                'team1_rating': sum(e.rating for e in team1) / len(team1),
+                'team2_rating': sum(e.rating for e in team2) / len(team2)
+            }
+        return None
+
+    def form_matches(self, max_matches: Optional[int] = None) -> List[Dict]:
+        """Собрать все матчи, которые можно составить сейчас"""
+        now = self.clock()
+        matches = []
+        for arena_type, team_size in self.TEAM_SIZES.items():
+            while self.counts[arena_type] >= 2 * team_size:
+                if max_matches is not None and len(matches) >= max_matches:
+                    return matches
+                match = self._form_match(arena_type, now)
+                if match is None:
+                    break
+                matches.append(match)
+        return matches
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        """Время ожидания и размер очереди по типам арены"""
+        metrics = {}
+        for arena_type, stats in self.wait_stats.items():
+            metrics[arena_type] = {
+                'queued': self.counts[arena_type],
+                'matched': stats['matched'],
+                'avg_wait': stats['total_wait'] / stats['matched'] if stats['matched'] else 0.0,
+                'max_wait': stats['max_wait']
+            }
+        return metrics
@@ -0,0 +1,113 @@
+"""
+Присутствие игроков в PvP зонах:
+- Кто находится в каждой зоне, с ограничением max_players
+- Индекс по уровню внутри зоны: цели для атаки без перебора всех игроков
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set
+
+MAX_LEVEL_DIFFERENCE = 10  # максимальная разница уровней для атаки в PvP
+
+@dataclass
+class ZonePresence:
+    zone: str
+    level: int
+
+class ZonePresenceTracker:
+    """Игроки в PvP зонах с индексом по уровню.
+
+    Для каждой зоны хранится множество игроков и множества по точному
+    уровню. Цели атакующего лежат в 2 * MAX_LEVEL_DIFFERENCE + 1 соседних
+    уровнях его зоны, поэтому поиск целей не зависит от числа игроков
+    онлайн и тратит время только на подходящих.
+    """
+
+    def __init__(self, zones: Dict[str, Dict]):
+        self.zones = zones
+        self.occupants: Dict[str, Set[int]] = {zone: set() for zone in zones}
+        self.by_level: Dict[str, Dict[int, Set[int]]] = {zone: {} for zone in zones}
+        self.presence: Dict[int, ZonePresence] = {}  # player_id: где находится игрок
+
+    def zone_of(self, player_id: int) -> Optional[str]:
+        presence = self.presence.get(player_id)
+        return presence.zone if presence else None
+
+    def count(self, zone: str) -> int:
+        return len(self.occupants[zone])
+
+    def is_full(self, zone: str) -> bool:
+        return len(self.occupants[zone]) >= self.zones[zone]['max_players']
+
+    def _add(self, player_id: int, zone: str, level: int):
+        self.occupants[zone].add(player_id)
+        self.by_level[zone].setdefault(level, set()).add(player_id)
+        self.presence[player_id] = ZonePresence(zone, level)
+
+    def _remove(self, player_id: int, presence: ZonePresence):
+        self.occupants[presence.zone].discard(player_id)
+        bucket = self.by_level[presence.zone][presence.level]
+        bucket.discard(player_id)
+        if not bucket:
+            del self.by_level[presence.zone][presence.level]
+
+    def enter(self, player_id: int, zone: str, level: int) -> bool:
+        """Поместить игрока в зону (из другой зоны он переходит). False, если зона заполнена"""
+        current = self.presence.get(player_id)
+        if current is not None and current.zone == zone:
+            self.update_level(player_id, level)
+            return True
+        if self.is_full(zone):
+            return False
+        if current is not None:
+            self._remove(player_id, current)
+        self._add(player_id, zone, level)
+        return True
+
+    def leave(self, player_id: int) -> Optional[str]:
+        """Убрать игрока из зоны. Возвращает зону, в которой он был"""
+        presence = self.presence.pop(player_id, None)
+        if presence is None:
+            return None
+        self._remove(player_id, presence)
+        return presence.zone
+
+    def update_level(self, player_id: int, level: int):
+        """Перенести игрока в корзину нового уровня (после повышения уровня)"""
+        presence = self.presence.get(player_id)
+        if presence is None or presence.level == level:
+            return
+        self._remove(player_id, presence)
+        self._add(player_id, presence.zone, level)
+
+    def iter_targets(self, player_id: int,
+                     max_level_difference: int = MAX_LEVEL_DIFFERENCE) -> Iterator[int]:
+        """Игроки той же зоны, которых можно атаковать (ближайшие по уровню - первыми)"""
+        presence = self.presence.get(player_id)
+        if presence is None:
+            return
+        levels = self.by_level[presence.zone]
+        for distance in range(max_level_difference + 1):
+            for level in ((presence.level,) if distance == 0
+                          else (presence.level - distance, presence.level + distance)):
+                for target_id in levels.get(level, ()):
+                    if target_id != player_id:
+                        yield target_id
+
+    def get_targets(self, player_id: int, limit: Optional[int] = None,
+                    max_level_difference: int = MAX_LEVEL_DIFFERENCE) -> List[int]:
+        """Список целей атакующего (не больше limit)"""
+        targets = []
+        for target_id in self.iter_targets(player_id, max_level_difference):
+            targets.append(target_id)
+            if limit is not None and len(targets) >= limit:
+                break
+        return targets
+
+    def can_attack(self, attacker_id: int, defender_id: int,
+                   max_level_difference: int = MAX_LEVEL_DIFFERENCE) -> bool:
+        """Оба в одной зоне и разница уровней допустима"""
+        attacker = self.presence.get(attacker_id)
+        defender = self.presence.get(defender_id)
+        return (attacker is not None and defender is not None and attacker_id != defender_id
+                and attacker.zone == defender.zone
+                and abs(attacker.level - defender.level) <= max_level_difference)
@@ -1,42 +1,40 @@
 import logging
-import random
+import os
 import asyncio
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
 from enum import Enum, auto
 from datetime import datetime, timedelta
 from database import Database
 from player import Player
 from combat import CombatSystem
 from world import World
+from raid_combat import (
+    RaidBoss, RaidCombatState, RaidDifficulty, STUN_DURATION, load_bosses, scaled_boss_health
+)
+from raid_log import RaidRecorder
+from raid_loot import LOOT_ROLLS, LootEngine, LootResult
 
 logger = logging.getLogger(__name__)
 
-class RaidDifficulty(Enum):
-    NORMAL = auto()
-    HEROIC = auto()
-    MYTHIC = auto()
-
 class RaidStatus(Enum):
     RECRUITING = auto()
     IN_PROGRESS = auto()
     COMPLETED = auto()
     FAILED = auto()
 
-@dataclass
-class RaidBoss:
-    id: str
-    name: str
-    health: int
-    abilities: List[Dict]
-    enrage_timer: int  # в секундах
-    loot_table: Dict[str, float]
-
 @dataclass
 class RaidMember:
     player: Player
     role: str  # "tank", "healer", "dps"
     ready: bool = False
+    damage_done: float = 0.0
+    healing_done: float = 0.0
+    loot_rolls: Dict[str, str] = field(default_factory=dict)  # item_id: need/greed/pass
 
 @dataclass
 class Raid:
@@ -48,79 +46,318 @@ class Raid:
     start_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
     current_boss_health: Optional[int] = None
+    elapsed: float = 0.0  # время боя в секундах симуляции
+    ability_ready_at: Dict[int, float] = field(default_factory=dict)  # индекс способности: время готовности
+    combat_state: Optional[RaidCombatState] = field(default=None, repr=False)
+    recorder: Optional[RaidRecorder] = field(default=None, repr=False)
+
+@dataclass
+class RaidQueueEntry:
+    player: Player
+    role: str
+    boss_id: str
+    difficulty: RaidDifficulty
+    queued_at: float
+    cancelled: bool = False
+
+class RaidMatchmaker:
+    """Очередь поиска рейда с разбивкой по ролям.
+
+    Для каждой пары (босс, сложность) хранится по очереди на роль.
+    Постановка, извлечение и отмена работают за O(1): отмена лишь помечает
+    запись, а помеченные записи пропускаются при извлечении и вычищаются,
+    когда их становится больше половины очереди.
+    """
+    # Роль: (минимум для сбора рейда, максимум в рейде)
+    ROLE_QUOTAS = {
+        "tank": (2, 2),
+        "healer": (3, 3),
+        "dps": (5, 10)
+    }
+
+    def __init__(self):
+        self.queues: Dict[Tuple[str, RaidDifficulty], Dict[str, Deque[RaidQueueEntry]]] = {}
+        self.counts: Dict[Tuple[str, RaidDifficulty], Dict[str, int]] = {}
+        self.entries: Dict[int, RaidQueueEntry] = {}  # player_id: запись в очереди
+        self._cancelled: Dict[Tuple[str, RaidDifficulty], Dict[str, int]] = {}
+        self._ready_keys: Set[Tuple[str, RaidDifficulty]] = set()
+        self.wait_stats: Dict[str, Dict[str, float]] = {
+            role: {'matched': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+            for role in self.ROLE_QUOTAS
+        }
+
+    def _ensure_key(self, key: Tuple[str, RaidDifficulty]):
+        if key not in self.queues:
+            self.queues[key] = {role: deque() for role in self.ROLE_QUOTAS}
+            self.counts[key] = {role: 0 for role in self.ROLE_QUOTAS}
+            self._cancelled[key] = {role: 0 for role in self.ROLE_QUOTAS}
+
+    def _quotas_met(self, key: Tuple[str, RaidDifficulty]) -> bool:
+        counts = self.counts[key]
+        return all(counts[role] >= minimum for role, (minimum, _) in self.ROLE_QUOTAS.items())
+
+    def enqueue(self, player: Player, role: str, boss_id: str, difficulty: RaidDifficulty) -> bool:
+        """Поставить игрока в очередь"""
+        if role not in self.ROLE_QUOTAS or player.user_id in self.entries:
+            return False
+
+        key = (boss_id, difficulty)
+        self._ensure_key(key)
+        entry = RaidQueueEntry(player, role, boss_id, difficulty, time.monotonic())
+        self.queues[key][role].append(entry)
+        self.counts[key][role] += 1
+        self.entries[player.user_id] = entry
+        if self._quotas_met(key):
+            self._ready_keys.add(key)
+        return True
+
+    def cancel(self, player_id: int) -> bool:
+        """Убрать игрока из очереди"""
+        entry = self.entries.pop(player_id, None)
+        if entry is None:
+            return False
+
+        key = (entry.boss_id, entry.difficulty)
+        entry.cancelled = True
+        self.counts[key][entry.role] -= 1
+        self._cancelled[key][entry.role] += 1
+
+        queue = self.queues[key][entry.role]
+        if self._cancelled[key][entry.role] * 2 > len(queue):
+            self.queues[key][entry.role] = deque(e for e in queue if not e.cancelled)
+            self._cancelled[key][entry.role] = 0
+        if not self._quotas_met(key):
+            self._ready_keys.discard(key)
+        return True
+
+    def _pop(self, key: Tuple[str, RaidDifficulty], role: str) -> RaidQueueEntry:
+        queue = self.queues[key][role]
+        while True:
+            entry = queue.popleft()
+            if not entry.cancelled:
+                break
+            self._cancelled[key][role] -= 1
+
+        del self.entries[entry.player.user_id]
+        self.counts[key][role] -= 1
+
+        wait = time.monotonic() - entry.queued_at
+        stats = self.wait_stats[role]
+        stats['matched'] += 1
+        stats['total_wait'] += wait
+        stats['max_wait'] = max(stats['max_wait'], wait)
+        return entry
+
+    def form_groups(self) -> List[Tuple[str, RaidDifficulty, List[RaidQueueEntry]]]:
+        """Собрать все группы, для которых набраны квоты ролей"""
+        groups = []
+        for key in list(self._ready_keys):
+            while self._quotas_met(key):
+                group = []
+                for role, (_, maximum) in self.ROLE_QUOTAS.items():
+                    for _ in range(min(maximum, self.counts[key][role])):
+                        group.append(self._pop(key, role))
+                groups.append((key[0], key[1], group))
+            self._ready_keys.discard(key)
+        return groups
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        """Время ожидания и размер очереди по ролям"""
+        metrics = {}
+        for role, stats in self.wait_stats.items():
+            metrics[role] = {
+                'queued': sum(counts[role] for counts in self.counts.values()),
+                'matched': stats['matched'],
+                'avg_wait': stats['total_wait'] / stats['matched'] if stats['matched'] else 0.0,
+                'max_wait': stats['max_wait']
+            }
+        return metrics
+
+class RaidResultWriter:
+    """Фоновая запись результатов рейдов.
+
+    Завершение рейда только ставит результат в очередь. Фоновая задача
+    забирает все накопившиеся результаты и пишет их одной транзакцией
+    через Database.save_raid_results в отдельном потоке со своим
+    соединением, поэтому ни цикл тиков, ни event loop не ждут БД.
+    Результаты, которые не удалось записать, возвращаются в очередь
+    (не больше max_attempts попыток).
+    """
+
+    def __init__(self, db: Database, max_batch: int = 100, max_attempts: int = 3):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Один поток: соединение sqlite нельзя использовать из разных потоков
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="raid-results")
+        self._writer_db: Optional[Database] = None
+
+    def submit(self, result: Dict, attempt: int = 0):
+        """Поставить результат рейда в очередь на запись"""
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        self.queue.put_nowait((result, attempt))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                failed = await loop.run_in_executor(self._executor, self._write, [r for r, _ in batch])
+            except Exception as e:
+                logger.error(f"Failed to save {len(batch)} raid results: {e}")
+                failed = [r for r, _ in batch]
+
+            attempts = {id(result): attempt for result, attempt in batch}
+            for result in failed:
+                attempt = attempts[id(result)] + 1
+                if attempt < self.max_attempts:
+                    self.submit(result, attempt)
+                else:
+                    logger.error(f"Dropping raid result {result.get('raid_id')} after {attempt} attempts")
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write(self, batch: List[Dict]) -> List[Dict]:
+        # Выполняется в потоке записи
+        if self._writer_db is None:
+            self._writer_db = Database(self.db.db_path)
+        return self._writer_db.save_raid_results(batch)
+
+    async def flush(self):
+        """Дождаться записи всех результатов из очереди"""
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def stop(self):
+        """Записать оставшиеся результаты и остановить фоновую задачу"""
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class RaidScheduler:
+    """Планировщик рейдов с фиксированным шагом.
+
+    Одна asyncio-задача вызывает _raid_tick для всех активных рейдов раз
+    в tick_interval секунд. Если тик не уложился в интервал, следующий
+    запускается сразу, а отставание попадает в статистику.
+    """
+
+    def __init__(self, raid_manager: "RaidManager", tick_interval: float = 1.0):
+        self.raid_manager = raid_manager
+        self.tick_interval = tick_interval
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'ticks': 0,
+            'raids_ticked': 0,
+            'last_tick_time': 0.0,
+            'max_tick_time': 0.0,
+            'last_lag': 0.0,
+            'max_lag': 0.0
+        }
+
+    def start(self) -> asyncio.Task:
+        """Запустить цикл тиков в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        """Остановить цикл тиков"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            # Даже при отставании уступаем управление другим задачам
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            now = time.monotonic()
+
+            lag = now - next_tick
+            await self.tick()
+            tick_time = time.monotonic() - now
+
+            self.stats['last_lag'] = lag
+            self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+            self.stats['last_tick_time'] = tick_time
+            self.stats['max_tick_time'] = max(self.stats['max_tick_time'], tick_time)
+            if tick_time > self.tick_interval:
+                logger.warning(f"Raid tick took {tick_time:.3f}s (interval {self.tick_interval}s)")
+
+            next_tick += self.tick_interval
+            # Не пытаемся догонять пропущенные тики пачкой
+            if next_tick < time.monotonic():
+                next_tick = time.monotonic()
+
+    async def tick(self):
+        """Один тик всех активных рейдов"""
+        raids = [
+            raid for raid in self.raid_manager.active_raids.values()
+            if raid.status == RaidStatus.IN_PROGRESS
+        ]
+        for raid in raids:
+            await self.raid_manager._raid_tick(raid, self.tick_interval)
+        self.stats['ticks'] += 1
+        self.stats['raids_ticked'] += len(raids)
 
 class RaidManager:
-    def __init__(self, db: Database, combat_system: CombatSystem, world: World):
+    MAX_RAID_SIZE = 25
+
+    def __init__(self, db: Database, combat_system: CombatSystem, world: World,
+                 combat_log_dir: Optional[str] = None):
         self.db = db
         self.combat_system = combat_system
         self.world = world
+        self.combat_log_dir = combat_log_dir  # None - журнал боя не пишется
         self.active_raids: Dict[str, Raid] = {}
-        self.raid_queue: List[Tuple[Player, str]] = []  # (player, role)
+        self.matchmaker = RaidMatchmaker()
+        self.player_raids: Dict[int, str] = {}  # player_id: raid_id
+        # (босс, сложность, статус): рейды со свободными местами (dict как упорядоченное множество)
+        self.open_raids: Dict[Tuple[str, RaidDifficulty, RaidStatus], Dict[str, None]] = {}
+        self._open_raid_keys: Dict[str, Tuple[str, RaidDifficulty, RaidStatus]] = {}
         self.bosses: Dict[str, RaidBoss] = self._load_bosses()
+        self.scheduler = RaidScheduler(self)
+        self.result_writer = RaidResultWriter(db)
+        # Номера рейдов: микросекунды запуска и дальше по одному, без повторов
+        self._raid_ids = count(time.time_ns() // 1000)
+        self.loot_engine = LootEngine(db)
         self._initialize_db()
 
     def _initialize_db(self):
         """Создать необходимые таблицы в БД"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS raid_history (
-                    raid_id TEXT PRIMARY KEY,
-                    boss_id TEXT,
-                    difficulty TEXT,
-                    status TEXT,
-                    start_time TEXT,
-                    end_time TEXT,
-                    members TEXT
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS raid_loot (
-                    raid_id TEXT,
-                    player_id INTEGER,
-                    item_id TEXT,
-                    timestamp TEXT,
-                    PRIMARY KEY (raid_id, player_id, item_id)
-                )
-            """)
-            conn.commit()
+        # Единая схема raid_history / raid_participants / raid_loot описана в Database
+        self.db.init_raid_tables()
 
     def _load_bosses(self) -> Dict[str, RaidBoss]:
         """Загрузить боссов для рейдов из конфига"""
-        return {
-            "ancient_dragon": RaidBoss(
-                id="ancient_dragon",
-                name="Древний Дракон",
-                health=500000,
-                abilities=[
-                    {
-                        "name": "Огненное дыхание",
-                        "damage": 1500,
-                        "cooldown": 30,
-                        "aoe": True
-                    },
-                    {
-                        "name": "Удар хвостом",
-                        "damage": 800,
-                        "cooldown": 20,
-                        "stun_chance": 0.3
-                    }
-                ],
-                enrage_timer=600,
-                loot_table={
-                    "dragon_scale": 0.7,
-                    "flame_sword": 0.2,
-                    "dragon_heart": 0.1
-                }
-            )
-        }
+        return load_bosses()
 
     async def create_raid(self, leader: Player, boss_id: str, difficulty: RaidDifficulty) -> Optional[Raid]:
         """Создать новый рейд"""
         if boss_id not in self.bosses:
             return None
+        if leader.user_id in self.player_raids:
+            return None
 
-        raid_id = f"raid_{leader.user_id}_{int(datetime.now().timestamp())}"
+        raid_id = f"raid_{leader.user_id}_{next(self._raid_ids)}"
         new_raid = Raid(
             raid_id=raid_id,
             boss=self.bosses[boss_id],
@@ -131,16 +368,33 @@ class RaidManager:
         )
 
         self.active_raids[raid_id] = new_raid
+        self._add_player(leader, raid_id)
+        self._index_raid(new_raid)
         return new_raid
 
+    def _add_player(self, player: Player, raid_id: str):
+        self.player_raids[player.user_id] = raid_id
+        # Игрок, попавший в рейд, больше не ищет группу
+        self.matchmaker.cancel(player.user_id)
+
+    def _index_raid(self, raid: Raid):
+        """Обновить положение рейда в наборах открытых рейдов"""
+        old_key = self._open_raid_keys.pop(raid.raid_id, None)
+        if old_key is not None:
+            raids = self.open_raids[old_key]
+            raids.pop(raid.raid_id, None)
+            if not raids:
+                del self.open_raids[old_key]
+
+        if raid.raid_id not in self.active_raids or len(raid.members) >= self.MAX_RAID_SIZE:
+            return
+        key = (raid.boss.id, raid.difficulty, raid.status)
+        self.open_raids.setdefault(key, {})[raid.raid_id] = None
+        self._open_raid_keys[raid.raid_id] = key
+
     def _get_scaled_boss_health(self, boss_id: str, difficulty: RaidDifficulty) -> int:
         """Получить здоровье босса с учетом сложности"""
-        base_health = self.bosses[boss_id].health
-        if difficulty == RaidDifficulty.HEROIC:
-            return int(base_health * 1.5)
-        elif difficulty == RaidDifficulty.MYTHIC:
-            return int(base_health * 2.0)
-        return base_health
+        return scaled_boss_health(self.bosses[boss_id], difficulty)
 
     async def join_raid(self, raid_id: str, player: Player, role: str) -> bool:
         """Присоединиться к рейду"""
@@ -149,15 +403,24 @@ class RaidManager:
 
         raid = self.active_raids[raid_id]
 
-        # Проверка дублирования игрока
-        if any(m.player.user_id == player.user_id for m in raid.members):
+        # Игрок уже в этом или другом рейде
+        if player.user_id in self.player_raids:
             return False
 
         # Проверка ролей (можно расширить)
         if role not in ["tank", "healer", "dps"]:
             return False
 
+        if len(raid.members) >= self.MAX_RAID_SIZE:
+            return False
+
+        # Накопленное старым составом переносится до изменения состава, как в leave_raid
+        if raid.combat_state is not None:
+            raid.combat_state.sync_to_players(raid.members, raid.elapsed)
         raid.members.append(RaidMember(player=player, role=role))
+        self._add_player(player, raid_id)
+        self._index_raid(raid)
+        self._rebuild_combat_state(raid)
         return True
 
     async def leave_raid(self, raid_id: str, player: Player) -> bool:
@@ -165,12 +428,23 @@ class RaidManager:
         if raid_id not in self.active_raids:
             return False
 
+        if self.player_raids.get(player.user_id) != raid_id:
+            return False
+
         raid = self.active_raids[raid_id]
+        if raid.combat_state is not None:
+            raid.combat_state.sync_to_players(raid.members, raid.elapsed)
         raid.members = [m for m in raid.members if m.player.user_id != player.user_id]
+        del self.player_raids[player.user_id]
+        self._rebuild_combat_state(raid)
 
-        # Если рейд пуст - удалить
+        # Если рейд пуст - удалить (журнал боя закрывается, как в _end_raid)
         if not raid.members:
             del self.active_raids[raid_id]
+            if raid.recorder is not None:
+                raid.recorder.close("ABANDONED")
+                raid.recorder = None
+        self._index_raid(raid)
 
         return True
 
@@ -190,46 +464,84 @@ class RaidManager:
             return False
 
         raid.status = RaidStatus.IN_PROGRESS
+        self._index_raid(raid)
         raid.start_time = datetime.now()
+        raid.elapsed = 0.0
+        # Первое применение каждой способности - после ее перезарядки
+        raid.ability_ready_at = {
+            i: float(ability.get("cooldown", 0))
+            for i, ability in enumerate(raid.boss.abilities)
+        }
+        raid.combat_state = RaidCombatState(raid.members)
+        if self.combat_log_dir is not None:
+            raid.recorder = RaidRecorder(
+                os.path.join(self.combat_log_dir, f"{raid.raid_id}.rlog"),
+                raid.raid_id, raid.boss.id, raid.difficulty.name,
+                [ability["name"] for ability in raid.boss.abilities]
+            )
+            raid.recorder.set_roster(raid.members)
         return True
 
-    async def _raid_tick(self, raid: Raid):
-        """Обработка одного тика рейда (вызывается периодически)"""
+    def _rebuild_combat_state(self, raid: Raid):
+        """Пересоздать массивы участников после изменения состава идущего рейда.
+
+        Накопленное старыми массивами вызывающий переносит в игроков до
+        изменения состава: индексы массивов соответствуют старому составу.
+        """
         if raid.status != RaidStatus.IN_PROGRESS:
             return
+        raid.combat_state = RaidCombatState(raid.members)
+        if raid.recorder is not None:
+            raid.recorder.set_roster(raid.members)
+
+    def start_scheduler(self) -> asyncio.Task:
+        """Запустить планировщик тиков рейдов"""
+        return self.scheduler.start()
+
+    async def _raid_tick(self, raid: Raid, dt: float = 1.0):
+        """Обработка одного тика рейда (вызывается планировщиком)"""
+        if raid.status != RaidStatus.IN_PROGRESS:
+            return
+
+        raid.elapsed += dt
 
         # Проверка таймера энрейдж
-        elapsed = (datetime.now() - raid.start_time).total_seconds()
-        if elapsed > raid.boss.enrage_timer:
+        if raid.elapsed > raid.boss.enrage_timer:
             await self._end_raid(raid.raid_id, success=False)
             return
 
-        # Обработка способностей босса
-        for ability in raid.boss.abilities:
-            # Упрощенная логика использования способностей
-            if random.random() < 0.1:  # 10% шанс использовать способность
-                await self._use_boss_ability(raid, ability)
+        # Ход участников: урон по боссу и лечение
+        raid.current_boss_health -= raid.combat_state.apply_member_actions(raid.elapsed, dt)
+        if raid.recorder is not None:
+            raid.recorder.record_member_actions(
+                raid.elapsed, raid.combat_state.tick_damage_done,
+                raid.combat_state.tick_healing_done, raid.current_boss_health
+            )
+
+        # Обработка способностей босса с учетом перезарядки
+        for i, ability in enumerate(raid.boss.abilities):
+            if raid.elapsed >= raid.ability_ready_at.get(i, 0.0):
+                raid.ability_ready_at[i] = raid.elapsed + ability.get("cooldown", 0)
+                await self._use_boss_ability(raid, ability, i)
+
+        # Весь рейд погиб
+        if raid.combat_state.alive_count() == 0:
+            await self._end_raid(raid.raid_id, success=False)
+            return
 
         # Проверка победы
         if raid.current_boss_health <= 0:
             await self._end_raid(raid.raid_id, success=True)
 
-    async def _use_boss_ability(self, raid: Raid, ability: Dict):
+    async def _use_boss_ability(self, raid: Raid, ability: Dict, ability_index: int = 0):
         """Обработка способности босса"""
-        # Логика урона по игрокам
-        for member in raid.members:
-            damage = ability["damage"]
-            
-            # Модификаторы для танков
-            if member.role == "tank":
-                damage *= 0.6
-            
-            # Применение урона
-            member.player.take_damage(int(damage))
-            
-            # Дополнительные эффекты
-            if ability.get("stun_chance", 0) > random.random():
-                member.player.apply_effect("stun", duration=2)
+        # Урон (с учетом множителя танков) и оглушения применяются
+        # ко всем участникам одной векторной операцией
+        damage, stunned = raid.combat_state.apply_boss_ability(ability, raid.elapsed)
+        if raid.recorder is not None:
+            raid.recorder.record_ability(
+                raid.elapsed, ability_index, ability["damage"], damage, stunned, STUN_DURATION
+            )
 
     async def _end_raid(self, raid_id: str, success: bool):
         """Завершить рейд"""
@@ -240,120 +552,121 @@ class RaidManager:
         raid.status = RaidStatus.COMPLETED if success else RaidStatus.FAILED
         raid.end_time = datetime.now()
 
+        if raid.combat_state is not None:
+            raid.combat_state.sync_to_players(raid.members, raid.elapsed)
+        if raid.recorder is not None:
+            raid.recorder.close(raid.status.name)
+            raid.recorder = None
+
         # Награждение игроков
-        if success:
-            await self._distribute_loot(raid)
+        loot = await self._distribute_loot(raid) if success else LootResult()
 
-        # Сохранение в историю
-        await self._save_raid_history(raid)
+        # Сохранение в историю вместе с долгами добычи (в фоне, без ожидания записи)
+        self.result_writer.submit(self._build_raid_result(raid, loot))
 
         # Очистка
         del self.active_raids[raid_id]
+        self._index_raid(raid)
+        for member in raid.members:
+            if self.player_raids.get(member.player.user_id) == raid_id:
+                del self.player_raids[member.player.user_id]
 
-    async def _distribute_loot(self, raid: Raid):
+    async def _distribute_loot(self, raid: Raid) -> LootResult:
         """Распределить добычу после успешного рейда"""
-        loot_winners = {}
-        
-        for item_id, drop_chance in raid.boss.loot_table.items():
-            if random.random() < drop_chance:
-                # Упрощенная система распределения лута
-                eligible_players = [m.player for m in raid.members]
-                winner = random.choice(eligible_players)
-                
-                if winner.user_id not in loot_winners:
-                    loot_winners[winner.user_id] = []
-                loot_winners[winner.user_id].append(item_id)
-                
-                winner.add_to_inventory(item_id)
-
-        # Сохранение информации о луте
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            for player_id, items in loot_winners.items():
-                for item_id in items:
-                    cursor.execute("""
-                        INSERT INTO raid_loot 
-                        (raid_id, player_id, item_id, timestamp) 
-                        VALUES (?, ?, ?, ?)
-                    """, (
-                        raid.raid_id,
-                        player_id,
-                        item_id,
-                        datetime.now().isoformat()
-                    ))
-            conn.commit()
-
-    async def _save_raid_history(self, raid: Raid):
-        """Сохранить информацию о рейде в БД"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO raid_history 
-                (raid_id, boss_id, difficulty, status, start_time, end_time, members) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                raid.raid_id,
-                raid.boss.id,
-                raid.difficulty.name,
-                raid.status.name,
-                raid.start_time.isoformat() if raid.start_time else None,
-                raid.end_time.isoformat() if raid.end_time else None,
-                json.dumps([m.player.user_id for m in raid.members])
-            ))
-            conn.commit()
+        loot = self.loot_engine.distribute(
+            raid.boss.id,
+            raid.boss.loot_table,
+            [m.player.user_id for m in raid.members],
+            {m.player.user_id: m.loot_rolls for m in raid.members if m.loot_rolls}
+        )
+
+        players = {m.player.user_id: m.player for m in raid.members}
+        for player_id, items in loot.winners.items():
+            for item_id in items:
+                players[player_id].add_to_inventory(item_id)
+
+        return loot
+
+    def set_loot_roll(self, player_id: int, item_id: str, roll: str) -> bool:
+        """Заявить бросок (need/greed/pass) на предмет добычи текущего рейда"""
+        if roll not in LOOT_ROLLS:
+            return False
+        raid = self.active_raids.get(self.player_raids.get(player_id))
+        if raid is None or item_id not in raid.boss.loot_table:
+            return False
+        for member in raid.members:
+            if member.player.user_id == player_id:
+                member.loot_rolls[item_id] = roll
+                return True
+        return False
+
+    def _build_raid_result(self, raid: Raid, loot: LootResult) -> Dict:
+        """Собрать результат рейда для записи в БД"""
+        return {
+            'raid_id': raid.raid_id,
+            'boss_id': raid.boss.id,
+            'difficulty': raid.difficulty.name,
+            'start_time': raid.start_time.isoformat() if raid.start_time else None,
+            'end_time': raid.end_time.isoformat() if raid.end_time else None,
+            'status': raid.status.name,
+            'participants': [
+                {
+                    'player_id': m.player.user_id,
+                    'role': m.role,
+                    'damage_done': int(m.damage_done),
+                    'healing_done': int(m.healing_done),
+                    'loot_received': loot.winners.get(m.player.user_id, [])
+                }
+                for m in raid.members
+            ],
+            'loot_debts': loot.debts
+        }
 
     async def get_player_raid(self, player_id: int) -> Optional[Raid]:
         """Получить рейд, в котором состоит игрок"""
-        for raid in self.active_raids.values():
-            if any(m.player.user_id == player_id for m in raid.members):
-                return raid
-        return None
+        raid_id = self.player_raids.get(player_id)
+        if raid_id is None:
+            return None
+        return self.active_raids.get(raid_id)
 
     async def find_raid(self, boss_id: str, difficulty: RaidDifficulty) -> Optional[Raid]:
         """Найти подходящий рейд для присоединения"""
-        for raid in self.active_raids.values():
-            if (raid.boss.id == boss_id and 
-                raid.difficulty == difficulty and 
-                raid.status == RaidStatus.RECRUITING and
-                len(raid.members) < 25):  # Максимальный размер рейда
-                return raid
-        return None
-
-    async def queue_for_raid(self, player: Player, role: str) -> bool:
+        raids = self.open_raids.get((boss_id, difficulty, RaidStatus.RECRUITING))
+        if not raids:
+            return None
+        return self.active_raids[next(iter(raids))]
+
+    async def queue_for_raid(self, player: Player, role: str, boss_id: str = "ancient_dragon",
+                             difficulty: RaidDifficulty = RaidDifficulty.NORMAL) -> bool:
         """Встать в очередь на поиск рейда"""
-        self.raid_queue.append((player, role))
+        if boss_id not in self.bosses or player.user_id in self.player_raids:
+            return False
+        if not self.matchmaker.enqueue(player, role, boss_id, difficulty):
+            return False
+
+        # Рейд собирается сразу, как только набраны квоты ролей
+        await self.process_raid_queue()
         return True
 
-    async def process_raid_queue(self):
-        """Обработать очередь и создать рейды"""
-        # Группировка по ролям
-        tanks = [p for p, r in self.raid_queue if r == "tank"]
-        healers = [p for p, r in self.raid_queue if r == "healer"]
-        dps = [p for p, r in self.raid_queue if r == "dps"]
-
-        # Проверка минимальных требований
-        if len(tanks) >= 2 and len(healers) >= 3 and len(dps) >= 5:
-            # Создать новый рейд
-            leader = dps[0]  # Первый DPS становится лидером
-            raid = await self.create_raid(leader, "ancient_dragon", RaidDifficulty.NORMAL)
+    async def leave_raid_queue(self, player: Player) -> bool:
+        """Выйти из очереди на поиск рейда"""
+        return self.matchmaker.cancel(player.user_id)
+
+    async def process_raid_queue(self) -> List[Raid]:
+        """Обработать очередь и создать рейды для всех набранных групп"""
+        formed = []
+        for boss_id, difficulty, group in self.matchmaker.form_groups():
+            # Первый DPS становится лидером
+            leader = next(entry for entry in group if entry.role == "dps")
+            raid = await self.create_raid(leader.player, boss_id, difficulty)
             
             # Добавить участников
-            for tank in tanks[:2]:
-                await self.join_raid(raid.raid_id, tank, "tank")
-            
-            for healer in healers[:3]:
-                await self.join_raid(raid.raid_id, healer, "healer")
-            
-            for dps_player in dps[:10]:  # Ограничение на 10 DPS
-                await self.join_raid(raid.raid_id, dps_player, "dps")
-            
-            # Удалить добавленных игроков из очереди
-            self.raid_queue = [p for p in self.raid_queue if p[0] not in [tank for tank in tanks[:2]] and
-                                                           p[0] not in [healer for healer in healers[:3]] and
-                                                           p[0] not in [dps_p for dps_p in dps[:10]]]
+            for entry in group:
+                if entry is not leader:
+                    await self.join_raid(raid.raid_id, entry.player, entry.role)
             
-            return raid
-        return None
+            formed.append(raid)
+        return formed
 
     async def get_raid_status(self, raid_id: str) -> Dict:
         """Получить статус рейда"""
@@ -361,6 +674,8 @@ class RaidManager:
             return {"error": "Raid not found"}
         
         raid = self.active_raids[raid_id]
+        if raid.combat_state is not None:
+            raid.combat_state.sync_to_players(raid.members, raid.elapsed)
         return {
             "boss": raid.boss.name,
             "difficulty": raid.difficulty.name,
@@ -369,7 +684,9 @@ class RaidManager:
             "members": [{
                 "name": m.player.name,
                 "role": m.role,
-                "ready": m.ready
-            } for m in raid.members],
+                "ready": m.ready,
+                "hp": (int(raid.combat_state.hp[i]) if raid.combat_state is not None
+                       else m.player.current_hp)
+            } for i, m in enumerate(raid.members)],
             "time_elapsed": (datetime.now() - raid.start_time).total_seconds() if raid.start_time else 0
         }
@@ -0,0 +1,222 @@
+"""
+Правила боя рейда без зависимостей от бота и БД:
+- Боссы рейдов и множители здоровья по сложности
+- HP, множители входящего урона и оглушения участников
+- Векторное применение способностей босса ко всем участникам сразу
+- Урон по боссу и лечение от участников
+- Перенос накопленного урона и эффектов в объекты Player
+"""
+import math
+from dataclasses import dataclass
+from enum import Enum, auto
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+class RaidDifficulty(Enum):
+    NORMAL = auto()
+    HEROIC = auto()
+    MYTHIC = auto()
+
+@dataclass
+class RaidBoss:
+    id: str
+    name: str
+    health: int
+    abilities: List[Dict]
+    enrage_timer: int  # в секундах
+    loot_table: Dict[str, float]
+
+# Множитель здоровья босса по сложности
+DIFFICULTY_HEALTH_MULTIPLIER = {
+    RaidDifficulty.NORMAL: 1.0,
+    RaidDifficulty.HEROIC: 1.5,
+    RaidDifficulty.MYTHIC: 2.0
+}
+
+def load_bosses() -> Dict[str, RaidBoss]:
+    """Боссы для рейдов"""
+    return {
+        "ancient_dragon": RaidBoss(
+            id="ancient_dragon",
+            name="Древний Дракон",
+            health=500000,
+            abilities=[
+                {
+                    "name": "Огненное дыхание",
+                    "damage": 1500,
+                    "cooldown": 30,
+                    "aoe": True
+                },
+                {
+                    "name": "Удар хвостом",
+                    "damage": 800,
+                    "cooldown": 20,
+                    "stun_chance": 0.3
+                }
+            ],
+            enrage_timer=600,
+            loot_table={
+                "dragon_scale": 0.7,
+                "flame_sword": 0.2,
+                "dragon_heart": 0.1
+            }
+        )
+    }
+
+def scaled_boss_health(boss: RaidBoss, difficulty: RaidDifficulty) -> int:
+    """Здоровье босса с учетом сложности"""
+    return int(boss.health * DIFFICULTY_HEALTH_MULTIPLIER[difficulty])
+
+# Множитель входящего урона по ролям
+ROLE_DAMAGE_TAKEN = {
+    "tank": 0.6,
+    "healer": 1.0,
+    "dps": 1.0
+}
+
+# Базовый урон (для лекарей - лечение) участника в секунду
+ROLE_OUTPUT = {
+    "tank": 50,
+    "healer": 120,
+    "dps": 150
+}
+
+STUN_DURATION = 2.0  # в секундах
+
+def member_output(role: str, level: int) -> float:
+    """Урон или лечение участника в секунду"""
+    return ROLE_OUTPUT.get(role, 0) * (1 + level * 0.05)
+
+def apply_boss_ability(hp: np.ndarray, damage_taken_mult: np.ndarray, stunned_until: np.ndarray,
+                       ability: Dict, elapsed: float,
+                       rng: np.random.Generator) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Применить способность босса к массивам участников.
+
+    Работает с массивами любой формы (участники одного рейда или пачка
+    рейдов), меняет hp и stunned_until на месте. Возвращает нанесенный
+    урон и маску оглушенных (или None, если способность не оглушает).
+    """
+    alive = hp > 0
+    damage = (ability["damage"] * damage_taken_mult).astype(np.int64)
+    damage *= alive
+    hp -= damage
+    np.maximum(hp, 0, out=hp)
+
+    stun_chance = ability.get("stun_chance", 0)
+    if stun_chance <= 0:
+        return damage, None
+
+    stunned = (rng.random(hp.shape) < stun_chance) & alive
+    np.maximum(stunned_until, np.where(stunned, elapsed + STUN_DURATION, 0.0), out=stunned_until)
+    return damage, stunned
+
+def apply_member_actions(hp: np.ndarray, max_hp: np.ndarray, output: np.ndarray, is_healer: np.ndarray,
+                         stunned_until: np.ndarray, elapsed: float,
+                         dt: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Ход участников: урон по боссу и лечение.
+
+    Живые и не оглушенные танки и DPS бьют босса, лекари лечат живых
+    участников пропорционально недостающему здоровью. Последняя ось -
+    участники, ведущие оси (пачка рейдов) сохраняются. Меняет hp на месте.
+    Возвращает суммарный урон по боссу, урон и лечение каждого участника
+    и полученное каждым участником лечение.
+    """
+    acting = (hp > 0) & (stunned_until <= elapsed)
+    produced = output * dt * acting
+
+    damage_done = np.where(is_healer, 0.0, produced)
+    boss_damage = damage_done.sum(axis=-1)
+
+    heal_by_healer = np.where(is_healer, produced, 0.0)
+    heal_pool = heal_by_healer.sum(axis=-1, keepdims=True)
+    missing = np.where(hp > 0, max_hp - hp, 0).astype(np.float64)
+    total_missing = missing.sum(axis=-1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.where(total_missing > 0, missing / total_missing, 0.0)
+    received = np.minimum(missing, np.floor(heal_pool * share)).astype(np.int64)
+    hp += received
+
+    effective = received.sum(axis=-1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        healing_done = np.where(heal_pool > 0, heal_by_healer * effective / heal_pool, 0.0)
+
+    return boss_damage, damage_done, healing_done, received
+
+class RaidCombatState:
+    """Боевое состояние участников одного рейда.
+
+    Во время боя меняются только массивы, а объекты Player получают
+    накопленный урон и оглушения в sync_to_players (при завершении рейда
+    или снимке состояния).
+    """
+
+    def __init__(self, members: List, rng: Optional[np.random.Generator] = None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.hp = np.array([m.player.current_hp for m in members], dtype=np.int64)
+        self.max_hp = np.array([m.player.max_hp for m in members], dtype=np.int64)
+        self.damage_taken_mult = np.array(
+            [ROLE_DAMAGE_TAKEN.get(m.role, 1.0) for m in members], dtype=np.float64
+        )
+        self.stunned_until = np.zeros(len(members), dtype=np.float64)
+        self.output = np.array(
+            [member_output(m.role, m.player.level) for m in members], dtype=np.float64
+        )
+        self.is_healer = np.array([m.role == "healer" for m in members], dtype=bool)
+        # Урон и лечение, еще не перенесенные в RaidMember
+        self.damage_done = np.zeros(len(members), dtype=np.float64)
+        self.healing_done = np.zeros(len(members), dtype=np.float64)
+        # Еще не перенесенные в Player изменение HP (урон минус лечение) и оглушения
+        self.pending_damage = np.zeros(len(members), dtype=np.int64)
+        self.pending_stun = np.zeros(len(members), dtype=bool)
+        # Урон и лечение участников за последний тик (для журнала боя)
+        self.tick_damage_done = np.zeros(len(members), dtype=np.float64)
+        self.tick_healing_done = np.zeros(len(members), dtype=np.float64)
+
+    def apply_boss_ability(self, ability: Dict, elapsed: float) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Применить способность босса ко всем участникам"""
+        damage, stunned = apply_boss_ability(
+            self.hp, self.damage_taken_mult, self.stunned_until, ability, elapsed, self.rng
+        )
+        self.pending_damage += damage
+        if stunned is not None:
+            self.pending_stun |= stunned
+        return damage, stunned
+
+    def apply_member_actions(self, elapsed: float, dt: float) -> int:
+        """Ход участников. Возвращает урон по боссу"""
+        boss_damage, damage_done, healing_done, received = apply_member_actions(
+            self.hp, self.max_hp, self.output, self.is_healer, self.stunned_until, elapsed, dt
+        )
+        self.tick_damage_done = damage_done
+        self.tick_healing_done = healing_done
+        self.damage_done += damage_done
+        self.healing_done += healing_done
+        self.pending_damage -= received
+        return int(boss_damage)
+
+    def alive_count(self) -> int:
+        return int(np.count_nonzero(self.hp))
+
+    def is_stunned(self, elapsed: float) -> np.ndarray:
+        return self.stunned_until > elapsed
+
+    def sync_to_players(self, members: List, elapsed: float):
+        """Перенести накопленные HP, оглушения и статистику в RaidMember и Player"""
+        for i in np.flatnonzero(self.pending_damage):
+            net_damage = int(self.pending_damage[i])
+            player = members[i].player
+            if net_damage > 0:
+                player.take_damage(net_damage)
+            else:
+                player.current_hp = min(player.max_hp, player.current_hp - net_damage)
+        for i in np.flatnonzero(self.pending_stun & (self.stunned_until > elapsed)):
+            remaining = math.ceil(self.stunned_until[i] - elapsed)
+            members[i].player.apply_effect("stun", duration=remaining)
+        for i, member in enumerate(members):
+            member.damage_done += float(self.damage_done[i])
+            member.healing_done += float(self.healing_done[i])
+        self.pending_damage[:] = 0
+        self.pending_stun[:] = False
+        self.damage_done[:] = 0
+        self.healing_done[:] = 0
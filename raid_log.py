@@ -0,0 +1,315 @@
+"""
+Журнал боя рейда:
+- Компактная запись событий тика (способности, урон, оглушения, лечение)
+- Сжатые блоки в файле, который только дополняется
+- Чтение через mmap и восстановление хода боя с графиками DPS/HPS
+
+Формат файла: сигнатура MAGIC, затем блоки [тип u8][длина u32][данные].
+Блок BLOCK_META - JSON с описанием рейда и составом (каждый следующий
+дополняет предыдущий), BLOCK_RECORDS - сжатый zlib массив записей
+RECORD_DTYPE по 12 байт.
+
+Упаковка, сжатие и запись блоков выполняются в отдельном потоке, чтобы
+тик рейда только сохранял ссылки на массивы боя.
+"""
+import json
+import mmap
+import struct
+import sys
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MAGIC = b"RLOG\x01"
+
+BLOCK_META = 1
+BLOCK_RECORDS = 2
+BLOCK_HEADER = struct.Struct("<BI")
+
+# Типы событий
+EVENT_ABILITY = 1         # value - базовый урон способности
+EVENT_DAMAGE_TAKEN = 2    # value - урон по участнику
+EVENT_STUN = 3            # value - длительность в мс
+EVENT_MEMBER_DAMAGE = 4   # value - урон участника по боссу
+EVENT_MEMBER_HEAL = 5     # value - лечение участника
+EVENT_BOSS_HEALTH = 6     # value - здоровье босса после тика
+
+NO_MEMBER = 0xFFFF
+
+RECORD_DTYPE = np.dtype([
+    ("time_ms", "<u4"),
+    ("event", "u1"),
+    ("ability", "u1"),
+    ("member", "<u2"),
+    ("value", "<i4"),
+])
+
+_writer: Optional[ThreadPoolExecutor] = None
+
+def _get_writer() -> ThreadPoolExecutor:
+    """Общий поток записи журналов (один поток сохраняет порядок блоков)"""
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="raid-log")
+    return _writer
+
+class RaidRecorder:
+    """Запись событий одного рейда.
+
+    На тике сохраняются только ссылки на массивы боя, а упаковка в
+    записи и сжатие выполняются в потоке записи одной векторной
+    операцией на блок из block_ticks тиков. Индексы участников в
+    записях - позиции в общем списке состава, который только дополняется.
+    """
+
+    def __init__(self, path: str, raid_id: str, boss_id: str, difficulty: str,
+                 abilities: List[str], block_ticks: int = 256):
+        self.path = path
+        self.block_ticks = block_ticks
+        self._ticks: List[tuple] = []      # (время, урон, лечение, здоровье босса)
+        self._abilities: List[tuple] = []  # (время, индекс, базовый урон, урон, оглушения)
+        self._roster: List[int] = []  # player_id в порядке появления
+        self._roster_pos: Dict[int, int] = {}
+        self._member_map = np.empty(0, dtype=np.uint16)  # индекс в массивах боя -> индекс в составе
+        self._file = open(path, "wb")
+        self._closed = False
+        self._last_write: Optional[Future] = None
+        self._submit(self._file.write, MAGIC)
+        self._write_meta({
+            "raid_id": raid_id,
+            "boss_id": boss_id,
+            "difficulty": difficulty,
+            "abilities": abilities
+        })
+
+    def _submit(self, fn, *args):
+        self._last_write = _get_writer().submit(fn, *args)
+
+    def _write_block(self, kind: int, payload: bytes):
+        self._file.write(BLOCK_HEADER.pack(kind, len(payload)))
+        self._file.write(payload)
+
+    def _write_meta(self, meta: Dict):
+        self._submit(self._write_block, BLOCK_META, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    def set_roster(self, members: List):
+        """Задать текущий порядок участников в массивах боя"""
+        # Накопленные тики относятся к прежнему порядку участников
+        self._flush_block()
+        new_players = []
+        for member in members:
+            player_id = member.player.user_id
+            if player_id not in self._roster_pos:
+                self._roster_pos[player_id] = len(self._roster)
+                self._roster.append(player_id)
+                new_players.append({"player_id": player_id, "role": member.role})
+        if new_players:
+            self._write_meta({"roster": new_players})
+        self._member_map = np.array(
+            [self._roster_pos[m.player.user_id] for m in members], dtype=np.uint16
+        )
+
+    def record_ability(self, elapsed: float, ability_index: int, base_damage: int,
+                       damage: np.ndarray, stunned: Optional[np.ndarray], stun_duration: float):
+        """Записать применение способности босса"""
+        stun_ms = stunned * int(stun_duration * 1000) if stunned is not None else None
+        self._abilities.append((int(elapsed * 1000), ability_index, base_damage, damage, stun_ms))
+
+    def record_member_actions(self, elapsed: float, damage_done: np.ndarray,
+                              healing_done: np.ndarray, boss_health: int):
+        """Записать урон и лечение участников за тик.
+
+        Массивы не копируются: RaidCombatState создает их заново на каждом тике.
+        """
+        self._ticks.append((int(elapsed * 1000), damage_done, healing_done, max(0, boss_health)))
+        if len(self._ticks) >= self.block_ticks:
+            self._flush_block()
+
+    @staticmethod
+    def _member_records(member_map: np.ndarray, times: np.ndarray, values: np.ndarray, event: int,
+                        abilities: np.ndarray) -> np.ndarray:
+        """Записи по участникам с ненулевым значением из матрицы (тики x участники)"""
+        tick_idx, member_idx = np.nonzero(values)
+        records = np.empty(len(tick_idx), dtype=RECORD_DTYPE)
+        records["time_ms"] = times[tick_idx]
+        records["event"] = event
+        records["ability"] = abilities[tick_idx]
+        records["member"] = member_map[member_idx]
+        records["value"] = values[tick_idx, member_idx]
+        return records
+
+    @staticmethod
+    def _single_records(times: np.ndarray, event: int, abilities: np.ndarray,
+                        values: np.ndarray) -> np.ndarray:
+        records = np.empty(len(times), dtype=RECORD_DTYPE)
+        records["time_ms"] = times
+        records["event"] = event
+        records["ability"] = abilities
+        records["member"] = NO_MEMBER
+        records["value"] = values
+        return records
+
+    def _flush_block(self):
+        """Передать накопленные тики в поток записи"""
+        if not self._ticks and not self._abilities:
+            return
+        self._submit(self._pack_block, self._member_map, self._ticks, self._abilities)
+        self._ticks = []
+        self._abilities = []
+
+    def _pack_block(self, member_map: np.ndarray, ticks: List[tuple], abilities: List[tuple]):
+        """Упаковать тики в записи и дописать сжатый блок (в потоке записи)"""
+        parts = []
+        if ticks:
+            times = np.array([t[0] for t in ticks], dtype=np.uint32)
+            zero = np.zeros(len(times), dtype=np.uint8)
+            parts.append(self._member_records(
+                member_map, times, np.stack([t[1] for t in ticks]).astype(np.int64),
+                EVENT_MEMBER_DAMAGE, zero))
+            parts.append(self._member_records(
+                member_map, times, np.stack([t[2] for t in ticks]).astype(np.int64),
+                EVENT_MEMBER_HEAL, zero))
+            parts.append(self._single_records(
+                times, EVENT_BOSS_HEALTH, zero, np.array([t[3] for t in ticks])))
+        if abilities:
+            times = np.array([a[0] for a in abilities], dtype=np.uint32)
+            indexes = np.array([a[1] for a in abilities], dtype=np.uint8)
+            parts.append(self._single_records(
+                times, EVENT_ABILITY, indexes, np.array([a[2] for a in abilities])))
+            parts.append(self._member_records(
+                member_map, times, np.stack([a[3] for a in abilities]), EVENT_DAMAGE_TAKEN, indexes))
+            stuns = [(i, a[4]) for i, a in enumerate(abilities) if a[4] is not None]
+            if stuns:
+                rows = np.array([i for i, _ in stuns])
+                parts.append(self._member_records(
+                    member_map, times[rows], np.stack([s for _, s in stuns]), EVENT_STUN, indexes[rows]))
+
+        # Записи группами по типам событий; по времени их упорядочивает читатель
+        self._write_block(BLOCK_RECORDS, zlib.compress(np.concatenate(parts).tobytes(), 1))
+
+    def close(self, status: Optional[str] = None) -> Optional[Future]:
+        """Сбросить оставшиеся записи и закрыть файл.
+
+        Возвращает Future завершения записи (None, если журнал уже закрыт).
+        """
+        if self._closed:
+            return None
+        self._closed = True
+        self._flush_block()
+        if status is not None:
+            self._write_meta({"status": status})
+        self._submit(self._file.close)
+        return self._last_write
+
+class RaidLogReader:
+    """Чтение журнала рейда через mmap"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta: Dict = {"roster": []}
+        self._record_blocks: List[tuple] = []  # (смещение, длина) сжатых блоков
+
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a raid log")
+
+        offset = len(MAGIC)
+        while offset + BLOCK_HEADER.size <= len(self._mm):
+            kind, length = BLOCK_HEADER.unpack_from(self._mm, offset)
+            offset += BLOCK_HEADER.size
+            if offset + length > len(self._mm):
+                break  # недописанный блок
+            if kind == BLOCK_META:
+                meta = json.loads(self._mm[offset:offset + length].decode("utf-8"))
+                roster = meta.pop("roster", [])
+                self.meta.update(meta)
+                self.meta["roster"].extend(roster)
+            elif kind == BLOCK_RECORDS:
+                self._record_blocks.append((offset, length))
+            offset += length
+
+    def records(self) -> np.ndarray:
+        """Все записи журнала одним массивом, упорядоченным по времени"""
+        if not self._record_blocks:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        records = np.concatenate([
+            np.frombuffer(zlib.decompress(self._mm[offset:offset + length]), dtype=RECORD_DTYPE)
+            for offset, length in self._record_blocks
+        ])
+        return records[np.argsort(records["time_ms"], kind="stable")]
+
+    def close(self):
+        self._mm.close()
+
+def replay(path: str, window: float = 10.0) -> Dict:
+    """Восстановить ход боя: здоровье босса и DPS/HPS участников по окнам"""
+    reader = RaidLogReader(path)
+    try:
+        records = reader.records()
+        meta = reader.meta
+    finally:
+        reader.close()
+
+    roster = meta["roster"]
+    window_ms = int(window * 1000)
+    end_ms = int(records["time_ms"].max()) if len(records) else 0
+    windows = end_ms // window_ms + 1
+
+    def timeline(event: int) -> np.ndarray:
+        selected = records[records["event"] == event]
+        totals = np.zeros((len(roster), windows), dtype=np.float64)
+        np.add.at(totals, (selected["member"], selected["time_ms"] // window_ms), selected["value"])
+        return totals / window
+
+    dps = timeline(EVENT_MEMBER_DAMAGE)
+    hps = timeline(EVENT_MEMBER_HEAL)
+    boss = records[records["event"] == EVENT_BOSS_HEALTH]
+    abilities = records[records["event"] == EVENT_ABILITY]
+
+    return {
+        "meta": {key: value for key, value in meta.items() if key != "roster"},
+        "window": window,
+        "boss_health": list(zip((boss["time_ms"] / 1000).tolist(), boss["value"].tolist())),
+        "abilities": [
+            (t / 1000, meta.get("abilities", [])[a] if a < len(meta.get("abilities", [])) else a)
+            for t, a in zip(abilities["time_ms"].tolist(), abilities["ability"].tolist())
+        ],
+        "members": [
+            {
+                "player_id": entry["player_id"],
+                "role": entry["role"],
+                "dps": dps[i].tolist(),
+                "hps": hps[i].tolist(),
+                "damage_total": float(dps[i].sum() * window),
+                "healing_total": float(hps[i].sum() * window),
+                "damage_taken": int(records["value"][
+                    (records["event"] == EVENT_DAMAGE_TAKEN) & (records["member"] == i)
+                ].sum())
+            }
+            for i, entry in enumerate(roster)
+        ]
+    }
+
+def main(argv: List[str]):
+    if not argv:
+        print("Usage: python raid_log.py <raid.log> [window_seconds]")
+        return
+    window = float(argv[1]) if len(argv) > 1 else 10.0
+    result = replay(argv[0], window)
+
+    meta = result["meta"]
+    print(f"Raid {meta.get('raid_id')} ({meta.get('boss_id')}, {meta.get('difficulty')}): "
+          f"{meta.get('status', 'unfinished')}")
+    if result["boss_health"]:
+        print(f"Boss health at end: {result['boss_health'][-1][1]}")
+    print(f"{'player':>12} {'role':>7} {'damage':>10} {'healing':>10} {'taken':>10}  peak DPS/HPS")
+    for member in result["members"]:
+        print(f"{member['player_id']:>12} {member['role']:>7} {member['damage_total']:>10.0f} "
+              f"{member['healing_total']:>10.0f} {member['damage_taken']:>10}  "
+              f"{max(member['dps'], default=0):.0f}/{max(member['hps'], default=0):.0f}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
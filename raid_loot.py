@@ -0,0 +1,146 @@
+"""
+Распределение добычи рейдов:
+- Броски need/greed/pass: предмет достается тем, кому он нужен, раньше жадных
+- Защита от невезения: долг добычи растет за каждую победу без награды
+  и увеличивает вес игрока при выборе победителя
+- Взвешенный выбор за O(log n) через дерево Фенвика
+"""
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+LOOT_NEED = "need"
+LOOT_GREED = "greed"
+LOOT_PASS = "pass"
+LOOT_ROLLS = (LOOT_NEED, LOOT_GREED, LOOT_PASS)
+
+DEBT_WEIGHT = 0.5  # прибавка к весу за каждую единицу долга добычи
+
+class FenwickTree:
+    """Дерево Фенвика по весам: изменение веса и выбор по префиксной сумме за O(log n)"""
+
+    def __init__(self, weights: List[float]):
+        self.size = len(weights)
+        self._tree = [0.0] + list(weights)
+        # Построение за O(n): каждый узел передает сумму родителю
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self._tree[parent] += self._tree[i]
+        self._weights = list(weights)
+
+    def weight(self, index: int) -> float:
+        return self._weights[index]
+
+    def set(self, index: int, weight: float):
+        """Задать вес элемента"""
+        delta = weight - self._weights[index]
+        self._weights[index] = weight
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def total(self) -> float:
+        total = 0.0
+        i = self.size
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, value: float) -> int:
+        """Индекс элемента, в отрезок которого попадает value из [0, total)"""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = position + step
+            if nxt <= self.size and self._tree[nxt] <= value:
+                position = nxt
+                value -= self._tree[nxt]
+            step >>= 1
+        # Из-за погрешности округления не выбираем элементы с нулевым весом
+        position = min(position, self.size - 1)
+        while position > 0 and self._weights[position] <= 0:
+            position -= 1
+        return position
+
+    def sample(self, rng: random.Random) -> Optional[int]:
+        """Случайный индекс пропорционально весам (None, если все веса нулевые)"""
+        total = self.total()
+        if total <= 0:
+            return None
+        return self.find(rng.random() * total)
+
+@dataclass
+class LootResult:
+    winners: Dict[int, List[str]] = field(default_factory=dict)  # player_id: предметы
+    debts: Dict[int, int] = field(default_factory=dict)          # player_id: новый долг добычи
+
+class LootEngine:
+    """Распределение добычи с учетом бросков и долга добычи.
+
+    Долги хранятся в таблице raid_loot_debt и кэшируются в памяти: кэш -
+    источник истины, а новые значения записываются вместе с результатом
+    рейда (Database.save_raid_results), одной пачкой на рейд.
+    """
+
+    def __init__(self, db, seed: Optional[int] = None):
+        self.db = db
+        self.rng = random.Random(seed)
+        self._debts: Dict[str, Dict[int, int]] = {}  # boss_id: {player_id: долг}
+
+    def get_debts(self, boss_id: str, player_ids: List[int]) -> Dict[int, int]:
+        """Долги добычи игроков по боссу (недостающие загружаются одним запросом)"""
+        cached = self._debts.setdefault(boss_id, {})
+        missing = [player_id for player_id in player_ids if player_id not in cached]
+        if missing:
+            loaded = self.db.get_loot_debts(boss_id, missing)
+            for player_id in missing:
+                cached[player_id] = loaded.get(player_id, 0)
+        return {player_id: cached[player_id] for player_id in player_ids}
+
+    @staticmethod
+    def _weight(debt: int) -> float:
+        return 1.0 + debt * DEBT_WEIGHT
+
+    def distribute(self, boss_id: str, loot_table: Dict[str, float], player_ids: List[int],
+                   rolls: Optional[Dict[int, Dict[str, str]]] = None) -> LootResult:
+        """Разыграть добычу босса между участниками.
+
+        rolls - броски игроков по предметам (по умолчанию greed). Игрок,
+        получивший предмет, возвращается к базовому весу до конца раздачи,
+        поэтому несколько предметов одного рейда расходятся по разным людям.
+        """
+        rolls = rolls or {}
+        debts = self.get_debts(boss_id, player_ids)
+        weights = [self._weight(debts[player_id]) for player_id in player_ids]
+        # Общее дерево для предметов, на которые все бросают greed
+        shared = FenwickTree(weights)
+        result = LootResult()
+
+        for item_id, drop_chance in loot_table.items():
+            if self.rng.random() >= drop_chance:
+                continue
+
+            item_rolls = [rolls.get(player_id, {}).get(item_id, LOOT_GREED) for player_id in player_ids]
+            if all(roll == LOOT_GREED for roll in item_rolls):
+                tree = shared
+            else:
+                eligible = LOOT_NEED if LOOT_NEED in item_rolls else LOOT_GREED
+                tree = FenwickTree([
+                    shared.weight(i) if roll == eligible else 0.0
+                    for i, roll in enumerate(item_rolls)
+                ])
+            index = tree.sample(self.rng)
+            if index is None:
+                continue  # все отказались
+
+            winner = player_ids[index]
+            result.winners.setdefault(winner, []).append(item_id)
+            shared.set(index, self._weight(0))
+
+        for player_id in player_ids:
+            result.debts[player_id] = 0 if player_id in result.winners else debts[player_id] + 1
+        self._debts[boss_id].update(result.debts)
+        return result
@@ -0,0 +1,269 @@
+"""
+Офлайн-симулятор баланса рейдов (метод Монте-Карло):
+- Пачки рейдов в массивах NumPy по тем же правилам, что и RaidManager
+- Пачки распределяются по пулу процессов
+- Гистограммы доли побед, времени убийства босса и добычи по сложностям
+- Добыча делится через LootEngine по тем же правилам (need/greed, долг добычи)
+
+Запуск без бота и БД:
+    python raid_sim.py --boss ancient_dragon --raids 20000
+"""
+import argparse
+import dataclasses
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from raid_combat import (
+    DIFFICULTY_HEALTH_MULTIPLIER, ROLE_DAMAGE_TAKEN, ROLE_OUTPUT, RaidBoss, RaidDifficulty,
+    apply_boss_ability, apply_member_actions, load_bosses
+)
+from raid_loot import LootEngine
+
+# Состав по умолчанию: полная группа из матчмейкера
+DEFAULT_COMPOSITION = ("tank",) * 2 + ("healer",) * 3 + ("dps",) * 10
+
+# Максимальное здоровье игрока, как в player.py: 80 + vitality * 4
+BASE_HP = 80
+HP_PER_VITALITY = 4
+
+TTK_BIN = 30  # ширина интервала гистограммы времени убийства, в секундах
+
+class MemoryDebtStore:
+    """Долги добычи в памяти вместо БД: в начале пачки долгов нет"""
+
+    def get_loot_debts(self, boss_id: str, player_ids: List[int]) -> Dict[int, int]:
+        return {}
+
+@dataclasses.dataclass
+class SimulationConfig:
+    boss: RaidBoss
+    health_multipliers: Dict[RaidDifficulty, float]
+    composition: Tuple[str, ...] = DEFAULT_COMPOSITION
+    level_range: Tuple[int, int] = (10, 60)
+    vitality_range: Tuple[int, int] = (10, 60)
+    # Броски по ролям: {роль: {предмет: need/greed/pass}}, по умолчанию все greed
+    loot_rolls: Dict[str, Dict[str, str]] = dataclasses.field(default_factory=dict)
+    dt: float = 1.0
+
+def simulate_batch(config: SimulationConfig, difficulty: RaidDifficulty, n_raids: int,
+                   seed: np.random.SeedSequence) -> Dict:
+    """Смоделировать пачку рейдов. Возвращает счетчики для гистограмм.
+
+    Все рейды пачки идут в ногу (общее время боя и перезарядки), рейды,
+    закончившиеся на тике, убираются из массивов. Добыча за победы пачки
+    делится одним составом по очереди, так что долг добычи переходит
+    от убийства к убийству, как у постоянной группы.
+    """
+    rng = np.random.default_rng(seed)
+    boss = config.boss
+    roles = list(config.composition)
+    shape = (n_raids, len(roles))
+
+    levels = rng.integers(config.level_range[0], config.level_range[1] + 1, size=shape)
+    vitality = rng.integers(config.vitality_range[0], config.vitality_range[1] + 1, size=shape)
+    max_hp = (BASE_HP + vitality * HP_PER_VITALITY).astype(np.int64)
+    hp = max_hp.copy()
+    damage_taken_mult = np.tile(np.array([ROLE_DAMAGE_TAKEN.get(r, 1.0) for r in roles]), (n_raids, 1))
+    output = np.array([ROLE_OUTPUT.get(r, 0) for r in roles]) * (1 + levels * 0.05)
+    is_healer = np.tile(np.array([r == "healer" for r in roles]), (n_raids, 1))
+    stunned_until = np.zeros(shape, dtype=np.float64)
+    boss_hp = np.full(n_raids, boss.health * config.health_multipliers[difficulty], dtype=np.float64)
+
+    active = np.arange(n_raids)
+    won = np.zeros(n_raids, dtype=bool)
+    wiped = np.zeros(n_raids, dtype=bool)
+    end_time = np.zeros(n_raids, dtype=np.float64)
+
+    elapsed = 0.0
+    ability_ready_at = [float(ability.get("cooldown", 0)) for ability in boss.abilities]
+    while active.size:
+        elapsed += config.dt
+        if elapsed > boss.enrage_timer:
+            end_time[active] = elapsed
+            break
+
+        boss_damage, _, _, _ = apply_member_actions(
+            hp, max_hp, output, is_healer, stunned_until, elapsed, config.dt
+        )
+        boss_hp -= boss_damage
+
+        for i, ability in enumerate(boss.abilities):
+            if elapsed >= ability_ready_at[i]:
+                ability_ready_at[i] = elapsed + ability.get("cooldown", 0)
+                apply_boss_ability(hp, damage_taken_mult, stunned_until, ability, elapsed, rng)
+
+        # Как в _raid_tick: гибель рейда проверяется раньше победы
+        dead = ~(hp > 0).any(axis=1)
+        killed = (boss_hp <= 0) & ~dead
+        finished = dead | killed
+        if finished.any():
+            wiped[active[dead]] = True
+            won[active[killed]] = True
+            end_time[active[finished]] = elapsed
+            keep = ~finished
+            active = active[keep]
+            hp, max_hp, damage_taken_mult = hp[keep], max_hp[keep], damage_taken_mult[keep]
+            output, is_healer, stunned_until = output[keep], is_healer[keep], stunned_until[keep]
+            boss_hp = boss_hp[keep]
+
+    # Добыча: те же броски и веса долга, что в RaidManager
+    items = list(boss.loot_table)
+    wins = int(won.sum())
+    engine = LootEngine(MemoryDebtStore(), seed=int(rng.integers(2 ** 63)))
+    player_ids = list(range(len(roles)))
+    rolls = {player_id: config.loot_rolls.get(role, {}) for player_id, role in enumerate(roles)}
+    item_drops = dict.fromkeys(items, 0)
+    items_per_kill = np.zeros(len(items) + 1, dtype=np.int64)
+    loot_by_role = dict.fromkeys(sorted(set(roles)), 0)
+    for _ in range(wins):
+        result = engine.distribute(boss.id, boss.loot_table, player_ids, rolls)
+        awarded = 0
+        for player_id, won_items in result.winners.items():
+            loot_by_role[roles[player_id]] += len(won_items)
+            awarded += len(won_items)
+            for item_id in won_items:
+                item_drops[item_id] += 1
+        items_per_kill[awarded] += 1
+
+    ttk_edges = np.arange(0, boss.enrage_timer + TTK_BIN, TTK_BIN)
+    return {
+        "raids": n_raids,
+        "wins": wins,
+        "wipes": int(wiped.sum()),
+        "enrages": int((~won & ~wiped).sum()),
+        "ttk_sum": float(end_time[won].sum()),
+        "ttk_hist": np.histogram(end_time[won], bins=ttk_edges)[0],
+        "ttk_edges": ttk_edges,
+        "item_drops": item_drops,
+        "items_per_kill": items_per_kill,
+        "loot_by_role": loot_by_role
+    }
+
+def _merge(total: Optional[Dict], part: Dict) -> Dict:
+    if total is None:
+        return part
+    for key, value in part.items():
+        if key == "ttk_edges":
+            continue
+        if isinstance(value, dict):
+            for name, count in value.items():
+                total[key][name] = total[key].get(name, 0) + count
+        else:
+            total[key] = total[key] + value
+    return total
+
+def _summarize(totals: Dict) -> Dict:
+    raids = totals["raids"]
+    wins = totals["wins"]
+    return {
+        "raids": raids,
+        "win_rate": wins / raids if raids else 0.0,
+        "wipe_rate": totals["wipes"] / raids if raids else 0.0,
+        "enrage_rate": totals["enrages"] / raids if raids else 0.0,
+        "mean_ttk": totals["ttk_sum"] / wins if wins else None,
+        "ttk_histogram": list(zip(totals["ttk_edges"][:-1].tolist(), totals["ttk_hist"].tolist())),
+        "drop_rate": {item: count / wins if wins else 0.0 for item, count in totals["item_drops"].items()},
+        "items_per_kill": totals["items_per_kill"].tolist(),
+        "loot_by_role": totals["loot_by_role"]
+    }
+
+def run_simulation(boss_id: str = "ancient_dragon", raids_per_difficulty: int = 10000,
+                   difficulties: Optional[Sequence[RaidDifficulty]] = None,
+                   batch_size: int = 2000, workers: Optional[int] = None, seed: Optional[int] = None,
+                   boss_overrides: Optional[Dict] = None,
+                   health_multipliers: Optional[Dict[RaidDifficulty, float]] = None,
+                   composition: Tuple[str, ...] = DEFAULT_COMPOSITION,
+                   level_range: Tuple[int, int] = (10, 60),
+                   vitality_range: Tuple[int, int] = (10, 60),
+                   loot_rolls: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, Dict]:
+    """Смоделировать рейды на босса по всем сложностям.
+
+    boss_overrides заменяет поля RaidBoss (health, enrage_timer, loot_table...),
+    health_multipliers - множители здоровья по сложности, level_range и
+    vitality_range - диапазоны уровня и выносливости участников, loot_rolls -
+    броски need/greed/pass по ролям. Возвращает сводку с гистограммами по
+    имени сложности.
+    """
+    boss = load_bosses()[boss_id]
+    if boss_overrides:
+        boss = dataclasses.replace(boss, **boss_overrides)
+    multipliers = dict(DIFFICULTY_HEALTH_MULTIPLIER)
+    multipliers.update(health_multipliers or {})
+    config = SimulationConfig(
+        boss=boss, health_multipliers=multipliers, composition=tuple(composition),
+        level_range=tuple(level_range), vitality_range=tuple(vitality_range),
+        loot_rolls=dict(loot_rolls or {})
+    )
+    difficulties = list(difficulties or RaidDifficulty)
+
+    jobs: List[Tuple[RaidDifficulty, int]] = []
+    for difficulty in difficulties:
+        for start in range(0, raids_per_difficulty, batch_size):
+            jobs.append((difficulty, min(batch_size, raids_per_difficulty - start)))
+    seeds = np.random.SeedSequence(seed).spawn(len(jobs))
+
+    totals: Dict[RaidDifficulty, Optional[Dict]] = {difficulty: None for difficulty in difficulties}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            simulate_batch,
+            [config] * len(jobs), [d for d, _ in jobs], [n for _, n in jobs], seeds
+        )
+        for (difficulty, _), part in zip(jobs, results):
+            totals[difficulty] = _merge(totals[difficulty], part)
+
+    return {difficulty.name: _summarize(totals[difficulty]) for difficulty in difficulties}
+
+def _bar(value: float, width: int = 40) -> str:
+    return "#" * int(round(value * width))
+
+def print_report(report: Dict[str, Dict]):
+    for difficulty, summary in report.items():
+        mean_ttk = f"{summary['mean_ttk']:.0f}s" if summary["mean_ttk"] is not None else "-"
+        print(f"== {difficulty}: {summary['raids']} raids, win {summary['win_rate']:.1%}, "
+              f"wipe {summary['wipe_rate']:.1%}, enrage {summary['enrage_rate']:.1%}, mean TTK {mean_ttk}")
+        wins = sum(count for _, count in summary["ttk_histogram"])
+        if wins:
+            print("  time to kill:")
+            for start, count in summary["ttk_histogram"]:
+                if count:
+                    print(f"  {start:>5}-{start + TTK_BIN:<5} {count:>7} {_bar(count / wins)}")
+            print("  drop rate per kill:")
+            for item, rate in summary["drop_rate"].items():
+                print(f"  {item:>14} {rate:>6.1%} {_bar(rate)}")
+            print("  items per kill:")
+            for items, count in enumerate(summary["items_per_kill"]):
+                print(f"  {items:>14} {count:>7} {_bar(count / wins)}")
+            print(f"  loot by role: {summary['loot_by_role']}")
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description="Raid balance simulator")
+    parser.add_argument("--boss", default="ancient_dragon")
+    parser.add_argument("--raids", type=int, default=10000, help="raids per difficulty")
+    parser.add_argument("--difficulty", action="append", choices=[d.name for d in RaidDifficulty])
+    parser.add_argument("--health", type=int, help="override boss base health")
+    parser.add_argument("--enrage", type=int, help="override enrage timer (seconds)")
+    parser.add_argument("--level", type=int, nargs=2, default=(10, 60), metavar=("MIN", "MAX"))
+    parser.add_argument("--vitality", type=int, nargs=2, default=(10, 60), metavar=("MIN", "MAX"))
+    parser.add_argument("--batch", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    if args.health is not None:
+        overrides["health"] = args.health
+    if args.enrage is not None:
+        overrides["enrage_timer"] = args.enrage
+    difficulties = [RaidDifficulty[name] for name in args.difficulty] if args.difficulty else None
+
+    print_report(run_simulation(
+        args.boss, args.raids, difficulties, batch_size=args.batch,
+        workers=args.workers, seed=args.seed, boss_overrides=overrides,
+        level_range=args.level, vitality_range=args.vitality
+    ))
+
+if __name__ == "__main__":
+    main()
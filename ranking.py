@@ -0,0 +1,153 @@
+"""
+Упорядоченный индекс для таблиц лидеров:
+- Вставка и удаление за O(log n)
+- Позиция ключа и выборка по позиции за O(log n)
+"""
+import random
+from typing import Any, Iterator, List, Optional
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Any, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        self.width: List[int] = [1] * level
+
+class RankedIndex:
+    """Индексируемый skip list с уникальными ключами.
+
+    Ключи хранятся по возрастанию, поэтому для таблиц лидеров в ключ
+    кладут отрицательные очки и ID для разрешения ничьих, например
+    (-honor, player_id).
+    """
+    MAX_LEVEL = 32
+
+    def __init__(self, seed: Optional[int] = None):
+        self._rng = random.Random(seed)
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and self._rng.random() < 0.5:
+            level += 1
+        return level
+
+    def bulk_load(self, keys: List[Any]):
+        """Заполнить пустой индекс отсортированными уникальными ключами за O(n)"""
+        if self._size:
+            raise ValueError("bulk_load requires an empty RankedIndex")
+        last = [self._head] * self.MAX_LEVEL  # последний узел на каждом уровне
+        last_pos = [0] * self.MAX_LEVEL
+        for position, key in enumerate(keys, start=1):
+            level = self._random_level()
+            self._level = max(self._level, level)
+            node = _Node(key, level)
+            for lvl in range(level):
+                last[lvl].next[lvl] = node
+                last[lvl].width[lvl] = position - last_pos[lvl]
+                last[lvl] = node
+                last_pos[lvl] = position
+        self._size = len(keys)
+        # Ширина ссылки в конец списка - число узлов после узла
+        for lvl in range(self.MAX_LEVEL):
+            last[lvl].width[lvl] = self._size - last_pos[lvl]
+
+    def insert(self, key: Any):
+        """Добавить ключ"""
+        update: List[_Node] = [self._head] * self.MAX_LEVEL
+        steps = [0] * self.MAX_LEVEL
+        node = self._head
+        for lvl in range(self._level - 1, -1, -1):
+            while node.next[lvl] is not None and node.next[lvl].key < key:
+                steps[lvl] += node.width[lvl]
+                node = node.next[lvl]
+            update[lvl] = node
+
+        level = self._random_level()
+        if level > self._level:
+            for lvl in range(self._level, level):
+                self._head.width[lvl] = self._size
+            self._level = level
+
+        new_node = _Node(key, level)
+        passed = 0
+        for lvl in range(level):
+            prev = update[lvl]
+            new_node.next[lvl] = prev.next[lvl]
+            prev.next[lvl] = new_node
+            new_node.width[lvl] = prev.width[lvl] - passed
+            prev.width[lvl] = passed + 1
+            passed += steps[lvl]
+        for lvl in range(level, self._level):
+            update[lvl].width[lvl] += 1
+        self._size += 1
+
+    def remove(self, key: Any) -> bool:
+        """Удалить ключ. Возвращает False, если его не было"""
+        update: List[_Node] = [self._head] * self.MAX_LEVEL
+        node = self._head
+        for lvl in range(self._level - 1, -1, -1):
+            while node.next[lvl] is not None and node.next[lvl].key < key:
+                node = node.next[lvl]
+            update[lvl] = node
+
+        target = node.next[0]
+        if target is None or target.key != key:
+            return False
+
+        for lvl in range(self._level):
+            prev = update[lvl]
+            if prev.next[lvl] is target:
+                prev.width[lvl] += target.width[lvl] - 1
+                prev.next[lvl] = target.next[lvl]
+            else:
+                prev.width[lvl] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+
+    def rank(self, key: Any) -> Optional[int]:
+        """Позиция ключа (с нуля) или None, если ключа нет"""
+        position = 0
+        node = self._head
+        for lvl in range(self._level - 1, -1, -1):
+            while node.next[lvl] is not None and node.next[lvl].key < key:
+                position += node.width[lvl]
+                node = node.next[lvl]
+        node = node.next[0]
+        if node is None or node.key != key:
+            return None
+        return position
+
+    def _node_at(self, index: int) -> _Node:
+        if not 0 <= index < self._size:
+            raise IndexError("RankedIndex index out of range")
+        remaining = index + 1
+        node = self._head
+        for lvl in range(self._level - 1, -1, -1):
+            while node.next[lvl] is not None and node.width[lvl] <= remaining:
+                remaining -= node.width[lvl]
+                node = node.next[lvl]
+        return node
+
+    def __getitem__(self, index: int) -> Any:
+        return self._node_at(index).key
+
+    def iter_from(self, index: int = 0) -> Iterator[Any]:
+        """Перебрать ключи, начиная с позиции index"""
+        if index >= self._size:
+            return
+        node = self._node_at(index)
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def __iter__(self) -> Iterator[Any]:
+        return self.iter_from(0)
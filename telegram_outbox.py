@@ -0,0 +1,222 @@
+"""
+Очередь исходящих правок сообщений Telegram:
+- Несколько ожидающих правок одного сообщения схлопываются в последнюю
+- Лимиты на чат и на бота целиком (token bucket)
+- Ответ 429 повторяется с экспоненциальной задержкой и случайным разбросом
+"""
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до следующего токена (0 - можно сейчас)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+@dataclass
+class PendingEdit:
+    bot: Any
+    kwargs: Dict[str, Any]
+    attempts: int = 0
+    not_before: float = 0.0
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """retry_after из ответа 429 (исключение telebot ApiTelegramException), иначе None"""
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    result = getattr(error, 'result_json', None) or {}
+    return float(result.get('parameters', {}).get('retry_after', 0))
+
+class MessageOutbox:
+    """Фоновая отправка правок сообщений с учетом лимитов Telegram.
+
+    Правки ждут в OrderedDict по (chat_id, message_id): новая правка того
+    же сообщения заменяет ожидающую и сохраняет ее место в очереди. Поток
+    отправки берет первую правку, для которой есть токены чата и бота, а
+    после 429 не трогает чат до истечения retry_after. Бот передается с
+    каждой правкой, поэтому вместо Telegram можно подставить заглушку или
+    бот, настроенный на локальный сервер API.
+    """
+    GLOBAL_RATE = 30.0   # правок в секунду на бота
+    GLOBAL_BURST = 5
+    CHAT_RATE = 1.0      # правок в секунду на чат
+    CHAT_BURST = 3
+    MAX_RETRIES = 5
+    BASE_BACKOFF = 0.5
+    MAX_BACKOFF = 30.0
+    MAX_CHAT_BUCKETS = 10000  # сверх этого забываются чаты с полным запасом токенов
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST, clock: Callable[[], float] = time.monotonic,
+                 rng: Optional[random.Random] = None):
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_burst, clock())
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._blocked_until: Dict[Any, float] = {}  # chat_id: конец паузы после 429
+        self._pending: "OrderedDict[Tuple[Any, Any], PendingEdit]" = OrderedDict()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self.stats = {'sent': 0, 'coalesced': 0, 'retried': 0, 'failed': 0}
+
+    def edit_message_text(self, bot, chat_id, message_id, text: str, **kwargs):
+        """Поставить правку в очередь (аргументы как у bot.edit_message_text)"""
+        kwargs.update(chat_id=chat_id, message_id=message_id, text=text)
+        key = (chat_id, message_id)
+        with self._condition:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending.bot = bot
+                pending.kwargs = kwargs
+                pending.attempts = 0
+                self.stats['coalesced'] += 1
+            else:
+                self._pending[key] = PendingEdit(bot, kwargs)
+            self._ensure_thread()
+            self._condition.notify_all()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="telegram-outbox", daemon=True)
+            self._thread.start()
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                self._prune_chats(now)
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _prune_chats(self, now: float):
+        # Полный запас у забытого чата такой же, как у нового, так что лимит не нарушается
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items()
+                        if bucket.is_full(now) and self._blocked_until.get(chat_id, 0.0) <= now]:
+            del self._chats[chat_id]
+            self._blocked_until.pop(chat_id, None)
+
+    def _next_ready(self, now: float) -> Tuple[Optional[Tuple[Any, Any]], float]:
+        """Первая правка, которую можно отправить сейчас, или время ожидания"""
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+
+        wait = None
+        for key, pending in self._pending.items():
+            chat_id = key[0]
+            ready_at = max(pending.not_before, self._blocked_until.get(chat_id, 0.0))
+            chat_wait = max(ready_at - now, self._chat_bucket(chat_id, now).wait_time(now))
+            if chat_wait <= 0:
+                return key, 0.0
+            wait = chat_wait if wait is None else min(wait, chat_wait)
+        return None, wait if wait is not None else 1.0
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    now = self.clock()
+                    key, wait = self._next_ready(now) if self._pending else (None, None)
+                    if key is not None:
+                        break
+                    self._condition.notify_all()  # для flush: очередь пуста или ждет лимитов
+                    self._condition.wait(wait)
+
+                pending = self._pending.pop(key)
+                self._global.take(now)
+                self._chat_bucket(key[0], now).take(now)
+                self._in_flight += 1
+
+            try:
+                self._send(key, pending)
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
+
+    def _send(self, key: Tuple[Any, Any], pending: PendingEdit):
+        try:
+            pending.bot.edit_message_text(**pending.kwargs)
+            self.stats['sent'] += 1
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is None:
+                if 'message is not modified' not in str(e):
+                    self.stats['failed'] += 1
+                    logger.error(f"Ошибка правки сообщения {key}: {e}")
+                return
+            self._schedule_retry(key, pending, retry_after)
+
+    def _schedule_retry(self, key: Tuple[Any, Any], pending: PendingEdit, retry_after: float):
+        backoff = min(self.MAX_BACKOFF, self.BASE_BACKOFF * 2 ** pending.attempts)
+        delay = retry_after + self.rng.uniform(0, backoff)
+        with self._condition:
+            self._blocked_until[key[0]] = max(self._blocked_until.get(key[0], 0.0), self.clock() + retry_after)
+            if key in self._pending:
+                return  # пока ждали ответа, пришла более новая правка
+            if pending.attempts >= self.MAX_RETRIES:
+                self.stats['failed'] += 1
+                logger.warning(f"Правка сообщения {key} отброшена после {pending.attempts} повторов")
+                return
+            pending.attempts += 1
+            pending.not_before = self.clock() + delay
+            self._pending[key] = pending
+            self.stats['retried'] += 1
+            self._condition.notify_all()
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться отправки всех правок. False, если не успели за timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stop(self):
+        """Остановить поток отправки (неотправленные правки остаются в очереди)"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def pytest_sessionstart(session):
+    # database.py создает game.db в текущей папке уже при импорте тестовых модулей
+    os.chdir(tempfile.mkdtemp(prefix="game-tests-"))
+
+@pytest.fixture(autouse=True)
+def _isolated_cwd(tmp_path, monkeypatch):
+    # Модули создают game.db и снимки в текущей папке при импорте
+    monkeypatch.chdir(tmp_path)
+
+@pytest.fixture
+def missing_imports(monkeypatch):
+    """Имена, которые импортируют combat, pvp и raid, но которых нет в player.py и world.py"""
+    import player
+    import world
+    monkeypatch.setattr(player, "get_player_data", None, raising=False)
+    monkeypatch.setattr(player, "save_player_data", None, raising=False)
+    monkeypatch.setattr(player, "Player", object, raising=False)
+    monkeypatch.setattr(world, "World", object, raising=False)
@@ -0,0 +1,79 @@
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+        self.edited = []
+        self.answered = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+    def reply_to(self, message, text, **kwargs):
+        self.sent.append(text)
+
+    def edit_message_text(self, **kwargs):
+        self.edited.append(kwargs)
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self.answered.append(text)
+
+
+@pytest.fixture
+def combat(missing_imports):
+    return importlib.import_module("combat")
+
+
+@pytest.fixture
+def players(combat, monkeypatch):
+    # Доступ к документам игроков подменяется хранилищем в памяти
+    store = {}
+    monkeypatch.setattr(combat, "get_player_data", lambda player_id: store.get(player_id))
+    monkeypatch.setattr(combat, "save_player_data", lambda player_id, data: store.__setitem__(player_id, data))
+    return store
+
+
+def _message(player_id):
+    return SimpleNamespace(from_user=SimpleNamespace(id=player_id), chat=SimpleNamespace(id=player_id))
+
+
+def test_auto_battle_adds_loot_to_inventory(combat, players):
+    system = combat.CombatSystem()
+    for mob in system.mob_templates.values():
+        mob["loot_chance"] = 1.0
+    players[1] = {
+        "stats": {"hp": 1000, "max_hp": 1000, "attack": 200, "defense": 200,
+                  "crit_chance": 0.0, "xp": 0, "gold": 0},
+        "inventory": {"leather": 2},
+    }
+
+    system.auto_battle(_Bot(), _message(1), 3)
+
+    inventory = players[1]["inventory"]
+    assert sum(inventory.values()) == 2 + 3
+    assert set(inventory) <= {"leather", "wolf_fang"}
+
+
+def test_combat_turn_renders_message_through_outbox(combat):
+    system = combat.CombatSystem()
+    mob = {"name": "Лесной волк", "hp": 500, "attack": 10, "defense": 5}
+    system.sessions.start(1, mob, False, {"hp": 100, "attack": 20, "defense": 5})
+    bot = _Bot()
+    call = SimpleNamespace(id="call", from_user=SimpleNamespace(id=1),
+                           message=SimpleNamespace(chat=SimpleNamespace(id=10), message_id=20))
+
+    system.process_combat_action(bot, call, "defend")
+    assert system.outbox.flush(timeout=5)
+    system.outbox.stop()
+
+    assert bot.answered == [None]
+    [edit] = bot.edited
+    assert (edit["chat_id"], edit["message_id"]) == (10, 20)
+    assert "Вы приготовились к защите" in edit["text"]
+    assert "Ход 2. Выберите действие:" in edit["text"]
+    buttons = [button.callback_data for row in edit["reply_markup"].keyboard for button in row]
+    assert buttons == ["combat_attack", "combat_defend", "combat_potion", "combat_flee"]
@@ -0,0 +1,76 @@
+import json
+import time
+
+from combat_effects import EffectBook
+from combat_sessions import CombatSessionStore
+
+MOB = {"name": "Лесной волк", "hp": 50, "attack": 10, "defense": 5}
+STATS = {"hp": 100, "attack": 20, "defense": 5}
+
+
+def _snapshot(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_idle_change_is_snapshotted_by_background_thread(tmp_path):
+    path = str(tmp_path / "combat_sessions.json")
+    store = CombatSessionStore(snapshot_path=path, snapshot_interval=0.05)
+    # Первое изменение сразу после создания снимок не пишет: интервал не прошел
+    store.start(1, MOB, False, STATS)
+
+    deadline = time.monotonic() + 5
+    while not (tmp_path / "combat_sessions.json").exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    store.close()
+
+    assert [session["player_id"] for session in _snapshot(path)] == [1]
+
+
+def test_close_writes_pending_changes(tmp_path):
+    path = str(tmp_path / "combat_sessions.json")
+    store = CombatSessionStore(snapshot_path=path, snapshot_interval=3600)
+    store.start(1, MOB, False, STATS)
+    store.start(2, MOB, True, STATS)
+    store.end(1)
+
+    store.close()
+
+    assert [session["player_id"] for session in _snapshot(path)] == [2]
+    restored = CombatSessionStore(snapshot_path=path)
+    assert restored.get(2).is_boss
+    restored.close()
+
+
+def test_effects_survive_reordered_definitions(tmp_path):
+    path = str(tmp_path / "combat_sessions.json")
+    book = EffectBook({"poison": {"name": "Яд", "duration": 3}, "stun": {"name": "Оглушение", "duration": 2}})
+    store = CombatSessionStore(snapshot_path=path, effects=book)
+    session = store.start(1, MOB, False, STATS)
+    session.player_effects.add(book, book.index["stun"])
+    session.mob_effects.add(book, book.index["poison"])
+    store.touch(session)
+    store.close()
+
+    reordered = EffectBook({"bleed": {"name": "Кровотечение"}, "stun": {"name": "Оглушение", "duration": 2}})
+    restored = CombatSessionStore(snapshot_path=path, effects=reordered).get(1)
+
+    assert restored.player_effects.names(reordered) == ["Оглушение"]
+    assert list(restored.player_effects.turns) == [2]
+    assert len(restored.mob_effects) == 0  # яда больше нет в описаниях
+
+
+def test_snapshot_skips_turn_in_progress(tmp_path):
+    path = str(tmp_path / "combat_sessions.json")
+    store = CombatSessionStore(snapshot_path=path, snapshot_interval=3600)
+    session = store.start(1, MOB, False, STATS)
+    session.mob_hp -= 20
+    session.turn += 1
+    store.touch(session)
+
+    # Ход начат, но еще не завершен вызовом touch
+    session.mob_hp -= 20
+    store.close()
+
+    [saved] = _snapshot(path)
+    assert (saved["mob_hp"], saved["turn"]) == (30, 1)
@@ -0,0 +1,19 @@
+import importlib
+
+def test_database_imports_and_creates_tables(tmp_path):
+    database = importlib.import_module("database")
+    db = database.Database(str(tmp_path / "test.db"))
+    db.init_pvp_tables()
+    db.init_raid_tables()
+    db.init_economy_tables()
+
+    db.create_player(1, "Tester")
+    assert db.get_player(1)["name"] == "Tester"
+
+def test_create_guild_returns_id(tmp_path):
+    database = importlib.import_module("database")
+    db = database.Database(str(tmp_path / "test.db"))
+    db.create_player(1, "Leader")
+
+    guild_id = db.create_guild("Guild", "GLD", 1)
+    assert db.get_guild(guild_id)["name"] == "Guild"
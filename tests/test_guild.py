@@ -0,0 +1,155 @@
+import random
+import sqlite3
+import threading
+
+from guild import GuildBankService, GuildManager, GuildRank
+
+
+class _GuildDb:
+    """Только соединение: схема guild_members в Database расходится со схемой GuildManager"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+
+    def get_connection(self):
+        return self.connection
+
+
+def _guild_with_bank(tmp_path):
+    manager = GuildManager(_GuildDb(str(tmp_path / "game.db")))
+    guild = manager.create_guild(1, "Стражи", "GRD")
+    guild.add_member(2, GuildRank.OFFICER)
+    guild.add_member(3, GuildRank.MEMBER)
+    guild.save_guild_data()
+    assert guild.deposit_to_bank(1, "gem", 100)
+    return manager, guild
+
+
+def test_removed_officer_cannot_withdraw_before_save(tmp_path):
+    _, guild = _guild_with_bank(tmp_path)
+
+    guild.remove_member(2)
+
+    assert not guild.withdraw_from_bank(2, "gem", 10)
+    assert guild.bank["gem"].quantity == 100
+
+
+def test_promoted_member_can_withdraw_before_save(tmp_path):
+    _, guild = _guild_with_bank(tmp_path)
+
+    guild.promote_member(3)
+
+    assert guild.withdraw_from_bank(3, "gem", 10)
+    assert guild.bank["gem"].quantity == 90
+
+
+def test_bank_operations_are_committed_immediately(tmp_path):
+    manager, guild = _guild_with_bank(tmp_path)
+    assert guild.withdraw_from_bank(2, "gem", 30)
+
+    # Отдельное соединение видит только закоммиченные данные
+    other = sqlite3.connect(manager.db.db_path)
+    row = other.execute(
+        "SELECT quantity FROM guild_bank WHERE guild_id = ? AND item_id = ?", (guild.guild_id, "gem")
+    ).fetchone()
+    assert row[0] == 70
+    assert other.execute("SELECT COUNT(*) FROM guild_bank_log").fetchone()[0] == 2
+
+
+def test_parallel_deposits_and_withdrawals_keep_balance_consistent(tmp_path):
+    manager, guild = _guild_with_bank(tmp_path)
+    # Половина потоков делит сервис менеджера, остальные - как отдельные процессы со своим сервисом
+    services = [manager.bank_service] * 4 + [GuildBankService(manager.db) for _ in range(4)]
+    results = [[] for _ in services]
+    start = threading.Barrier(len(services))
+
+    def worker(service, out, seed):
+        rng = random.Random(seed)
+        start.wait()
+        for _ in range(50):
+            if rng.random() < 0.4:
+                quantity = rng.randint(1, 5)
+                out.append((quantity, service.deposit(guild.guild_id, 1, "gem", quantity)))
+            else:
+                quantity = rng.randint(1, 20)
+                out.append((-quantity, service.withdraw(guild.guild_id, 2, "gem", quantity)))
+
+    threads = [threading.Thread(target=worker, args=(service, out, seed))
+               for seed, (service, out) in enumerate(zip(services, results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    succeeded = [(delta, after) for out in results for delta, after in out if after is not None]
+    assert any(delta < 0 for delta, _ in succeeded)
+    assert any(after is None for out in results for _, after in out)  # остатка хватило не всем
+    assert all(after >= 0 for _, after in succeeded)
+
+    conn = sqlite3.connect(manager.db.db_path)
+    row = conn.execute(
+        "SELECT quantity FROM guild_bank WHERE guild_id = ? AND item_id = ?", (guild.guild_id, "gem")
+    ).fetchone()
+    assert (row[0] if row else 0) == 100 + sum(delta for delta, _ in succeeded)
+    log = conn.execute("SELECT delta, quantity_after FROM guild_bank_log ORDER BY log_id").fetchall()
+    assert len(log) == 1 + len(succeeded)
+    assert all(after >= 0 for _, after in log)
+    # Журнал - последовательная история: каждый остаток равен предыдущему плюс изменение
+    balance = 0
+    for delta, after in log:
+        balance += delta
+        assert after == balance
+
+
+def test_leaderboard_reconciles_stale_rankings_on_load(tmp_path):
+    manager, guild = _guild_with_bank(tmp_path)
+    guild.add_exp(50)
+    guild.save_guild_data()
+    manager.flush()
+    conn = manager.db.get_connection()
+    conn.execute("UPDATE guild_rankings SET level = 99, exp = 0 WHERE guild_id = ?", (guild.guild_id,))
+    conn.execute("INSERT INTO guild_rankings VALUES (12345, 50, 0, 0, NULL)")
+    conn.commit()
+
+    restarted = GuildManager(manager.db)
+    [entry] = restarted.get_guild_leaderboard()
+
+    assert (entry['guild_id'], entry['level'], entry['exp']) == (guild.guild_id, guild.level, 50)
+    assert entry['total_contribution'] == guild.total_contribution
+
+
+def test_manager_flushes_leaderboard_at_exit(tmp_path, monkeypatch):
+    hooks = []
+    monkeypatch.setattr("guild.atexit.register", hooks.append)
+    manager, guild = _guild_with_bank(tmp_path)
+    guild.add_exp(50)
+    assert manager.leaderboard._dirty
+
+    for hook in hooks:
+        hook()
+
+    row = manager.db.get_connection().execute(
+        "SELECT exp FROM guild_rankings WHERE guild_id = ?", (guild.guild_id,)
+    ).fetchone()
+    assert row[0] == 50
+
+
+def test_removed_member_can_join_another_guild_before_save(tmp_path):
+    manager, guild = _guild_with_bank(tmp_path)
+    other = manager.create_guild(10, "Вороны", "RVN")
+
+    assert guild.remove_member(3)
+    assert manager.get_guild_by_member(3) is None
+    assert other.add_member(3)
+    assert manager.get_guild_by_member(3) is other
+
+    guild.save_guild_data()
+    other.save_guild_data()
+    assert manager.get_guild_by_member(3) is other
+    assert manager.member_index[3] == other.guild_id
+
+    guild.remove_member(2)
+    guild.save_guild_data()
+    assert 2 not in manager.member_index
+    assert manager.get_guild_by_member(2) is None
@@ -0,0 +1,51 @@
+import asyncio
+import importlib
+
+import pytest
+
+from database import Database
+
+
+@pytest.fixture
+def pvp(missing_imports):
+    return importlib.import_module("pvp")
+
+
+def _manager(pvp, tmp_path):
+    manager = pvp.PvPManager(Database(str(tmp_path / "game.db")), None)
+    for player_id in range(1, 6):
+        manager.stats.record(player_id, wins=player_id, honor=10 * player_id)
+    manager.stats.flush()
+    return manager
+
+
+def test_result_recorded_mid_rollover_lands_in_new_season(pvp, tmp_path):
+    manager = _manager(pvp, tmp_path)
+
+    async def scenario():
+        rollover = asyncio.create_task(manager.reset_pvp_season("2026-09", chunk_size=2))
+        await asyncio.sleep(0)  # архивирована первая пачка (игроки 1 и 2)
+        manager.stats.record(1, wins=1)
+        manager.stats.record(5, wins=1)
+        await rollover
+
+    asyncio.run(scenario())
+
+    archive = dict(manager.db.get_connection().execute(
+        "SELECT player_id, wins FROM pvp_season_archive WHERE season = '2026-09'"
+    ).fetchall())
+    assert archive == {1: 1, 2: 2, 3: 3, 4: 4, 5: 5}
+    stats = manager.db.get_pvp_stats_for([1, 2, 5])
+    assert (stats[1]['wins'], stats[2]['wins'], stats[5]['wins']) == (1, 0, 1)
+    assert not manager.stats.pending
+
+
+def test_repeated_rollover_of_closed_season_is_rejected(pvp, tmp_path):
+    manager = _manager(pvp, tmp_path)
+    asyncio.run(manager.reset_pvp_season("2026-09"))
+    manager.stats.record(1, wins=1)
+    manager.stats.flush()
+
+    with pytest.raises(ValueError):
+        asyncio.run(manager.reset_pvp_season("2026-09"))
+    assert manager.db.get_pvp_stats_for([1])[1]['wins'] == 1
@@ -0,0 +1,43 @@
+from database import Database
+from pvp_challenges import STATUS_ACTIVE, STATUS_PENDING, DuelRegistry
+
+
+def _registry(tmp_path, clock=lambda: 1000.0):
+    db = Database(str(tmp_path / "game.db"))
+    db.init_pvp_tables()
+    return DuelRegistry(db, clock=clock)
+
+
+def test_claim_is_exclusive_across_registries(tmp_path):
+    registry = _registry(tmp_path)
+    other = DuelRegistry(Database(registry.db.db_path), clock=registry.clock)
+    duel = registry.create(1, 2)
+
+    assert registry.claim(duel.duel_id)
+    assert not other.claim(duel.duel_id)
+    assert registry.db.get_pvp_duel(duel.duel_id)["status"] == STATUS_ACTIVE
+
+
+def test_release_returns_claimed_duel_to_pending(tmp_path):
+    registry = _registry(tmp_path)
+    duel = registry.create(1, 2)
+    assert registry.claim(duel.duel_id)
+
+    registry.release(duel.duel_id)
+
+    assert duel.status == STATUS_PENDING
+    assert registry.db.get_pvp_duel(duel.duel_id)["status"] == STATUS_PENDING
+    assert [d.duel_id for d in registry.get_incoming(2)] == [duel.duel_id]
+    assert registry.claim(duel.duel_id)
+
+
+def test_released_duel_still_expires(tmp_path):
+    now = [1000.0]
+    registry = _registry(tmp_path, clock=lambda: now[0])
+    duel = registry.create(1, 2)
+    registry.claim(duel.duel_id)
+    registry.release(duel.duel_id)
+
+    now[0] += registry.ttl
+    assert [d.duel_id for d in registry.expire()] == [duel.duel_id]
+    assert registry.db.get_pvp_duel(duel.duel_id) is None
@@ -0,0 +1,69 @@
+import asyncio
+import importlib
+
+import pytest
+
+from database import Database
+
+
+class _Player:
+    def __init__(self, user_id, level=50, hp=5000):
+        self.user_id = user_id
+        self.name = f"Игрок {user_id}"
+        self.level = level
+        self.current_hp = hp
+        self.max_hp = hp
+        self.effects = []
+        self.inventory = []
+
+    def take_damage(self, amount):
+        self.current_hp = max(0, self.current_hp - amount)
+
+    def apply_effect(self, effect, duration):
+        self.effects.append((effect, duration))
+
+    def add_to_inventory(self, item_id):
+        self.inventory.append(item_id)
+
+
+@pytest.fixture
+def raid(missing_imports):
+    return importlib.import_module("raid")
+
+
+ROLES = ["tank", "tank", "healer", "healer", "healer", "dps", "dps", "dps", "dps"]
+
+
+def test_join_running_raid_then_end(raid, tmp_path):
+    async def scenario():
+        manager = raid.RaidManager(Database(str(tmp_path / "game.db")), None, None)
+        leader = _Player(1)
+        created = await manager.create_raid(leader, "ancient_dragon", raid.RaidDifficulty.NORMAL)
+        for user_id, role in enumerate(ROLES, start=2):
+            assert await manager.join_raid(created.raid_id, _Player(user_id), role)
+        assert await manager.start_raid(created.raid_id)
+        for _ in range(35):
+            await manager._raid_tick(created)
+        damage_before_join = created.combat_state.damage_done.sum()
+        assert damage_before_join > 0
+
+        newcomer = _Player(100)
+        assert await manager.join_raid(created.raid_id, newcomer, "dps")
+        assert len(created.combat_state.hp) == len(created.members) == 11
+        # Накопленное до входа перенесено в участников старого состава
+        assert sum(m.damage_done for m in created.members) == pytest.approx(damage_before_join)
+
+        await manager._raid_tick(created)
+        await manager._end_raid(created.raid_id, success=False)
+        await manager.result_writer.stop()
+
+        assert created.raid_id not in manager.active_raids
+        assert 100 not in manager.player_raids
+        assert created.members[-1].damage_done > 0
+        return manager
+
+    manager = asyncio.run(scenario())
+    row = manager.db.get_connection().execute(
+        "SELECT COUNT(*) FROM raid_participants"
+    ).fetchone()
+    assert row[0] == 11